@@ -6,6 +6,7 @@ ITPF Advanced Legal Reasoning System
 """
 
 import json
+import os
 import re
 from typing import Dict, Any, List, Tuple, Set, Optional
 from dataclasses import dataclass
@@ -13,6 +14,82 @@ from collections import defaultdict
 import asyncio
 from datetime import datetime
 
+import numpy as np
+
+try:
+    from .legal_corpus import DEFAULT_SOURCE, get_corpus
+    from .passage_index import render_structure
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_corpus import DEFAULT_SOURCE, get_corpus
+    from passage_index import render_structure
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# مصطلحات قانونية مهمة لها وزن أكبر في التشابه الدلالي
+LEGAL_TERMS = {
+    'متسابق', 'نقاط', 'وقت', 'استبعاد', 'عقوبة', 'ثانية', 'دقيقة',
+    'contestant', 'points', 'time', 'disqualification', 'penalty', 'seconds'
+}
+# أقل تشابه تُنشأ عنده علاقة بين مادتين
+RELATION_THRESHOLD = 0.3
+
+
+def graph_id(article: Dict) -> Any:
+    """معرف المادة في خريطة المعرفة (الملاحق تشترك في المعرف "appendix")"""
+    return article.get('article_number', 'appendix')
+
+
+def word_set(text: str) -> Set[str]:
+    """كلمات النص بحروف صغيرة"""
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def set_similarity(words1: Set[str], words2: Set[str]) -> float:
+    """تشابه مجموعتي كلمات مع وزن إضافي للمصطلحات القانونية"""
+    intersection = words1.intersection(words2)
+    union = words1.union(words2)
+    
+    if not union:
+        return 0.0
+    
+    # زيادة الوزن للمصطلحات القانونية
+    weighted_intersection = len(intersection) + 0.5 * len(intersection & LEGAL_TERMS)
+    return weighted_intersection / len(union)
+
+
+def similarity_matrix(word_sets: List[Set[str]]) -> np.ndarray:
+    """set_similarity لكل زوج من المواد دفعة واحدة (مصفوفة n×n)
+
+    Builds the binary term-document matrix once; the pairwise intersections
+    and the legal-term intersections are two matrix products and the union
+    sizes follow from the row sums, so every cell equals set_similarity of
+    that pair. numpy only (scipy is not a dependency): the corpus is small
+    enough for a dense incidence matrix.
+    """
+    vocabulary: Dict[str, int] = {}
+    rows, columns = [], []
+    for row, words in enumerate(word_sets):
+        for word in words:
+            rows.append(row)
+            columns.append(vocabulary.setdefault(word, len(vocabulary)))
+    incidence = np.zeros((len(word_sets), max(1, len(vocabulary))), dtype=np.float32)
+    incidence[rows, columns] = 1.0
+
+    legal_columns = [vocabulary[term] for term in LEGAL_TERMS if term in vocabulary]
+    legal = incidence[:, legal_columns]
+    # float32 counts are exact far beyond any article length
+    intersections = (incidence @ incidence.T).astype(np.float64)
+    legal_intersections = (legal @ legal.T).astype(np.float64)
+    sizes = incidence.sum(axis=1, dtype=np.float64)
+    unions = sizes[:, None] + sizes[None, :] - intersections
+
+    weighted = intersections + 0.5 * legal_intersections
+    similarity = np.zeros_like(weighted)
+    np.divide(weighted, unions, out=similarity, where=unions > 0)
+    return similarity
+
 
 @dataclass
 class LegalEntity:
@@ -52,6 +129,9 @@ class AdvancedLegalReasoning:
         self.legal_entities = {}
         self.cross_references = []
         self.semantic_clusters = {}
+        # المراجع المتقاطعة لكل مادة (مصدراً أو هدفاً) بترتيب cross_references
+        self.adjacency = {}
+        self.graph_info = {}
         
         # مؤشرات العلاقات القانونية
         self.relationship_patterns = {
@@ -87,27 +167,129 @@ class AdvancedLegalReasoning:
                 r'(\d+)\s*نقاط?', r'(\d+)\s*points?'
             ]
         }
+        
+        # تجميع المواد حسب الموضوع (التوقيت، النقاط، العقوبات...)
+        self.cluster_keywords = {
+            'timing': ['وقت', 'ثانية', 'دقيقة', 'مهلة', 'time', 'second', 'minute'],
+            'scoring': ['نقاط', 'درجة', 'تسجيل', 'points', 'score', 'scoring'],
+            'penalties': ['عقوبة', 'استبعاد', 'خصم', 'penalty', 'disqualification'],
+            'exceptions': ['استثناء', 'إلا', 'باستثناء', 'exception', 'except', 'unless']
+        }
 
     def build_knowledge_graph(self, legal_data: Dict[str, Any]) -> None:
-        """بناء خريطة المعرفة القانونية"""
+        """بناء خريطة المعرفة القانونية داخل العملية (load_knowledge_graph تقرأها مبنية مسبقاً)"""
         print("🧠 Building advanced knowledge graph...")
-        
-        all_articles = legal_data.get('articles', []) + legal_data.get('appendices', [])
-        
-        for article in all_articles:
-            article_num = article.get('article_number', 'appendix')
-            content = article.get('content', '')
-            
+        self.apply_graph(self.compute_graph(legal_data))
+
+    def load_knowledge_graph(self, language: str = 'arabic', source: str = DEFAULT_SOURCE) -> None:
+        """تحميل خريطة المعرفة للغة من الملف المبني مسبقاً، أو بناؤها إذا كان غير موجود أو قديماً"""
+        corpus = get_corpus(source)
+        graph = None
+        if os.environ.get('ITPF_GRAPH_ARTIFACT', '1') != '0':
+            try:
+                try:
+                    from .knowledge_graph import load_graph
+                except ImportError:
+                    from knowledge_graph import load_graph
+                graph = load_graph(corpus, language, self)
+            except Exception as e:
+                print(f"Knowledge graph artifact unavailable, building it instead: {str(e)}")
+        if graph is None:
+            print("🧠 Building advanced knowledge graph...")
+            graph = self.compute_graph(corpus.language_data(language))
+        self.apply_graph(graph)
+
+    def compute_graph(self, legal_data: Dict[str, Any]) -> Dict[str, Any]:
+        """الكيانات والمراجع المتقاطعة والتجميعات في شكل قابل للتسلسل
+
+        Every text is rendered, lowercased and tokenized once, all pairwise
+        similarities come from one similarity_matrix(), and the related
+        articles of a source are read from its row once and reused by every
+        relationship pattern it matches. Structured appendix content is rendered to text
+        (passage_index.render_structure) instead of breaking on .lower().
+        """
+        all_articles = list(legal_data.get('articles', [])) + list(legal_data.get('appendices', []))
+        ids = [graph_id(article) for article in all_articles]
+        texts = [render_structure(article.get('content')) for article in all_articles]
+        contents = [text.lower() for text in texts]
+        similarity = similarity_matrix([word_set(content) for content in contents])
+        patterns = self._compiled_patterns()
+        
+        entities = {}
+        edges = []
+        clusters = {}
+        for index, source_num in enumerate(ids):
             # استخراج الكيانات القانونية
-            entities = self._extract_legal_entities(content, article_num)
-            self.legal_entities[article_num] = entities
+            entities[source_num] = [
+                (entity.text, entity.entity_type, entity.value, entity.context, entity.article_refs)
+                for entity in self._extract_legal_entities(texts[index], source_num)
+            ]
             
             # بناء المراجع المتقاطعة
-            cross_refs = self._find_cross_references(article, all_articles)
-            self.cross_references.extend(cross_refs)
+            edges.extend(self._source_edges(index, ids, contents, similarity, patterns))
             
             # تجميع دلالي للمواد المترابطة
-            self._build_semantic_clusters(article, all_articles)
+            for cluster_name, keywords in self.cluster_keywords.items():
+                if any(keyword in contents[index] for keyword in keywords):
+                    clusters.setdefault(cluster_name, []).append(source_num)
+        
+        adjacency = {}
+        for edge_index, (source_num, target_num, _, _, _) in enumerate(edges):
+            adjacency.setdefault(source_num, []).append(edge_index)
+            adjacency.setdefault(target_num, []).append(edge_index)
+        
+        return {
+            'nodes': ids,
+            'entities': entities,
+            'edges': edges,
+            'adjacency': adjacency,
+            'clusters': clusters,
+        }
+
+    def _compiled_patterns(self) -> Dict[str, List[Any]]:
+        return {rel_type: [re.compile(pattern) for pattern in rel_patterns]
+                for rel_type, rel_patterns in self.relationship_patterns.items()}
+
+    def _source_edges(self, index: int, ids: List[Any], contents: List[str], similarity: np.ndarray,
+                      patterns: Dict[str, List[Any]]) -> List[Tuple[Any, Any, str, float, str]]:
+        """مراجع المادة index: لكل نمط علاقة يطابقها، المواد التي يتجاوز تشابهها العتبة"""
+        edges = []
+        related = None
+        for rel_type, rel_patterns in patterns.items():
+            for pattern in rel_patterns:
+                if not pattern.search(contents[index]):
+                    continue
+                # المواد المرتبطة تُحسب مرة واحدة لكل مصدر
+                if related is None:
+                    related = self._related_articles(index, ids, similarity)
+                edges.extend((ids[index], target_num, rel_type, strength, contents[index][:200])
+                             for target_num, strength in related)
+        return edges
+
+    def _related_articles(self, index: int, ids: List[Any], similarity: np.ndarray) -> List[Tuple[Any, float]]:
+        """المواد التي يتجاوز تشابهها مع المادة index عتبة العلاقة (من صف مصفوفة التشابه)"""
+        # حساب قوة العلاقة بناء على التشابه الدلالي
+        candidates = np.flatnonzero(similarity[index] > RELATION_THRESHOLD)  # عتبة العلاقة
+        return [(ids[other], float(similarity[index, other])) for other in candidates
+                if ids[other] != ids[index]]
+
+    def apply_graph(self, graph: Dict[str, Any]) -> None:
+        """استبدال خريطة المعرفة الحالية بخريطة محسوبة أو محملة"""
+        self.legal_entities = {
+            article_num: [LegalEntity(*entity) for entity in entities]
+            for article_num, entities in graph['entities'].items()
+        }
+        self.cross_references = [CrossReference(*edge) for edge in graph['edges']]
+        self.adjacency = {
+            article_num: [self.cross_references[edge_index] for edge_index in edge_indexes]
+            for article_num, edge_indexes in graph['adjacency'].items()
+        }
+        self.semantic_clusters = {name: list(members) for name, members in graph['clusters'].items()}
+        self.graph_info = {
+            'nodes': len(graph['nodes']),
+            'edges': len(self.cross_references),
+            'clusters': {name: len(members) for name, members in self.semantic_clusters.items()},
+        }
 
     def _extract_legal_entities(self, content: str, article_num) -> List[LegalEntity]:
         """استخراج الكيانات القانونية من النص"""
@@ -130,78 +312,16 @@ class AdvancedLegalReasoning:
 
     def _find_cross_references(self, article: Dict, all_articles: List[Dict]) -> List[CrossReference]:
         """العثور على المراجع المتقاطعة بين المواد"""
-        cross_refs = []
-        source_num = article.get('article_number', 'appendix')
-        content = article.get('content', '').lower()
-        
-        for rel_type, patterns in self.relationship_patterns.items():
-            for pattern in patterns:
-                if re.search(pattern, content):
-                    # البحث عن المواد المرتبطة
-                    for other_article in all_articles:
-                        target_num = other_article.get('article_number', 'appendix')
-                        if target_num != source_num:
-                            # حساب قوة العلاقة بناء على التشابه الدلالي
-                            strength = self._calculate_semantic_similarity(
-                                content, other_article.get('content', '').lower()
-                            )
-                            
-                            if strength > 0.3:  # عتبة العلاقة
-                                cross_ref = CrossReference(
-                                    source_article=source_num,
-                                    target_article=target_num,
-                                    relationship_type=rel_type,
-                                    strength=strength,
-                                    context=content[:200]
-                                )
-                                cross_refs.append(cross_ref)
-        
-        return cross_refs
+        contents = [render_structure(item.get('content')).lower() for item in [article] + list(all_articles)]
+        ids = [graph_id(item) for item in [article] + list(all_articles)]
+        similarity = similarity_matrix([word_set(content) for content in contents])
+        return [CrossReference(*edge) for edge in self._source_edges(0, ids, contents, similarity,
+                                                                     self._compiled_patterns())]
 
     def _calculate_semantic_similarity(self, text1: str, text2: str) -> float:
         """حساب التشابه الدلالي بين النصوص"""
         # خوارزمية مبسطة للتشابه الدلالي
-        words1 = set(re.findall(r'\w+', text1.lower()))
-        words2 = set(re.findall(r'\w+', text2.lower()))
-        
-        # مصطلحات قانونية مهمة لها وزن أكبر
-        legal_terms = {
-            'متسابق', 'نقاط', 'وقت', 'استبعاد', 'عقوبة', 'ثانية', 'دقيقة',
-            'contestant', 'points', 'time', 'disqualification', 'penalty', 'seconds'
-        }
-        
-        intersection = words1.intersection(words2)
-        union = words1.union(words2)
-        
-        if not union:
-            return 0.0
-        
-        # زيادة الوزن للمصطلحات القانونية
-        weighted_intersection = len(intersection)
-        for term in intersection:
-            if term in legal_terms:
-                weighted_intersection += 0.5
-        
-        return weighted_intersection / len(union)
-
-    def _build_semantic_clusters(self, article: Dict, all_articles: List[Dict]) -> None:
-        """بناء التجميعات الدلالية للمواد"""
-        # تجميع المواد حسب الموضوع (التوقيت، النقاط، العقوبات...)
-        content = article.get('content', '').lower()
-        article_num = article.get('article_number', 'appendix')
-        
-        clusters = {
-            'timing': ['وقت', 'ثانية', 'دقيقة', 'مهلة', 'time', 'second', 'minute'],
-            'scoring': ['نقاط', 'درجة', 'تسجيل', 'points', 'score', 'scoring'],
-            'penalties': ['عقوبة', 'استبعاد', 'خصم', 'penalty', 'disqualification'],
-            'exceptions': ['استثناء', 'إلا', 'باستثناء', 'exception', 'except', 'unless']
-        }
-        
-        for cluster_name, keywords in clusters.items():
-            if any(keyword in content for keyword in keywords):
-                if cluster_name not in self.semantic_clusters:
-                    self.semantic_clusters[cluster_name] = []
-                self.semantic_clusters[cluster_name].append(article_num)
+        return set_similarity(word_set(text1), word_set(text2))
 
     def perform_multi_hop_reasoning(self, question: str, context: List[Dict]) -> List[ReasoningStep]:
         """التفكير المتعدد المراحل لربط المواد"""
@@ -291,8 +411,8 @@ class AdvancedLegalReasoning:
                     relevance_score += 2
             
             if relevance_score > 0:
-                article['computed_relevance'] = relevance_score
-                relevant_articles.append(article)
+                # context items are the shared corpus dicts: annotate a copy
+                relevant_articles.append(dict(article, computed_relevance=relevance_score))
         
         # ترتيب حسب الصلة
         return sorted(relevant_articles, key=lambda x: x.get('computed_relevance', 0), reverse=True)
@@ -300,12 +420,14 @@ class AdvancedLegalReasoning:
     def _find_cross_referenced_articles(self, direct_articles: List[Dict], all_context: List[Dict]) -> List[Dict]:
         """العثور على المواد المترابطة عبر المراجع المتقاطعة"""
         linked_articles = []
+        # a linked article that is also direct keeps its computed relevance
+        direct_by_number = {article.get('article_number'): article for article in direct_articles}
         
         for article in direct_articles:
             article_num = article.get('article_number')
             
-            # البحث عن المراجع المتقاطعة في قاعدة البيانات
-            for cross_ref in self.cross_references:
+            # المراجع المتقاطعة للمادة من قوائم التجاور
+            for cross_ref in self.adjacency.get(article_num, ()):
                 if cross_ref.source_article == article_num or cross_ref.target_article == article_num:
                     # العثور على المادة المرتبطة في السياق
                     target_num = (cross_ref.target_article if cross_ref.source_article == article_num 
@@ -313,9 +435,9 @@ class AdvancedLegalReasoning:
                     
                     for context_article in all_context:
                         if context_article.get('article_number') == target_num:
-                            context_article['cross_ref_type'] = cross_ref.relationship_type
-                            context_article['cross_ref_strength'] = cross_ref.strength
-                            linked_articles.append(context_article)
+                            linked_articles.append(dict(direct_by_number.get(target_num, context_article),
+                                                        cross_ref_type=cross_ref.relationship_type,
+                                                        cross_ref_strength=cross_ref.strength))
         
         return linked_articles
 
@@ -374,9 +496,8 @@ class AdvancedLegalReasoning:
         
         # نقاط للمراجع المتقاطعة
         article_num = article.get('article_number')
-        for cross_ref in self.cross_references:
-            if cross_ref.source_article == article_num or cross_ref.target_article == article_num:
-                base_score += cross_ref.strength * 2.0
+        for cross_ref in self.adjacency.get(article_num, ()):
+            base_score += cross_ref.strength * 2.0
         
         # نقاط للتجميعات الدلالية
         for cluster_name, cluster_articles in self.semantic_clusters.items():
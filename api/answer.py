@@ -4,22 +4,60 @@ ITPF Legal System - Complete DeepSeek Integration
 نظام ITPF القانوني مع تكامل DeepSeek كامل ومتقدم
 """
 
+import copy
 import json
 import os
 import re
-import requests
-from typing import Dict, Any, List, Tuple
+import time
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from http.server import BaseHTTPRequestHandler
 
+try:
+    from .legal_corpus import get_corpus
+    from .hybrid_retrieval import retrieve_sync
+    from .passage_index import excerpt, get_passage_index
+    from .prompt_builder import ContextItem, build_prompt, log_prompt_report
+    from .response_cache import corpus_stamp, response_cache, response_key
+    from .semantic_cache import question_embedding, semantic_cache
+    from .deepseek_client import DeepSeekStreamError, deepseek_client
+    from .deepseek_keys import key_pool, pooled_chat, retryable
+    from .model_router import LOCAL_ROUTE, RouteDecision, model_router
+    from .answer_jobs import answer_jobs
+    from .single_flight import deepseek_flights
+    from .request_state import RequestField
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+    from hybrid_retrieval import retrieve_sync
+    from passage_index import excerpt, get_passage_index
+    from prompt_builder import ContextItem, build_prompt, log_prompt_report
+    from response_cache import corpus_stamp, response_cache, response_key
+    from semantic_cache import question_embedding, semantic_cache
+    from deepseek_client import DeepSeekStreamError, deepseek_client
+    from deepseek_keys import key_pool, pooled_chat, retryable
+    from model_router import LOCAL_ROUTE, RouteDecision, model_router
+    from answer_jobs import answer_jobs
+    from single_flight import deepseek_flights
+    from request_state import RequestField
+
+# هذه النقطة تخدم نموذج المحادثة فقط؛ أسئلة deepseek_reasoner تُخفض إليه
+ANSWER_ROUTES = (LOCAL_ROUTE, 'deepseek_chat')
+
 class ITTPFLegalSystem:
     """نظام ITPF القانوني الكامل مع DeepSeek"""
     
+    # بيانات الطلب الحالي: لكل طلب متزامن قيمته (request_state)
+    last_prompt_report = RequestField()
+    last_cache_hit = RequestField()
+    last_route = RequestField()
+    
     def __init__(self):
         """تهيئة النظام"""
         self.arabic_data = {}
         self.english_data = {}
-        self.deepseek_api_key = None
         self.deepseek_url = "https://api.deepseek.com/v1/chat/completions"
+        self.corpus_stamp = ''
         
         # تحميل قواعد البيانات
         self._load_databases()
@@ -28,19 +66,14 @@ class ITTPFLegalSystem:
         self._initialize_deepseek()
     
     def _load_databases(self):
-        """تحميل قواعد البيانات العربية والإنجليزية"""
+        """تحميل قواعد البيانات العربية والإنجليزية من اللقطة المشتركة"""
         try:
-            script_dir = os.path.dirname(os.path.abspath(__file__))
-            
-            # تحميل البيانات العربية
-            arabic_file = os.path.join(script_dir, 'arabic_legal_rules_complete_authentic.json')
-            with open(arabic_file, 'r', encoding='utf-8') as f:
-                self.arabic_data = json.load(f)
-            
-            # تحميل البيانات الإنجليزية  
-            english_file = os.path.join(script_dir, 'english_legal_rules_complete_authentic.json')
-            with open(english_file, 'r', encoding='utf-8') as f:
-                self.english_data = json.load(f)
+            corpus = get_corpus('complete')
+            self.arabic_data = corpus.arabic
+            self.english_data = corpus.english
+            self.corpus_stamp = corpus_stamp(corpus)
+            # إجابات نسخة سابقة من النصوص لم تعد صالحة
+            response_cache.purge(self.corpus_stamp)
                 
             print(f"✅ قواعد البيانات محملة - عربي: {len(self.arabic_data['articles'])} مادة + {len(self.arabic_data['appendices'])} ملحق")
             print(f"✅ قواعد البيانات محملة - إنجليزي: {len(self.english_data['articles'])} مادة + {len(self.english_data['appendices'])} ملحق")
@@ -49,42 +82,13 @@ class ITTPFLegalSystem:
             print(f"❌ خطأ في تحميل قواعد البيانات: {str(e)}")
     
     def _initialize_deepseek(self):
-        """تهيئة مفاتيح DeepSeek API من بيئة Vercel"""
-        # قائمة بجميع المفاتيح المحتملة في بيئة Vercel
-        potential_keys = [
-            'DEEPSEEK_API_KEY',
-            'DEEPSEEK_API_KEY_1', 
-            'DEEPSEEK_API_KEY_2',
-            'DEEPSEEK_API_KEY_3',
-            'deepseek_api_key',
-            'DEEPSEEK_TOKEN',
-            'deepseek_token'
-        ]
-        
+        """تهيئة مفاتيح DeepSeek API من المجمع المشترك (يقرأ بيئة Vercel مرة واحدة)"""
         print("🔍 البحث عن مفاتيح DeepSeek في بيئة Vercel...")
+        for slot in key_pool.slots:
+            print(f"✅ تم العثور على مفتاح DeepSeek صحيح: {slot.name}")
+            print(f"🔑 طول المفتاح: {len(slot.value)} - المقطع الأول: {slot.value[:12]}...")
         
-        # محاولة قراءة كل مفتاح من البيئة
-        for key_name in potential_keys:
-            try:
-                value = os.environ.get(key_name, '').strip()
-                if value and len(value) > 20 and value.startswith('sk-'):
-                    self.deepseek_api_key = value
-                    print(f"✅ تم العثور على مفتاح DeepSeek صحيح: {key_name}")
-                    print(f"🔑 طول المفتاح: {len(value)} - المقطع الأول: {value[:12]}...")
-                    return
-                elif value:
-                    print(f"⚠️ مفتاح غير صحيح في {key_name}: طول={len(value)}, يبدأ بـ sk-={value.startswith('sk-') if value else False}")
-            except Exception as e:
-                print(f"❌ خطأ في قراءة {key_name}: {str(e)}")
-        
-        # طباعة جميع متغيرات البيئة للتشخيص (فقط في التطوير)
-        all_env_vars = {k: v[:10] + "..." if len(v) > 10 else v for k, v in os.environ.items() if 'deepseek' in k.lower() or 'api' in k.lower()}
-        if all_env_vars:
-            print(f"🔍 متغيرات البيئة ذات الصلة: {list(all_env_vars.keys())}")
-        else:
-            print("❌ لم يتم العثور على أي مفاتيح API في بيئة Vercel!")
-            
-        if not self.deepseek_api_key:
+        if not len(key_pool):
             print("❌ تعذر العثور على مفتاح DeepSeek API صحيح في بيئة Vercel!")
             print("💡 تأكد من إضافة مفتاح DeepSeek في إعدادات Environment Variables في Vercel")
     
@@ -93,37 +97,50 @@ class ITTPFLegalSystem:
         data = self.arabic_data if language == 'arabic' else self.english_data
         results = []
         
-        # تحويل السؤال إلى كلمات مفتاحية
-        keywords = self._extract_keywords(question, language)
+        keywords = self._query_terms(question, language)
         
-        # البحث في المواد القانونية
-        for article in data['articles']:
-            score = self._calculate_relevance(question, keywords, article['content'], language)
-            if score > 0:
+        # ترتيب BM25F للمواد والملاحق معاً، مدمجاً مع البحث الدلالي إن كان النموذج محملاً
+        for ranked in retrieve_sync(question, language, k=10, terms=keywords, data={language: data}):
+            score = round(ranked.score, 3)
+            if ranked.kind == 'article':
+                article = ranked.item
                 results.append({
+                    'doc_id': ranked.doc.doc_id,
                     'type': 'article',
                     'article_number': article['article_number'],
                     'title': article.get('title', f'المادة {article["article_number"]}'),
                     'content': article['content'][:500],  # أول 500 حرف
-                    'score': score
+                    'score': score,
+                    'score_breakdown': ranked.breakdown()
                 })
-        
-        # البحث في الملاحق
-        for appendix in data['appendices']:
-            score = self._calculate_relevance(question, keywords, str(appendix['content']), language)
-            if score > 0:
+            else:
+                appendix = ranked.item
                 results.append({
+                    'doc_id': ranked.doc.doc_id,
                     'type': 'appendix', 
                     'appendix_number': appendix['appendix_number'],
                     'title': appendix.get('title', f'ملحق {appendix["appendix_number"]}'),
                     'content': str(appendix['content'])[:500],
-                    'score': score
+                    'score': score,
+                    'score_breakdown': ranked.breakdown()
                 })
         
-        # ترتيب النتائج حسب الصلة
-        results.sort(key=lambda x: x['score'], reverse=True)
-        
-        return results[:10]  # أفضل 10 نتائج
+        return results  # أفضل 10 نتائج
+    
+    def _query_terms(self, question: str, language: str) -> List[str]:
+        """تحويل السؤال إلى كلمات مفتاحية (الأرقام مهمة للمواد والجزاءات)"""
+        keywords = self._extract_keywords(question, language)
+        keywords.extend(re.findall(r'\d+', question))
+        return keywords
+    
+    def _context_passages(self, question: str, legal_context: List[Dict[str, Any]], language: str) -> Dict[int, str]:
+        """أنسب مقاطع كل نتيجة ضمن ميزانية الرموز بدلاً من أول 500 حرف"""
+        data = self.arabic_data if language == 'arabic' else self.english_data
+        doc_ids = [item['doc_id'] for item in legal_context if 'doc_id' in item]
+        if not data or not doc_ids:
+            return {}
+        selected = get_passage_index(data).select(self._query_terms(question, language), doc_ids)
+        return {doc_id: '\n...\n'.join(passage.text for passage in passages) for doc_id, passages in selected.items()}
     
     def _extract_keywords(self, text: str, language: str) -> List[str]:
         """استخراج الكلمات المفتاحية"""
@@ -139,52 +156,153 @@ class ITTPFLegalSystem:
         
         return list(set(keywords))
     
-    def _calculate_relevance(self, question: str, keywords: List[str], content: str, language: str) -> float:
-        """حساب درجة الصلة"""
-        score = 0.0
-        content_lower = content.lower()
-        question_lower = question.lower()
-        
-        # تطابق مباشر مع السؤال
-        if any(word in content_lower for word in question_lower.split() if len(word) > 2):
-            score += 10.0
+    def _context_ids(self, legal_context: List[Dict[str, Any]]) -> List[str]:
+        """معرفات المراجع المرسلة إلى DeepSeek"""
+        return [f"{item['type']}:{item.get('article_number') or item.get('appendix_number')}"
+                for item in legal_context[:5]]
+    
+    def _response_key(self, question: str, legal_context: List[Dict[str, Any]], language: str) -> str:
+        """مفتاح ذاكرة الإجابات: السؤال الموحد والمراجع المرسلة ونسخة النصوص"""
+        return response_key(question, language, 'answer', self._context_ids(legal_context), self.corpus_stamp)
+    
+    def _cached_response(self, question: str, legal_context: List[Dict[str, Any]], language: str,
+                         force_refresh: bool = False) -> Tuple[Optional[str], str, Optional[Any]]:
+        """الإجابة المحفوظة للسؤال نفسه أو لسؤال مشابه، مع مفتاح الذاكرة وتمثيل السؤال"""
+        cache_key = self._response_key(question, legal_context, language)
+        cached = None if force_refresh else response_cache.get(cache_key)
+        if cached is not None:
+            print("⚡ إجابة DeepSeek من الذاكرة المؤقتة")
+            self.last_cache_hit = {'type': 'exact', 'confidence': 1.0}
+            return cached, cache_key, None
+        
+        # سؤال بصياغة أخرى سبقت الإجابة عنه
+        embedding = question_embedding(question, language)
+        if embedding is not None and not force_refresh:
+            hit = semantic_cache.lookup(embedding, question, language, 'answer', self.corpus_stamp,
+                                        self._context_ids(legal_context))
+            if hit is not None:
+                print(f"⚡ إجابة DeepSeek لسؤال مشابه (تشابه {hit.confidence:.3f})")
+                self.last_cache_hit = hit.info()
+                return hit.answer, cache_key, embedding
+        return None, cache_key, embedding
+    
+    def _remember_response(self, cache_key: str, embedding: Optional[Any], question: str, language: str,
+                           references: List[str], ai_response: str) -> None:
+        """حفظ إجابة DeepSeek الناجحة في الذاكرتين"""
+        response_cache.put(cache_key, ai_response, self.corpus_stamp)
+        if embedding is not None:
+            semantic_cache.store(embedding, question, language, 'answer', self.corpus_stamp, references, ai_response)
+    
+    def _remote_answer(self, payload: Dict[str, Any], timeout: float, cache_key: str, embedding: Optional[Any],
+                       question: str, language: str, references: List[str]) -> Optional[str]:
+        """طلب DeepSeek عبر مجمع المفاتيح؛ الإجابة الناجحة تُحفظ في الذاكرة وإلا None
+
+        Identical questions in flight at the same time share one request:
+        cache_key (normalized question, references sent and corpus version)
+        determines the prompt, so it is the coalescing key.
+        """
+        # كل محاولات المفاتيح معاً ضمن ميزانية المسار
+        deadline = time.perf_counter() + timeout
+        
+        def call() -> Optional[str]:
+            print("🤖 استدعاء DeepSeek API...")
+            
+            # أنسب مفتاح سليم من المجمع، والعميل المشترك يعيد استخدام اتصال TLS المفتوح
+            response = pooled_chat(payload, timeout=30, url=self.deepseek_url, deadline=deadline)
             
-        # تطابق الكلمات المفتاحية
-        for keyword in keywords:
-            if keyword in content_lower:
-                score += 5.0
-        
-        # تطابق الأرقام (مهم للمواد والجزاءات)
-        numbers_in_question = re.findall(r'\d+', question)
-        numbers_in_content = re.findall(r'\d+', content)
-        common_numbers = set(numbers_in_question) & set(numbers_in_content)
-        score += len(common_numbers) * 15.0
-        
-        return score
+            if response is None:
+                print("❌ لا يوجد مفتاح DeepSeek متاح حالياً")
+            elif response.status_code == 200:
+                result = response.json()
+                if 'choices' in result and len(result['choices']) > 0:
+                    ai_response = result['choices'][0]['message']['content']
+                    print(f"✅ DeepSeek نجح: {len(ai_response)} حرف")
+                    self._remember_response(cache_key, embedding, question, language, references, ai_response)
+                    return ai_response
+                print(f"❌ استجابة DeepSeek غير صحيحة: {result}")
+            else:
+                print(f"❌ خطأ DeepSeek API {response.status_code}: {response.text}")
+            return None
+        
+        ai_response, shared = deepseek_flights.do(f"answer:{cache_key}", call, timeout)
+        if shared:
+            print("🔗 إجابة DeepSeek مشتركة مع طلب مطابق جارٍ")
+        return ai_response
     
-    def generate_deepseek_response(self, question: str, legal_context: List[Dict[str, Any]], language: str) -> str:
-        """توليد إجابة ذكية باستخدام DeepSeek"""
+    def generate_deepseek_response(self, question: str, legal_context: List[Dict[str, Any]], language: str,
+                                   force_refresh: bool = False) -> str:
+        """توليد إجابة على المسار الذي يختاره الموجه (force_refresh يتجاوز الذاكرة المؤقتة ويحدّثها)
+
+        Definitional and lookup questions are answered locally; the others
+        go to DeepSeek within the route's latency budget and fall back to the
+        local answer on timeout or failure. The decision is in self.last_route.
+        """
+        started = time.perf_counter()
+        decision = model_router.decide(question, allowed=ANSWER_ROUTES)
+        self.last_route = decision
         
-        # إعادة محاولة تهيئة المفتاح إذا لم يكن متاحاً
-        if not self.deepseek_api_key:
-            self._initialize_deepseek()
+        if decision.route != LOCAL_ROUTE:
+            cached, cache_key, embedding = self._cached_response(question, legal_context, language, force_refresh)
+            if cached is not None:
+                model_router.record(decision, decision.route, started, [(decision.route, 'cached')])
+                return cached
         
-        if not self.deepseek_api_key:
-            print("🔄 إعادة محاولة قراءة مفاتيح DeepSeek من البيئة...")
-            return self._generate_fallback_response(question, legal_context, language)
+        def remote(route: str, timeout: float) -> Optional[str]:
+            payload = self._deepseek_payload(question, legal_context, language)
+            return self._remote_answer(payload, timeout, cache_key, embedding, question, language,
+                                       self._context_ids(legal_context))
         
-        try:
-            # إعداد السياق القانوني لـ DeepSeek
-            context_text = ""
-            for item in legal_context[:5]:  # أفضل 5 نتائج
-                if item['type'] == 'article':
-                    context_text += f"المادة {item['article_number']}: {item['title']}\n{item['content']}\n\n"
+        return model_router.run_sync(decision, remote,
+                                     lambda: self._generate_fallback_response(question, legal_context, language))
+    
+    def _stream_deepseek(self, payload: Dict[str, Any], timeout: float = 30) -> Iterator[str]:
+        """بث DeepSeek بمفاتيح المجمع: ينتقل للمفتاح التالي ما دام لم يصل أي جزء"""
+        error = "No healthy DeepSeek API key"
+        for _ in range(max(1, len(key_pool))):
+            lease = key_pool.acquire()
+            if lease is None:
+                break
+            sent = False
+            outcome = None
+            try:
+                for delta in deepseek_client.stream_chat(payload, lease.key, timeout=timeout, url=self.deepseek_url):
+                    sent = True
+                    yield delta
+                outcome = {'status_code': 200}
+            except DeepSeekStreamError as e:
+                outcome = {'status_code': e.status_code, 'error': str(e), 'retry_after': e.retry_after}
+            except Exception as e:
+                outcome = {'error': str(e)}
+            finally:
+                # outcome is None when the reader closed the stream midway
+                if outcome is None:
+                    key_pool.cancel(lease)
                 else:
-                    context_text += f"ملحق {item['appendix_number']}: {item['title']}\n{item['content']}\n\n"
-            
-            # إعداد البرومبت للغة المحددة
-            if language == 'arabic':
-                system_prompt = """أنت خبير قانوني متخصص في قوانين الاتحاد الدولي لالتقاط الأوتاد (ITPF). 
+                    key_pool.release(lease, **outcome)
+            if outcome.get('status_code') == 200:
+                return
+            error = outcome['error']
+            if sent or not retryable(outcome.get('status_code')):
+                break
+        raise RuntimeError(error)
+    
+    def _deepseek_payload(self, question: str, legal_context: List[Dict[str, Any]], language: str) -> Dict[str, Any]:
+        """طلب DeepSeek: السياق من أنسب المقاطع والبرومبت ضمن ميزانية الرموز"""
+        # إعداد السياق القانوني لـ DeepSeek من أنسب المقاطع
+        passages = self._context_passages(question, legal_context[:5], language)
+        context_items = []
+        for item in legal_context[:5]:  # أفضل 5 نتائج
+            # documents left out by the passage budget are dropped by the prompt builder
+            content = passages.get(item.get('doc_id'), '') if passages else item['content']
+            if item['type'] == 'article':
+                label = f"المادة {item['article_number']}: {item['title']}"
+            else:
+                label = f"ملحق {item['appendix_number']}: {item['title']}"
+            context_items.append(ContextItem(label, content, item['score']))
+        
+        # إعداد البرومبت للغة المحددة
+        if language == 'arabic':
+            system_prompt = """أنت خبير قانوني متخصص في قوانين الاتحاد الدولي لالتقاط الأوتاد (ITPF). 
 
 ## مهمتك:
 1. تحليل السؤال القانوني بعمق ودقة
@@ -217,16 +335,16 @@ class ITTPFLegalSystem:
 ### 🎯 **القرار النهائي:**
 - **الحكم:** [القرار المحدد]
 - **الأساس القانوني:** المواد [أرقام المواد]"""
-                
-                user_prompt = f"""السؤال: {question}
+            
+            user_template = """السؤال: {question}
 
 المراجع القانونية المتاحة:
-{context_text}
+{context}
 
 المطلوب: تحليل قانوني محدد ومفصل للسؤال، مع ذكر المواد القانونية ذات الصلة."""
-                
-            else:
-                system_prompt = """You are a legal expert specialized in the International Tent Pegging Federation (ITPF) rules.
+            
+        else:
+            system_prompt = """You are a legal expert specialized in the International Tent Pegging Federation (ITPF) rules.
 
 ## Your task:
 1. Analyze the legal question thoroughly and accurately
@@ -259,53 +377,29 @@ Use this exact formatting:
 ### 🎯 **Final Decision:**
 - **Ruling:** [Specific Decision]
 - **Legal Basis:** Articles [article numbers]"""
-                
-                user_prompt = f"""Question: {question}
+            
+            user_template = """Question: {question}
 
 Available Legal References:
-{context_text}
+{context}
 
 Required: Specific and detailed legal analysis of the question, citing relevant legal articles."""
-            
-            # إرسال الطلب إلى DeepSeek
-            payload = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                "temperature": 0.3,
-                "max_tokens": 800
-            }
-            
-            headers = {
-                "Authorization": f"Bearer {self.deepseek_api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            print(f"🤖 استدعاء DeepSeek API...")
-            
-            response = requests.post(self.deepseek_url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    ai_response = result['choices'][0]['message']['content']
-                    print(f"✅ DeepSeek نجح: {len(ai_response)} حرف")
-                    return ai_response
-                else:
-                    print(f"❌ استجابة DeepSeek غير صحيحة: {result}")
-                    return self._generate_fallback_response(question, legal_context, language)
-            else:
-                print(f"❌ خطأ DeepSeek API {response.status_code}: {response.text}")
-                return self._generate_fallback_response(question, legal_context, language)
-                
-        except Exception as e:
-            print(f"❌ خطأ DeepSeek: {str(e)}")
-            return self._generate_fallback_response(question, legal_context, language)
+        
+        # تجميع البرومبت ضمن ميزانية الرموز
+        prompt = build_prompt(system_prompt, question, context_items, user_template, mode='answer')
+        self.last_prompt_report = prompt.report.to_dict()
+        log_prompt_report(prompt.report)
+        
+        return {
+            "model": "deepseek-chat",
+            "messages": prompt.messages,
+            "temperature": 0.3,
+            "max_tokens": prompt.report.max_output_tokens
+        }
     
     def _generate_fallback_response(self, question: str, legal_context: List[Dict[str, Any]], language: str) -> str:
-        """توليد إجابة احتياطية عند فشل DeepSeek"""
+        """الإجابة المحلية: مسار local_fast، والبديل عند فشل DeepSeek أو تجاوز ميزانية الزمن"""
+        terms = self._query_terms(question, language)
         if language == 'arabic':
             response = "## الخلاصة القانونية\n\n"
             response += "بناءً على تحليل القوانين المتاحة:\n\n"
@@ -313,10 +407,10 @@ Required: Specific and detailed legal analysis of the question, citing relevant
             for i, item in enumerate(legal_context[:3], 1):
                 if item['type'] == 'article':
                     response += f"**{i}. المادة {item['article_number']}**: {item['title']}\n"
-                    response += f"   {item['content'][:200]}...\n\n"
+                    response += f"   {excerpt(item['content'], terms, 200)}\n\n"
                 else:
                     response += f"**{i}. ملحق {item['appendix_number']}**: {item['title']}\n"
-                    response += f"   {item['content'][:200]}...\n\n"
+                    response += f"   {excerpt(item['content'], terms, 200)}\n\n"
             
             return response
         else:
@@ -326,23 +420,15 @@ Required: Specific and detailed legal analysis of the question, citing relevant
             for i, item in enumerate(legal_context[:3], 1):
                 if item['type'] == 'article':
                     response += f"**{i}. Article {item['article_number']}**: {item['title']}\n"
-                    response += f"   {item['content'][:200]}...\n\n"
+                    response += f"   {excerpt(item['content'], terms, 200)}\n\n"
                 else:
                     response += f"**{i}. Appendix {item['appendix_number']}**: {item['title']}\n"
-                    response += f"   {item['content'][:200]}...\n\n"
+                    response += f"   {excerpt(item['content'], terms, 200)}\n\n"
             
             return response
 
-    def process_question(self, question: str, language: str = 'arabic') -> Dict[str, Any]:
-        """معالجة السؤال وإرجاع الإجابة الكاملة"""
-        
-        # البحث في المحتوى القانوني
-        legal_context = self.search_legal_content(question, language)
-        
-        # توليد الإجابة الذكية
-        ai_response = self.generate_deepseek_response(question, legal_context, language)
-        
-        # إعداد المراجع القانونية
+    def _references(self, legal_context: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """المراجع القانونية المعروضة مع الإجابة"""
         references = []
         for item in legal_context[:6]:
             ref = {
@@ -350,28 +436,196 @@ Required: Specific and detailed legal analysis of the question, citing relevant
                 'number': item.get('article_number') or item.get('appendix_number'),
                 'title': item['title'], 
                 'content': item['content'][:300],
-                'relevance_score': item['score']
+                'relevance_score': item['score'],
+                'score_breakdown': item['score_breakdown']
             }
             references.append(ref)
+        return references
+    
+    def _metadata(self, question: str, language: str, legal_context: List[Dict[str, Any]]) -> Dict[str, Any]:
+        return {
+            'question': question,
+            'language': language,
+            'references_found': len(legal_context),
+            'deepseek_used': len(key_pool) > 0,
+            'prompt_tokens': self.last_prompt_report,
+            'cached_response': self.last_cache_hit is not None,
+            'cache': self.last_cache_hit,
+            'route': self.last_route.to_dict() if self.last_route else None,
+            'articles_count': len(self.arabic_data['articles']),
+            'appendices_count': len(self.arabic_data['appendices'])
+        }
+    
+    def process_question(self, question: str, language: str = 'arabic', force_refresh: bool = False) -> Dict[str, Any]:
+        """معالجة السؤال وإرجاع الإجابة الكاملة"""
+        
+        # البحث في المحتوى القانوني
+        legal_context = self.search_legal_content(question, language)
+        
+        # توليد الإجابة الذكية
+        self.last_prompt_report = None
+        self.last_cache_hit = None
+        self.last_route = None
+        ai_response = self.generate_deepseek_response(question, legal_context, language, force_refresh)
         
         return {
             'success': True,
             'legal_analysis': ai_response,
-            'legal_references': references,
-            'metadata': {
-                'question': question,
-                'language': language,
-                'references_found': len(legal_context),
-                'deepseek_used': bool(self.deepseek_api_key),
-                'articles_count': len(self.arabic_data['articles']),
-                'appendices_count': len(self.arabic_data['appendices'])
-            }
+            'legal_references': self._references(legal_context),
+            'metadata': self._metadata(question, language, legal_context)
+        }
+    
+    def speculative_question(self, question: str, language: str = 'arabic',
+                             force_refresh: bool = False) -> Dict[str, Any]:
+        """الإجابة الاستباقية: الإجابة المحلية فوراً ومهمة خلفية لتحليل DeepSeek
+
+        Returns the process_question() result with the local answer at
+        retrieval time. Questions routed to DeepSeek, and not already cached,
+        also get a 'job' ({'id', 'status', 'poll'}); the job's result holds
+        the DeepSeek analysis, or legal_analysis None when it failed and the
+        local answer stands.
+        """
+        legal_context = self.search_legal_content(question, language)
+        self.last_prompt_report = None
+        self.last_cache_hit = None
+        self.last_route = None
+        
+        started = time.perf_counter()
+        decision = model_router.decide(question, allowed=ANSWER_ROUTES)
+        self.last_route = decision
+        job = None
+        if decision.route == LOCAL_ROUTE:
+            ai_response = self._generate_fallback_response(question, legal_context, language)
+            model_router.record(decision, LOCAL_ROUTE, started, [(LOCAL_ROUTE, 'ok')])
+        else:
+            ai_response, cache_key, embedding = self._cached_response(question, legal_context, language, force_refresh)
+            if ai_response is not None:
+                model_router.record(decision, decision.route, started, [(decision.route, 'cached')])
+            else:
+                ai_response = self._generate_fallback_response(question, legal_context, language)
+                # البرومبت يُبنى هنا لا في الخلفية: last_prompt_report لهذا الطلب
+                payload = self._deepseek_payload(question, legal_context, language)
+                # the job records its own attempts; this request's metadata keeps the speculative decision
+                job = answer_jobs.submit(self._upgrade_answer, payload, copy.deepcopy(decision), cache_key,
+                                         embedding, question, language, self._context_ids(legal_context))
+        
+        metadata = self._metadata(question, language, legal_context)
+        metadata['speculative'] = job is not None
+        result = {
+            'success': True,
+            'legal_analysis': ai_response,
+            'legal_references': self._references(legal_context),
+            'metadata': metadata
+        }
+        if job is not None:
+            result['job'] = {'id': job.id, 'status': job.status, 'poll': f"/api/answer?job={job.id}"}
+        return result
+    
+    def _upgrade_answer(self, payload: Dict[str, Any], decision: RouteDecision, cache_key: str,
+                        embedding: Optional[Any], question: str, language: str,
+                        references: List[str]) -> Dict[str, Any]:
+        """مهمة الخلفية: تحليل DeepSeek ضمن ميزانية المسار (لا تلمس حالة الطلب الحالي)"""
+        def remote(route: str, timeout: float) -> Optional[str]:
+            return self._remote_answer(payload, timeout, cache_key, embedding, question, language, references)
+        
+        # the local answer was already sent, so the fallback adds nothing
+        ai_response = model_router.run_sync(decision, remote, lambda: None)
+        return {
+            'legal_analysis': ai_response,
+            'upgraded': ai_response is not None,
+            'route': decision.to_dict()
         }
+    
+    def stream_question(self, question: str, language: str = 'arabic',
+                        force_refresh: bool = False) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """معالجة السؤال بالبث: المراجع أولاً ثم أجزاء التحليل فور توليدها
+
+        Yields (event, data) pairs: one 'references', then 'delta' events
+        ({'text': ...}) and a final 'done' with the metadata of
+        process_question(). A DeepSeek failure before the first token is
+        answered with the fallback text; after it, an 'error' event precedes
+        'done' and the partial answer is not cached.
+        """
+        legal_context = self.search_legal_content(question, language)
+        self.last_prompt_report = None
+        self.last_cache_hit = None
+        self.last_route = None
+        yield 'references', {'legal_references': self._references(legal_context)}
+        
+        started = time.perf_counter()
+        decision = model_router.decide(question, allowed=ANSWER_ROUTES)
+        self.last_route = decision
+        if decision.route == LOCAL_ROUTE:
+            yield 'delta', {'text': self._generate_fallback_response(question, legal_context, language)}
+            model_router.record(decision, LOCAL_ROUTE, started, [(LOCAL_ROUTE, 'ok')])
+            yield 'done', {'success': True, 'metadata': self._metadata(question, language, legal_context)}
+            return
+        
+        cached, cache_key, embedding = self._cached_response(question, legal_context, language, force_refresh)
+        if cached is not None:
+            yield 'delta', {'text': cached}
+            model_router.record(decision, decision.route, started, [(decision.route, 'cached')])
+            yield 'done', {'success': True, 'metadata': self._metadata(question, language, legal_context)}
+            return
+        
+        # سؤال مطابق يُبث الآن لعميل آخر: انتظار نصه الكامل بدل طلب جديد
+        flight_key = f"answer:{cache_key}"
+        flight, leader = deepseek_flights.join(flight_key)
+        if not leader:
+            try:
+                shared = deepseek_flights.wait(flight, decision.budget_seconds)
+            except Exception as e:
+                print(f"❌ فشل الطلب المطابق الجاري: {str(e)}")
+                shared = None
+            if shared:
+                print("🔗 إجابة DeepSeek مشتركة مع بث مطابق جارٍ")
+                yield 'delta', {'text': shared}
+                model_router.record(decision, decision.route, started, [(decision.route, 'coalesced')])
+            else:
+                yield 'delta', {'text': self._generate_fallback_response(question, legal_context, language)}
+                model_router.record(decision, LOCAL_ROUTE, started, [(decision.route, 'failed'), (LOCAL_ROUTE, 'ok')])
+            yield 'done', {'success': True, 'metadata': self._metadata(question, language, legal_context)}
+            return
+        
+        parts = []
+        error = None
+        ai_response = None
+        try:
+            payload = self._deepseek_payload(question, legal_context, language)
+            print("🤖 بث إجابة DeepSeek...")
+            # ميزانية المسار حد لانتظار كل جزء من البث
+            for delta in self._stream_deepseek(payload, timeout=min(30, decision.budget_seconds)):
+                parts.append(delta)
+                yield 'delta', {'text': delta}
+            ai_response = ''.join(parts) or None
+        except Exception as e:
+            print(f"❌ خطأ بث DeepSeek: {str(e)}")
+            error = str(e)
+        finally:
+            # also when the client disconnects (GeneratorExit): followers get None
+            deepseek_flights.finish(flight_key, flight, ai_response)
+        
+        if ai_response is not None:
+            print(f"✅ DeepSeek نجح (بث): {len(ai_response)} حرف")
+            self._remember_response(cache_key, embedding, question, language,
+                                    self._context_ids(legal_context), ai_response)
+            model_router.record(decision, decision.route, started, [(decision.route, 'ok')])
+        elif parts:
+            yield 'error', {'error': error}
+            model_router.record(decision, decision.route, started, [(decision.route, 'interrupted')])
+        else:
+            yield 'delta', {'text': self._generate_fallback_response(question, legal_context, language)}
+            model_router.record(decision, LOCAL_ROUTE, started, [(decision.route, 'failed'), (LOCAL_ROUTE, 'ok')])
+        
+        metadata = self._metadata(question, language, legal_context)
+        metadata['streamed'] = bool(parts)
+        yield 'done', {'success': error is None or not parts, 'metadata': metadata}
 
 # إنشاء المثيل العالمي
 itpf_system = ITTPFLegalSystem()
 
 from http.server import BaseHTTPRequestHandler
+from urllib.parse import parse_qs, urlparse
 import json
 
 class handler(BaseHTTPRequestHandler):
@@ -381,10 +635,34 @@ class handler(BaseHTTPRequestHandler):
         """معالجة CORS preflight"""
         self.send_response(200)
         self.send_header('Access-Control-Allow-Origin', '*')
-        self.send_header('Access-Control-Allow-Methods', 'POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
         self.send_header('Access-Control-Allow-Headers', 'Content-Type')
         self.end_headers()
     
+    def do_GET(self):
+        """نتيجة مهمة إجابة استباقية (?job=<id>&wait=<ثوان>)، أو إحصاءات الذاكرة المؤقتة"""
+        params = parse_qs(urlparse(self.path).query)
+        if 'job' in params:
+            try:
+                wait = float(params.get('wait', ['0'])[0])
+            except ValueError:
+                wait = 0.0
+            job = answer_jobs.get(params['job'][0], wait)
+            if job is None:
+                # المهمة في نسخة أخرى من الدالة أو انتهت صلاحيتها: تبقى الإجابة المحلية
+                self.send_error_response({'success': False, 'job': {'id': params['job'][0], 'status': 'unknown'}}, 404)
+                return
+            self.send_success_response({'success': True, 'job': job.to_dict()})
+            return
+        
+        self.send_success_response({
+            'response_cache': response_cache.stats(),
+            'semantic_cache': semantic_cache.stats(),
+            'model_router': model_router.stats(),
+            'answer_jobs': answer_jobs.stats(),
+            'single_flight': deepseek_flights.stats()
+        })
+    
     def do_POST(self):
         """معالجة طلبات POST"""
         try:
@@ -398,13 +676,20 @@ class handler(BaseHTTPRequestHandler):
             
             question = data.get('question', '')
             language = data.get('language', 'arabic')
+            # تجاوز الذاكرة المؤقتة وطلب إجابة جديدة من DeepSeek
+            force_refresh = bool(data.get('force_refresh', False))
+            # "speculative": الإجابة المحلية فوراً وتحليل DeepSeek عبر مهمة خلفية
+            mode = data.get('mode', 'answer')
             
             if not question:
                 self.send_error_response({'error': 'السؤال مطلوب'}, 400)
                 return
             
             # معالجة السؤال بالنظام المتطور
-            result = itpf_system.process_question(question, language)
+            if mode == 'speculative':
+                result = itpf_system.speculative_question(question, language, force_refresh)
+            else:
+                result = itpf_system.process_question(question, language, force_refresh)
             
             # إرسال الاستجابة
             self.send_success_response(result)
@@ -11,49 +11,24 @@ from http.server import BaseHTTPRequestHandler
 from collections import defaultdict
 from dataclasses import dataclass
 
+try:
+    from .legal_corpus import get_corpus
+    from .legal_index import LegalIndex, IndexedDocument
+    from .legal_ranker import get_ranker
+    from .concept_matcher import compile_ontology
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+    from legal_index import LegalIndex, IndexedDocument
+    from legal_ranker import get_ranker
+    from concept_matcher import compile_ontology
+
 
 def load_legal_data():
-    """Load complete legal data - enhanced and comprehensive"""
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load Arabic data with enhanced error handling
-        arabic_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            arabic_file = os.path.join(script_dir, f'arabic_data_part{i}.json')
-            try:
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        arabic_data["appendices"] = part_data.get("appendices", [])
-                    arabic_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading Arabic part {i}: {str(e)}")
-        
-        # Load English data with enhanced error handling
-        english_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            english_file = os.path.join(script_dir, f'english_data_part{i}.json')
-            try:
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        english_data["appendices"] = part_data.get("appendices", [])
-                    if 'chapters' in part_data:
-                        for chapter in part_data['chapters']:
-                            english_data["articles"].extend(chapter.get('articles', []))
-                    else:
-                        english_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading English part {i}: {str(e)}")
-        
-        print(f"Expert System Data Loaded - Arabic: {len(arabic_data['articles'])} articles, {len(arabic_data['appendices'])} appendices")
-        print(f"Expert System Data Loaded - English: {len(english_data['articles'])} articles, {len(english_data['appendices'])} appendices")
-        
-        return arabic_data, english_data
-    except Exception as e:
-        print(f"Critical error loading legal data: {str(e)}")
-        return {}, {}
+    """Load complete legal data from the shared corpus snapshot (parsed once per process)"""
+    corpus = get_corpus()
+    return corpus.arabic, corpus.english
 
 
 @dataclass
@@ -69,6 +44,7 @@ class ExpertLegalAnalyzer:
     
     def __init__(self):
         self.legal_concepts = self._build_legal_ontology()
+        self.concept_matcher = compile_ontology(self.legal_concepts)
         self.article_relationships = {}
         self.regulation_hierarchy = {}
         
@@ -148,11 +124,7 @@ class ExpertLegalAnalyzer:
         terms.update(words)
         
         # إضافة المرادفات والمفاهيم ذات الصلة
-        for concept in self.legal_concepts.values():
-            for term in concept.arabic_terms + concept.english_terms:
-                if term.lower() in question_lower:
-                    terms.update([t.lower() for t in concept.arabic_terms + concept.english_terms])
-                    terms.update([t.lower() for t in concept.related_concepts])
+        terms.update(self.concept_matcher.expand(question_lower))
         
         # معالجة الأرقام والأرقام العربية
         number_mappings = {
@@ -174,11 +146,15 @@ class ExpertLegalAnalyzer:
         semantic_terms = self.extract_semantic_terms(question)
         
         results = []
+        ranker = get_ranker(data)
+        index = ranker.index
+        term_scores, _ = ranker.score_terms(semantic_terms)
         
         # البحث في المقالات
-        for article in data.get('articles', []):
+        for doc in index.articles:
+            article = doc.item
             score = self._calculate_advanced_relevance(
-                article, semantic_terms, intent_analysis, 'article'
+                index, doc, term_scores.get(doc.doc_id, 0.0), intent_analysis, 'article'
             )
             
             if score > 0:
@@ -192,9 +168,10 @@ class ExpertLegalAnalyzer:
                 })
         
         # البحث في الملاحق مع أولوية خاصة
-        for appendix in data.get('appendices', []):
+        for doc in index.appendices:
+            appendix = doc.item
             score = self._calculate_advanced_relevance(
-                appendix, semantic_terms, intent_analysis, 'appendix'
+                index, doc, term_scores.get(doc.doc_id, 0.0), intent_analysis, 'appendix'
             )
             
             # أولوية إضافية للملحق المحدد في السؤال
@@ -221,32 +198,23 @@ class ExpertLegalAnalyzer:
         
         return results[:8]  # إرجاع المزيد من النتائج للتحليل الأعمق
     
-    def _calculate_advanced_relevance(self, item: dict, terms: List[str], 
+    def _calculate_advanced_relevance(self, index: LegalIndex, doc: IndexedDocument, term_score: float, 
                                     intent_analysis: dict, content_type: str) -> float:
         """حساب الصلة المتقدمة مع فهم السياق"""
-        content = str(item.get('content', '')).lower()
-        title = str(item.get('title', '')).lower()
-        
-        score = 0.0
+        def in_content(word: str) -> bool:
+            return index.contains(doc.doc_id, 'content', word)
         
-        # البحث الأساسي في النصوص
-        for term in terms:
-            term_lower = term.lower()
-            if term_lower in content:
-                score += 3.0 if content_type == 'appendix' else 2.0
-            if term_lower in title:
-                score += 4.0 if content_type == 'appendix' else 3.0
+        # درجة BM25F للمصطلحات الدلالية
+        score = term_score
         
-        # تقييم السياق حسب نوع السؤال
-        if intent_analysis['primary_intent'] == 'definition':
-            if any(word in content for word in ['تعريف', 'هو', 'هي', 'عبارة عن']):
-                score += 2.0
-        elif intent_analysis['primary_intent'] == 'specification':
-            if any(word in content for word in ['متر', 'سم', 'ثانية', 'كيلو', 'measurement']):
-                score += 2.0
-        elif intent_analysis['primary_intent'] == 'procedure':
-            if any(word in content for word in ['يجب', 'خطوات', 'طريقة', 'كيفية']):
-                score += 2.0
+        # تقييم السياق حسب نوع السؤال (للنصوص المطابقة فقط)
+        intent_words = {
+            'definition': ['تعريف', 'هو', 'هي', 'عبارة عن'],
+            'specification': ['متر', 'سم', 'ثانية', 'كيلو', 'measurement'],
+            'procedure': ['يجب', 'خطوات', 'طريقة', 'كيفية'],
+        }.get(intent_analysis['primary_intent'], [])
+        if term_score and any(in_content(word) for word in intent_words):
+            score += 2.0
         
         # تقييم إضافي للملاحق في الأسئلة المتخصصة
         if content_type == 'appendix' and intent_analysis['target_appendix']:
@@ -6,141 +6,76 @@ ITPF Legal Answer System - Hybrid AI-powered Q&A Endpoint for Vercel
 import json
 import os
 import re
-import requests
 from typing import Dict, Any, List
-import difflib
 from http.server import BaseHTTPRequestHandler
 from urllib.parse import parse_qs
 
+try:
+    from .legal_corpus import get_corpus
+    from .legal_ranker import get_ranker
+    from .concept_matcher import compile_concept_map
+    from .deepseek_keys import key_pool, pooled_chat
+    from .fuzzy_index import get_fuzzy_index
+    from .passage_index import split_sentences
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+    from legal_ranker import get_ranker
+    from concept_matcher import compile_concept_map
+    from deepseek_keys import key_pool, pooled_chat
+    from fuzzy_index import get_fuzzy_index
+    from passage_index import split_sentences
+
 
 def call_deepseek_api(prompt: str, max_tokens: int = 500) -> str:
     """Call DeepSeek API with intelligent prompt handling"""
     
-    # Get API keys from environment (cycling through 3 keys for load balancing)
-    api_keys = [
-        os.getenv('DEEPSEEK_API_KEY_1'),
-        os.getenv('DEEPSEEK_API_KEY_2'), 
-        os.getenv('DEEPSEEK_API_KEY_3')
-    ]
-    
-    # Filter out None values and placeholder values
-    valid_keys = [key for key in api_keys if key and key != 'your-actual-deepseek-key-here' and key != 'your_actual_key_here']
-    
-    if not valid_keys:
+    if not len(key_pool):
         print("No valid DeepSeek API keys found - using algorithmic fallback")
         return None
     
-    # Try each API key with intelligent rotation
-    for i, api_key in enumerate(valid_keys):
-        try:
-            headers = {
-                "Authorization": f"Bearer {api_key}",
-                "Content-Type": "application/json"
-            }
-            
-            # DeepSeek API endpoint (OpenAI compatible)
-            url = "https://api.deepseek.com/v1/chat/completions"
-            
-            payload = {
-                "model": "deepseek-chat",
-                "messages": [
-                    {
-                        "role": "system",
-                        "content": "أنت قاضٍ ومحلل قانوني متخصص في قواعد الاتحاد الدولي لالتقاط الأوتاد. تقدم إجابات دقيقة ومختصرة وذكية بناء على النصوص المرفقة فقط."
-                    },
-                    {
-                        "role": "user",
-                        "content": prompt
-                    }
-                ],
-                "max_tokens": max_tokens,
-                "temperature": 0.3,
-                "stream": False
+    payload = {
+        "model": "deepseek-chat",
+        "messages": [
+            {
+                "role": "system",
+                "content": "أنت قاضٍ ومحلل قانوني متخصص في قواعد الاتحاد الدولي لالتقاط الأوتاد. تقدم إجابات دقيقة ومختصرة وذكية بناء على النصوص المرفقة فقط."
+            },
+            {
+                "role": "user",
+                "content": prompt
             }
-            
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            
-            if response.status_code == 200:
-                result = response.json()
-                if 'choices' in result and len(result['choices']) > 0:
-                    ai_response = result['choices'][0]['message']['content'].strip()
-                    return ai_response if ai_response else None
-            else:
-                print(f"DeepSeek API error {response.status_code}: {response.text}")
-            
-        except Exception as e:
-            print(f"DeepSeek API error with key {i+1}: {str(e)}")
-            continue
+        ],
+        "max_tokens": max_tokens,
+        "temperature": 0.3,
+        "stream": False
+    }
+    
+    try:
+        # DeepSeek API (OpenAI compatible) through the shared client; the key pool
+        # skips keys with an open circuit breaker and moves on after key errors
+        response = pooled_chat(payload, timeout=30)
+        
+        if response is not None and response.status_code == 200:
+            result = response.json()
+            if 'choices' in result and len(result['choices']) > 0:
+                ai_response = result['choices'][0]['message']['content'].strip()
+                return ai_response if ai_response else None
+        elif response is not None:
+            print(f"DeepSeek API error {response.status_code}: {response.text}")
+        
+    except Exception as e:
+        print(f"DeepSeek API error: {str(e)}")
     
     # If all API keys failed, return None
     return None
 
 
 def load_legal_data():
-    """Load complete legal data from split JSON files"""
-    try:
-        # Get the directory of the current script (api directory)
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load Arabic data from split files
-        arabic_data = {"metadata": {}, "articles": [], "appendices": []}
-        for i in range(1, 4):  # Load parts 1, 2, 3
-            arabic_file = os.path.join(script_dir, f'arabic_data_part{i}.json')
-            try:
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:  # Get metadata and appendices from first part
-                        arabic_data["metadata"] = part_data.get("metadata", {})
-                        arabic_data["appendices"] = part_data.get("appendices", [])
-                    arabic_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading Arabic part {i}: {str(e)}")
-        
-        print(f"Arabic data loaded: {len(arabic_data['articles'])} articles, {len(arabic_data['appendices'])} appendices")
-        
-        # Load English data from split files
-        english_data = {"metadata": {}, "chapters": [], "appendices": []}
-        for i in range(1, 4):  # Load parts 1, 2, 3
-            english_file = os.path.join(script_dir, f'english_data_part{i}.json')
-            try:
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:  # Get metadata and appendices from first part
-                        english_data["metadata"] = part_data.get("metadata", {})
-                        english_data["appendices"] = part_data.get("appendices", [])
-                    english_data["chapters"].extend(part_data.get("chapters", []))
-            except Exception as e:
-                print(f"Error loading English part {i}: {str(e)}")
-        
-        # Extract articles from chapters for easier access
-        all_english_articles = []
-        if english_data["chapters"]:
-            for chapter in english_data["chapters"]:
-                all_english_articles.extend(chapter.get("articles", []))
-        
-        print(f"English data loaded: {len(all_english_articles)} articles, {len(english_data.get('appendices', []))} appendices")
-        
-        # Fallback: Try original files if split files not found
-        if not arabic_data["articles"]:
-            try:
-                with open('arabic_legal_rules_complete_authentic.json', 'r', encoding='utf-8') as f:
-                    arabic_data = json.load(f)
-                    print(f"Fallback Arabic data loaded: {len(arabic_data.get('articles', []))} articles")
-            except Exception as e:
-                print(f"Error loading Arabic fallback data: {str(e)}")
-        
-        if not all_english_articles:
-            try:
-                with open('english_legal_rules_complete_authentic.json', 'r', encoding='utf-8') as f:
-                    english_data = json.load(f)
-                    print(f"Fallback English data loaded")
-            except Exception as e:
-                print(f"Error loading English fallback data: {str(e)}")
-            
-        return arabic_data, english_data
-    except Exception as e:
-        print(f"Critical error loading legal data: {str(e)}")
-        return [], []
+    """Load complete legal data from the shared corpus snapshot (parsed once per process)"""
+    corpus = get_corpus()
+    return corpus.arabic, corpus.english
 
 
 # PHASE 1: COMPREHENSIVE ITPF CONCEPT MAP AND SYNONYMS DICTIONARY
@@ -237,6 +172,9 @@ ITPF_CONCEPT_MAP = {
     }
 }
 
+# compiled once per process: every term, synonym word and context keyword in one automaton
+ITPF_CONCEPT_MATCHER = compile_concept_map(ITPF_CONCEPT_MAP)
+
 def expand_question_with_concepts(question: str) -> list:
     """
     Phase 1 Enhancement: Expand question using ITPF concept mapping and synonyms
@@ -244,55 +182,20 @@ def expand_question_with_concepts(question: str) -> list:
     """
     question_lower = question.lower().strip()
     expanded_terms = []
-    matched_concepts = []
     
     # Add original question terms
     original_terms = re.findall(r'\b[\u0600-\u06FFa-zA-Z]+\b', question_lower)
     expanded_terms.extend([term for term in original_terms if len(term) > 2])
     
-    # Map question to ITPF concepts
-    for concept_name, concept_data in ITPF_CONCEPT_MAP.items():
-        concept_matched = False
-        
-        # Check Arabic terms
-        for term in concept_data["arabic_terms"]:
-            if term.lower() in question_lower:
-                matched_concepts.append(concept_name)
-                expanded_terms.extend(concept_data["arabic_terms"])
-                expanded_terms.extend(concept_data["synonyms"]["arabic"])
-                expanded_terms.extend(concept_data["context_keywords"])
-                concept_matched = True
-                break
-        
-        # Check English terms if not already matched
-        if not concept_matched:
-            for term in concept_data["english_terms"]:
-                if term.lower() in question_lower:
-                    matched_concepts.append(concept_name)
-                    expanded_terms.extend(concept_data["english_terms"])
-                    expanded_terms.extend(concept_data["synonyms"]["english"])
-                    concept_matched = True
-                    break
-        
-        # Check synonyms for partial matches
-        if not concept_matched:
-            for synonym in concept_data["synonyms"]["arabic"]:
-                if any(word in question_lower for word in synonym.split()):
-                    matched_concepts.append(concept_name)
-                    expanded_terms.extend(concept_data["arabic_terms"])
-                    expanded_terms.extend(concept_data["context_keywords"])
-                    break
-    
-    # Add related concepts
-    for matched_concept in matched_concepts:
-        related_concepts = ITPF_CONCEPT_MAP[matched_concept].get("related_concepts", [])
-        for related in related_concepts:
-            if related in ITPF_CONCEPT_MAP:
-                expanded_terms.extend(ITPF_CONCEPT_MAP[related]["arabic_terms"][:2])
-                expanded_terms.extend(ITPF_CONCEPT_MAP[related]["english_terms"][:2])
+    # Map question to ITPF concepts (one pass over the compiled automaton,
+    # expansions already include the related concepts)
+    concept_matches = ITPF_CONCEPT_MATCHER.match(question_lower)
+    matched_concepts = [match.concept for match in concept_matches]
+    for match in concept_matches:
+        expanded_terms.extend(match.terms)
     
     # Remove duplicates and filter
-    unique_terms = list(set([term.lower() for term in expanded_terms if len(term) > 2]))
+    unique_terms = list(dict.fromkeys(term.lower() for term in expanded_terms if len(term) > 2))
     
     print(f"Question expansion - Original: {len(original_terms)} terms, Expanded: {len(unique_terms)} terms")
     print(f"Matched concepts: {matched_concepts}")
@@ -442,7 +345,7 @@ def enhance_search_with_context(question: str, expanded_terms: list, context_ana
     print(f"Enhanced search - Original: {len(expanded_terms)}, Enhanced: {len(unique_enhanced_terms)}")
     return unique_enhanced_terms
 
-def advanced_search_relevant_content(question: str, data: list, language: str) -> list:
+def advanced_search_relevant_content(question: str, data, language: str) -> list:
     """Advanced search algorithm enhanced with ITPF concept mapping and contextual analysis"""
     relevant_articles = []
     
@@ -469,36 +372,30 @@ def advanced_search_relevant_content(question: str, data: list, language: str) -
     
     print(f"Search keywords extracted: {all_keywords}")
     
-    for article in data:
-        # Handle both dict and string formats
-        if isinstance(article, dict):
-            content_text = str(article.get('content', '')).lower()
-            title_text = str(article.get('title', '')).lower()
-            article_number = str(article.get('article_number', ''))
-        else:
-            # Skip invalid articles
-            continue
-        
-        # Calculate relevance score
-        relevance_score = 0
-        matched_keywords = []
+    # Language data (articles + appendices) or a plain list of items; invalid items are skipped by the index
+    ranker = get_ranker(data)
+    index = ranker.index
+    keyword_scores, keyword_matches = ranker.score_terms(keyword for keyword in all_keywords if len(keyword) > 2)  # Ignore very short keywords
+    fuzzy_index = get_fuzzy_index(data)
+    
+    # Fuzzy matching for important terms (close words looked up once per term, not per article)
+    important_terms = ['المشاركة', 'التسجيل', 'النقاط', 'المعدات', 'البطولة', 'القواعد', 'النظام']
+    question_terms = [term for term in important_terms if term in question_lower]
+    fuzzy_docs = set()
+    for term in question_terms:
+        fuzzy_docs |= fuzzy_index.documents_close_to(term)
+    
+    for doc in index.documents:
+        article = doc.item
         
-        # Direct keyword matching
-        for keyword in all_keywords:
-            if len(keyword) > 2:  # Ignore very short keywords
-                if keyword in content_text:
-                    relevance_score += 3
-                    matched_keywords.append(keyword)
-                elif keyword in title_text:
-                    relevance_score += 2
-                    matched_keywords.append(keyword)
+        # BM25F relevance of the keywords
+        relevance_score = round(keyword_scores.get(doc.doc_id, 0.0), 3)
+        matched_keywords = list(keyword_matches.get(doc.doc_id, []))
         
-        # Fuzzy matching for important terms
-        important_terms = ['المشاركة', 'التسجيل', 'النقاط', 'المعدات', 'البطولة', 'القواعد', 'النظام']
-        for term in important_terms:
-            if term in question_lower:
-                # Check for similar terms in content
-                similar_matches = difflib.get_close_matches(term, content_text.split(), n=3, cutoff=0.6)
+        # Check for similar terms in content
+        if doc.doc_id in fuzzy_docs:
+            for term in question_terms:
+                similar_matches = fuzzy_index.close_matches(term, doc.doc_id, n=3, cutoff=0.6)
                 if similar_matches:
                     relevance_score += 1
                     matched_keywords.extend(similar_matches)
@@ -512,13 +409,13 @@ def advanced_search_relevant_content(question: str, data: list, language: str) -
                 response_style = context_analysis["response_style"]
                 
                 # Boost based on response style requirements
-                if response_style == "compliance_focused" and any(compliance_term in content_text for compliance_term in ["يجب", "مطلوب", "ضروري", "must", "required"]):
+                if response_style == "compliance_focused" and any(index.contains(doc.doc_id, 'content', compliance_term) for compliance_term in ["يجب", "مطلوب", "ضروري", "must", "required"]):
                     intent_boost += 2
-                elif response_style == "specification_detailed" and any(spec_term in content_text for spec_term in ["مواصفات", "أبعاد", "قياس", "specifications", "measurements"]):
+                elif response_style == "specification_detailed" and any(index.contains(doc.doc_id, 'content', spec_term) for spec_term in ["مواصفات", "أبعاد", "قياس", "specifications", "measurements"]):
                     intent_boost += 2
-                elif response_style == "step_by_step" and any(proc_term in content_text for proc_term in ["خطوات", "كيفية", "طريقة", "steps", "procedure"]):
+                elif response_style == "step_by_step" and any(index.contains(doc.doc_id, 'content', proc_term) for proc_term in ["خطوات", "كيفية", "طريقة", "steps", "procedure"]):
                     intent_boost += 2
-                elif response_style == "outcome_focused" and any(outcome_term in content_text for outcome_term in ["نتيجة", "فوز", "نقاط", "result", "win", "points"]):
+                elif response_style == "outcome_focused" and any(index.contains(doc.doc_id, 'content', outcome_term) for outcome_term in ["نتيجة", "فوز", "نقاط", "result", "win", "points"]):
                     intent_boost += 2
             
             final_score = relevance_score + intent_boost
@@ -640,7 +537,8 @@ def extract_relevant_sentences(content: str, search_elements: List[str]) -> str:
     if not content or not search_elements:
         return content[:200] + "..." if len(content) > 200 else content
     
-    sentences = content.split('.')
+    # تقسيم الجمل محفوظ لكل نص (لا يُقسم "6.4 ثواني" ولا يُعاد التقسيم في كل طلب)
+    sentences = [content[start:end].rstrip('.') for start, end in split_sentences(content)]
     relevant_sentences = []
     
     # البحث عن الجمل التي تحتوي على عناصر البحث
@@ -980,32 +878,13 @@ class handler(BaseHTTPRequestHandler):
             # Phase 1: Fast Direct Search - Single query for speed
             relevant_articles = []
             if language in ['both', 'arabic'] and arabic_data:
-                # Extract articles and appendices from Arabic data structure
-                if isinstance(arabic_data, dict):
-                    arabic_articles = arabic_data.get('articles', [])
-                    arabic_appendices = arabic_data.get('appendices', [])
-                    # Combine articles and appendices for comprehensive search
-                    arabic_content = arabic_articles + arabic_appendices
-                else:
-                    arabic_content = arabic_data
-                
-                # Single fast search with original question
-                arabic_results = advanced_search_relevant_content(question, arabic_content, 'arabic')
+                # The index covers both articles and appendices of the language data
+                arabic_results = advanced_search_relevant_content(question, arabic_data, 'arabic')
                 relevant_articles.extend(arabic_results)
                 
             if language in ['both', 'english'] and english_data:
-                # Extract articles and appendices from English data structure 
-                english_content = []
-                if isinstance(english_data, dict):
-                    if 'chapters' in english_data:
-                        for chapter in english_data['chapters']:
-                            english_content.extend(chapter.get('articles', []))
-                    # Also include appendices if available
-                    english_appendices = english_data.get('appendices', [])
-                    english_content.extend(english_appendices)
-                elif isinstance(english_data, list):
-                    english_content = english_data
-                english_results = advanced_search_relevant_content(question, english_content, 'english')
+                # Chapter articles and appendices are indexed together as well
+                english_results = advanced_search_relevant_content(question, english_data, 'english')
                 relevant_articles.extend(english_results)
             
             # Sort all results by relevance
@@ -3,66 +3,44 @@ ITPF Legal Answer System - DeepSeek Powered Expert Version
 نظام خبير قانوني مدعوم بـ DeepSeek للتحليل الذكي المتقدم
 """
 
+import asyncio
 import json
 import os
 import re
-import asyncio
-from typing import Dict, Any, List, Tuple, Set
+from typing import Dict, Any, List, Optional, Tuple, Set
 from http.server import BaseHTTPRequestHandler
 from collections import defaultdict
 from dataclasses import dataclass
 
 try:
+    from .deepseek_client import deepseek_client
     from .deepseek_integration import deepseek_integration
+    from .model_router import model_router
+    from .legal_corpus import get_corpus
+    from .legal_ranker import get_ranker
+    from .response_cache import corpus_stamp, response_cache, response_key
+    from .semantic_cache import question_embedding, semantic_cache
 except ImportError:
     # للتطوير المحلي
     import sys
     sys.path.append(os.path.dirname(__file__))
+    from deepseek_client import deepseek_client
     from deepseek_integration import deepseek_integration
+    from model_router import model_router
+    from legal_corpus import get_corpus
+    from legal_ranker import get_ranker
+    from response_cache import corpus_stamp, response_cache, response_key
+    from semantic_cache import question_embedding, semantic_cache
 
 
 def load_legal_data():
-    """Load complete legal data - enhanced and comprehensive"""
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load Arabic data with enhanced error handling
-        arabic_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            arabic_file = os.path.join(script_dir, f'arabic_data_part{i}.json')
-            try:
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        arabic_data["appendices"] = part_data.get("appendices", [])
-                    arabic_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading Arabic part {i}: {str(e)}")
-        
-        # Load English data with enhanced error handling
-        english_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            english_file = os.path.join(script_dir, f'english_data_part{i}.json')
-            try:
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        english_data["appendices"] = part_data.get("appendices", [])
-                    if 'chapters' in part_data:
-                        for chapter in part_data['chapters']:
-                            english_data["articles"].extend(chapter.get('articles', []))
-                    else:
-                        english_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading English part {i}: {str(e)}")
-        
-        print(f"DeepSeek System Data Loaded - Arabic: {len(arabic_data['articles'])} articles, {len(arabic_data['appendices'])} appendices")
-        print(f"DeepSeek System Data Loaded - English: {len(english_data['articles'])} articles, {len(english_data['appendices'])} appendices")
-        
-        return arabic_data, english_data
-    except Exception as e:
-        print(f"Critical error loading legal data: {str(e)}")
-        return {}, {}
+    """Load complete legal data from the shared corpus snapshot (parsed once per process)"""
+    corpus = get_corpus()
+    return corpus.arabic, corpus.english
+
+
+# درجة إضافية (بوحدات BM25F) للملحق المذكور رقمه في السؤال
+APPENDIX_MATCH_BONUS = 10.0
 
 
 def smart_local_search(question: str, data: dict, language: str) -> List[Dict[str, Any]]:
@@ -99,50 +77,39 @@ def smart_local_search(question: str, data: dict, language: str) -> List[Dict[st
         if term in synonyms:
             search_terms.extend(synonyms[term])
     
+    # ترتيب BM25F لكل مستند في الفهرس
+    ranker = get_ranker(data)
+    scores, _ = ranker.score_terms(search_terms)
+    
     # البحث في المقالات
-    for article in data.get('articles', []):
-        content = article.get('content', '').lower()
-        title = article.get('title', '').lower()
-        
-        score = 0
-        for term in search_terms:
-            if term.lower() in content:
-                score += 2
-            if term.lower() in title:
-                score += 3
-        
+    for doc in ranker.index.articles:
+        score = scores.get(doc.doc_id, 0)
         if score > 0:
+            article = doc.item
             results.append({
                 'article_number': article.get('article_number', 0),
                 'title': article.get('title', ''),
                 'content': article.get('content', ''),
-                'relevance_score': score,
+                'relevance_score': round(score, 3),
                 'content_type': 'article'
             })
     
-    # البحث في الملاحق مع أولوية عالية
-    for appendix in data.get('appendices', []):
-        content = str(appendix.get('content', '')).lower()
-        title = appendix.get('title', '').lower()
-        
-        score = 0
-        for term in search_terms:
-            if term.lower() in content:
-                score += 4  # أولوية عالية للملاحق
-            if term.lower() in title:
-                score += 5
+    # البحث في الملاحق
+    for doc in ranker.index.appendices:
+        appendix = doc.item
+        score = scores.get(doc.doc_id, 0)
         
         # أولوية إضافية للملحق المحدد
         appendix_num = str(appendix.get('appendix_number', ''))
         if appendix_num in search_terms:
-            score += 10
+            score += APPENDIX_MATCH_BONUS
         
         if score > 0:
             results.append({
                 'article_number': f"ملحق {appendix_num}",
                 'title': appendix.get('title', ''),
                 'content': str(appendix.get('content', '')),
-                'relevance_score': score,
+                'relevance_score': round(score, 3),
                 'content_type': 'appendix'
             })
     
@@ -151,49 +118,67 @@ def smart_local_search(question: str, data: dict, language: str) -> List[Dict[st
     return results[:8]  # إرجاع أفضل 8 نتائج لـ DeepSeek
 
 
-async def create_deepseek_powered_analysis(question: str, results: List[Dict[str, Any]]) -> str:
-    """تحليل قانوني مدعوم بـ DeepSeek للذكاء المتقدم"""
+async def create_deepseek_powered_analysis(question: str, results: List[Dict[str, Any]],
+                                           language: str = 'arabic') -> Tuple[str, Dict[str, Any]]:
+    """تحليل قانوني مدعوم بـ DeepSeek للذكاء المتقدم، مع قرار التوجيه"""
     
-    # تحديد نمط المعالجة بناءً على تعقيد السؤال
-    processing_mode = deepseek_integration.analyze_query_complexity(question)
+    # تحديد المسار بناءً على تعقيد السؤال: التعريفات والبحث محلياً، والمعقد إلى DeepSeek
+    decision = model_router.decide(question)
     
-    print(f"DeepSeek processing mode: {processing_mode}")
+    print(f"DeepSeek processing mode: {decision.route}")
     
-    if processing_mode == 'local_fast':
-        # للأسئلة البسيطة، استخدام التحليل المحلي السريع
-        return create_local_fast_analysis(question, results)
-    else:
-        # للأسئلة المعقدة، استخدام DeepSeek
-        try:
+    # الإجابات الناجحة محفوظة لنفس السؤال والمراجع ونسخة النصوص
+    stamp = corpus_stamp(get_corpus())
+    context_ids = [f"{result.get('content_type')}:{result.get('article_number')}" for result in results[:5]]
+    
+    async def remote(processing_mode: str, timeout: float) -> Optional[str]:
+        cache_key = response_key(question, language, processing_mode, context_ids, stamp)
+        deepseek_response = response_cache.get(cache_key)
+        embedding = None
+        if deepseek_response is not None:
+            print("DeepSeek response served from cache")
+        else:
+            # سؤال بصياغة أخرى سبقت الإجابة عنه؛ التمثيل (وتحميل النموذج) خارج الحلقة المشتركة
+            embedding = await asyncio.to_thread(question_embedding, question, language)
+            hit = None
+            if embedding is not None:
+                hit = semantic_cache.lookup(embedding, question, language, processing_mode, stamp, context_ids)
+            if hit is not None:
+                print(f"DeepSeek response served from semantic cache (similarity {hit.confidence:.3f})")
+                deepseek_response = hit.answer
+        if deepseek_response is None:
             deepseek_response = await deepseek_integration.get_deepseek_response(
-                question, results, processing_mode
+                question, results, processing_mode, timeout
             )
-            
             if deepseek_response['success']:
-                # دمج تحليل DeepSeek مع النتائج المحلية
-                enhanced_analysis = deepseek_integration.create_enhanced_summary(
-                    question, deepseek_response['response'], results
-                )
-                
-                # إضافة معلومات DeepSeek
-                deepseek_info = f"""
+                response_cache.put(cache_key, deepseek_response, stamp)
+                if embedding is not None:
+                    semantic_cache.store(embedding, question, language, processing_mode, stamp, context_ids,
+                                         deepseek_response)
+        
+        if not deepseek_response['success']:
+            # الموجه يرجع إلى المسار الأرخص
+            print(f"DeepSeek fallback: {deepseek_response.get('error', 'Unknown error')}")
+            return None
+        
+        # دمج تحليل DeepSeek مع النتائج المحلية
+        enhanced_analysis = deepseek_integration.create_enhanced_summary(
+            question, deepseek_response['response'], results
+        )
+        
+        # إضافة معلومات DeepSeek
+        deepseek_info = f"""
 
 **🤖 معلومات المعالجة الذكية:**
 - نمط المعالجة: {processing_mode}
 - النموذج المستخدم: {deepseek_response.get('model_used', 'N/A')}
 - الرموز المستخدمة: {deepseek_response.get('tokens_used', 'N/A')}
 - مستوى التحليل: متقدم بالذكاء الاصطناعي"""
-                
-                return enhanced_analysis + deepseek_info
-            else:
-                # في حالة فشل DeepSeek، استخدام التحليل المحلي
-                print(f"DeepSeek fallback: {deepseek_response.get('error', 'Unknown error')}")
-                return create_local_fast_analysis(question, results)
-                
-        except Exception as e:
-            print(f"DeepSeek error: {str(e)}")
-            # في حالة خطأ، استخدام التحليل المحلي
-            return create_local_fast_analysis(question, results)
+        
+        return enhanced_analysis + deepseek_info
+    
+    analysis = await model_router.run(decision, remote, lambda: create_local_fast_analysis(question, results))
+    return analysis, decision.to_dict()
 
 
 def create_local_fast_analysis(question: str, results: List[Dict[str, Any]]) -> str:
@@ -371,14 +356,9 @@ class handler(BaseHTTPRequestHandler):
             all_results.sort(key=lambda x: x['relevance_score'], reverse=True)
             
             # Create DeepSeek-powered analysis
-            loop = asyncio.new_event_loop()
-            asyncio.set_event_loop(loop)
-            try:
-                expert_analysis = loop.run_until_complete(
-                    create_deepseek_powered_analysis(question, all_results)
-                )
-            finally:
-                loop.close()
+            expert_analysis, route = deepseek_client.run(
+                create_deepseek_powered_analysis(question, all_results, language)
+            )
             
             # Prepare enhanced references for display
             legal_references = []
@@ -402,7 +382,8 @@ class handler(BaseHTTPRequestHandler):
                     "language": language,
                     "articles_found": len(all_results),
                     "system_type": "DeepSeek Powered Expert Legal System",
-                    "deepseek_powered": True,
+                    "route": route,
+                    "deepseek_powered": route['route'] != 'local_fast',
                     "expert_powered": True,
                     "text_preservation": "Complete - no truncation",
                     "version": "7.0.0", 
@@ -0,0 +1,134 @@
+"""
+ITPF Legal System - Answer Jobs
+مهام الخلفية للإجابة الاستباقية: الإجابة المحلية فوراً وتحليل DeepSeek عند جاهزيته
+
+In speculative mode answer.py replies at retrieval time with the local answer
+and a job id. The DeepSeek call runs as a job on a small thread pool and the
+client polls GET /api/answer?job=<id>&wait=<seconds> for the upgraded
+analysis. A poll with wait blocks until the job finishes or the wait runs
+out, which also keeps a serverless instance awake while the job runs there.
+
+Jobs live in the memory of the instance that created them and expire after
+JOB_TTL. A poll that reaches another instance, or comes after the job was
+dropped, gets status "unknown" and the client keeps the local answer.
+"""
+
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, Optional
+
+JOB_WORKERS = int(os.getenv('ITPF_ANSWER_JOB_WORKERS', '4'))
+JOB_TTL = float(os.getenv('ITPF_ANSWER_JOB_TTL', '600'))
+MAX_JOBS = int(os.getenv('ITPF_ANSWER_JOB_MAX', '256'))
+# أطول انتظار يقبله طلب استطلاع واحد
+MAX_WAIT = 25.0
+
+PENDING, DONE, FAILED = 'pending', 'done', 'failed'
+
+
+@dataclass
+class AnswerJob:
+    """مهمة خلفية واحدة ونتيجتها"""
+    id: str
+    created: float = field(default_factory=time.time)
+    status: str = PENDING
+    result: Optional[Dict[str, Any]] = None
+    error: str = ''
+    finished: float = 0.0
+    event: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    def to_dict(self) -> Dict[str, Any]:
+        end = self.finished or time.time()
+        return {
+            'id': self.id,
+            'status': self.status,
+            'elapsed_ms': round((end - self.created) * 1000, 1),
+            'result': self.result,
+            'error': self.error or None,
+        }
+
+
+class AnswerJobStore:
+    """مهام الإجابة في ذاكرة العملية مع مدة صلاحية"""
+
+    def __init__(self, workers: int = JOB_WORKERS, ttl: float = JOB_TTL, max_jobs: int = MAX_JOBS):
+        self.workers = workers
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.jobs: Dict[str, AnswerJob] = {}
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    def _pool(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='itpf-answer-job')
+        return self._executor
+
+    def _evict(self, now: float) -> None:
+        """حذف المهام المنتهية الصلاحية، ثم أقدم المهام المكتملة عند تجاوز الحد"""
+        for job_id, job in list(self.jobs.items()):
+            if now - job.created > self.ttl:
+                del self.jobs[job_id]
+        finished = sorted((job for job in self.jobs.values() if job.status != PENDING), key=lambda job: job.created)
+        while len(self.jobs) >= self.max_jobs and finished:
+            del self.jobs[finished.pop(0).id]
+
+    def submit(self, fn: Callable[..., Dict[str, Any]], *args: Any) -> AnswerJob:
+        """تشغيل fn(*args) في الخلفية؛ قيمتها المعادة هي نتيجة المهمة"""
+        job = AnswerJob(uuid.uuid4().hex)
+        with self._lock:
+            self._evict(job.created)
+            self.jobs[job.id] = job
+            self.submitted += 1
+            executor = self._pool()
+        executor.submit(self._run, job, fn, args)
+        return job
+
+    def _run(self, job: AnswerJob, fn: Callable[..., Dict[str, Any]], args: tuple) -> None:
+        try:
+            result = fn(*args)
+        except Exception as e:
+            print(f"❌ Answer job {job.id} failed: {str(e)}")
+            job.error = str(e)
+            job.status = FAILED
+        else:
+            job.result = result
+            job.status = DONE
+        job.finished = time.time()
+        with self._lock:
+            if job.status == DONE:
+                self.completed += 1
+            else:
+                self.failed += 1
+        job.event.set()
+
+    def get(self, job_id: str, wait: float = 0.0) -> Optional[AnswerJob]:
+        """المهمة بمعرفها (None إذا لم تكن في هذه العملية)، مع انتظار اكتمالها حتى wait ثانية"""
+        with self._lock:
+            job = self.jobs.get(job_id)
+        if job is not None and wait > 0:
+            job.event.wait(min(wait, MAX_WAIT))
+        return job
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            pending = sum(job.status == PENDING for job in self.jobs.values())
+            return {
+                'workers': self.workers,
+                'jobs': len(self.jobs),
+                'pending': pending,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+answer_jobs = AnswerJobStore()
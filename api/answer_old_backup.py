@@ -29,51 +29,26 @@ except ImportError:
         ADVANCED_REASONING_AVAILABLE = False
         print("⚠️ Advanced reasoning not available, using standard system")
 
+try:
+    from .legal_corpus import get_corpus
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+
 
 def load_legal_data():
     """Load complete legal data - enhanced and comprehensive"""
     try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load Arabic data with enhanced error handling
-        arabic_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            arabic_file = os.path.join(script_dir, f'arabic_data_part{i}.json')
-            try:
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        arabic_data["appendices"] = part_data.get("appendices", [])
-                    arabic_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading Arabic part {i}: {str(e)}")
-        
-        # Load English data with enhanced error handling
-        english_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            english_file = os.path.join(script_dir, f'english_data_part{i}.json')
-            try:
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        english_data["appendices"] = part_data.get("appendices", [])
-                    if 'chapters' in part_data:
-                        for chapter in part_data['chapters']:
-                            english_data["articles"].extend(chapter.get('articles', []))
-                    else:
-                        english_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading English part {i}: {str(e)}")
-        
-        print(f"Expert System Data Loaded - Arabic: {len(arabic_data['articles'])} articles, {len(arabic_data['appendices'])} appendices")
-        print(f"Expert System Data Loaded - English: {len(english_data['articles'])} articles, {len(english_data['appendices'])} appendices")
+        corpus = get_corpus()
+        arabic_data, english_data = corpus.arabic, corpus.english
         
         # تهيئة النظام المتقدم (إضافة آمنة)
         if ADVANCED_REASONING_AVAILABLE:
             try:
                 global advanced_reasoning_system
                 advanced_reasoning_system = AdvancedLegalReasoning()
-                advanced_reasoning_system.build_knowledge_graph(arabic_data)
+                advanced_reasoning_system.load_knowledge_graph('arabic')
                 print("🧠 Advanced reasoning system initialized with knowledge graph")
             except Exception as e:
                 print(f"⚠️ Could not initialize advanced reasoning: {str(e)}")
@@ -8,49 +8,20 @@ import os
 from typing import Dict, Any, List
 from http.server import BaseHTTPRequestHandler
 
+try:
+    from .legal_corpus import get_corpus
+    from .legal_ranker import get_ranker
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+    from legal_ranker import get_ranker
+
 
 def load_legal_data():
-    """Load complete legal data - simplified and fast"""
-    try:
-        script_dir = os.path.dirname(os.path.abspath(__file__))
-        
-        # Load Arabic data
-        arabic_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            arabic_file = os.path.join(script_dir, f'arabic_data_part{i}.json')
-            try:
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        arabic_data["appendices"] = part_data.get("appendices", [])
-                    arabic_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading Arabic part {i}: {str(e)}")
-        
-        # Load English data  
-        english_data = {"articles": [], "appendices": []}
-        for i in range(1, 4):
-            english_file = os.path.join(script_dir, f'english_data_part{i}.json')
-            try:
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    part_data = json.load(f)
-                    if i == 1:
-                        english_data["appendices"] = part_data.get("appendices", [])
-                    if 'chapters' in part_data:
-                        for chapter in part_data['chapters']:
-                            english_data["articles"].extend(chapter.get('articles', []))
-                    else:
-                        english_data["articles"].extend(part_data.get("articles", []))
-            except Exception as e:
-                print(f"Error loading English part {i}: {str(e)}")
-        
-        print(f"Data loaded - Arabic: {len(arabic_data['articles'])} articles, {len(arabic_data['appendices'])} appendices")
-        print(f"Data loaded - English: {len(english_data['articles'])} articles, {len(english_data['appendices'])} appendices")
-        
-        return arabic_data, english_data
-    except Exception as e:
-        print(f"Error loading legal data: {str(e)}")
-        return {}, {}
+    """Load complete legal data from the shared corpus snapshot (parsed once per process)"""
+    corpus = get_corpus()
+    return corpus.arabic, corpus.english
 
 
 def simple_search(question: str, data: dict, language: str) -> List[Dict[str, Any]]:
@@ -70,44 +41,33 @@ def simple_search(question: str, data: dict, language: str) -> List[Dict[str, An
     # Add question words as search terms
     search_terms.extend(question_lower.split())
     
+    # BM25F scores for every matching document
+    ranker = get_ranker(data)
+    index = ranker.index
+    scores, _ = ranker.score_terms(search_terms)
+    
     # Search in articles
-    for article in data.get('articles', []):
-        content = article.get('content', '').lower()
-        title = article.get('title', '').lower()
-        
-        score = 0
-        for term in search_terms:
-            if term in content:
-                score += 2
-            if term in title:
-                score += 3
-        
+    for doc in index.articles:
+        score = scores.get(doc.doc_id, 0)
         if score > 0:
+            article = doc.item
             results.append({
                 'article_number': article.get('article_number', 0),
                 'title': article.get('title', ''),
                 'content': article.get('content', ''),
-                'relevance_score': score
+                'relevance_score': round(score, 3)
             })
     
     # Search in appendices
-    for appendix in data.get('appendices', []):
-        content = str(appendix.get('content', '')).lower()
-        title = appendix.get('title', '').lower()
-        
-        score = 0
-        for term in search_terms:
-            if term in content:
-                score += 3
-            if term in title:
-                score += 4
-        
+    for doc in index.appendices:
+        score = scores.get(doc.doc_id, 0)
         if score > 0:
+            appendix = doc.item
             results.append({
                 'article_number': f"ملحق {appendix.get('appendix_number', '')}",
                 'title': appendix.get('title', ''),
                 'content': str(appendix.get('content', ''))[:500] + "...",
-                'relevance_score': score
+                'relevance_score': round(score, 3)
             })
     
     # Sort by relevance and return top 5
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+ITPF Legal System - Streaming Answer Endpoint
+بث الإجابة كأحداث SSE: المراجع القانونية أولاً ثم نص التحليل أثناء توليده
+
+The JSON endpoint (answer.py) waits for the whole DeepSeek generation before
+sending anything. This endpoint runs the same pipeline with a streamed
+completion and forwards it as server-sent events:
+
+    event: references   {"legal_references": [...]}        after retrieval
+    event: delta        {"text": "..."}                    per DeepSeek chunk
+    event: error        {"error": "..."}                   stream broke midway
+    event: done         {"success": true, "metadata": {...}}
+
+POST takes the same JSON body as answer.py; GET takes question, language and
+force_refresh as query parameters so EventSource clients can connect too.
+"""
+
+import json
+import os
+from http.server import BaseHTTPRequestHandler
+from typing import Any, Dict
+from urllib.parse import parse_qs, urlparse
+
+try:
+    from .answer import itpf_system
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from answer import itpf_system
+
+
+def sse_event(event: str, data: Dict[str, Any]) -> bytes:
+    """حدث SSE واحد (JSON في سطر data واحد)"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode('utf-8')
+
+
+class handler(BaseHTTPRequestHandler):
+    """معالج Vercel لبث الإجابات"""
+
+    def do_OPTIONS(self):
+        """معالجة CORS preflight"""
+        self.send_response(200)
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.send_header('Access-Control-Allow-Methods', 'GET, POST, OPTIONS')
+        self.send_header('Access-Control-Allow-Headers', 'Content-Type')
+        self.end_headers()
+
+    def do_GET(self):
+        """بث الإجابة لعملاء EventSource"""
+        params = parse_qs(urlparse(self.path).query)
+        self.stream_answer({key: values[0] for key, values in params.items()})
+
+    def do_POST(self):
+        """بث الإجابة لطلب JSON بنفس صيغة answer.py"""
+        try:
+            content_length = int(self.headers.get('Content-Length', 0))
+            data = json.loads(self.rfile.read(content_length).decode('utf-8')) if content_length > 0 else {}
+        except ValueError:
+            self.send_error_response({'error': 'JSON غير صالح'}, 400)
+            return
+        self.stream_answer(data)
+
+    def stream_answer(self, data: Dict[str, Any]):
+        question = data.get('question', '')
+        language = data.get('language', 'arabic')
+        force_refresh = str(data.get('force_refresh', '')).lower() in ('1', 'true')
+
+        if not question:
+            self.send_error_response({'error': 'السؤال مطلوب'}, 400)
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream; charset=utf-8')
+        self.send_header('Cache-Control', 'no-cache')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        # منع التخزين المؤقت للبث في الوسطاء (nginx وما شابه)
+        self.send_header('X-Accel-Buffering', 'no')
+        self.end_headers()
+
+        events = itpf_system.stream_question(question, language, force_refresh)
+        try:
+            for event, payload in events:
+                self.wfile.write(sse_event(event, payload))
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            print("⚠️ انقطع اتصال العميل أثناء البث")
+        except Exception as e:
+            print(f"❌ خطأ في البث: {str(e)}")
+            try:
+                self.wfile.write(sse_event('error', {'error': str(e)}))
+                self.wfile.write(sse_event('done', {'success': False}))
+            except (BrokenPipeError, ConnectionResetError):
+                pass
+        finally:
+            # إغلاق المولد يوقف قراءة بث DeepSeek إن لم يكتمل
+            events.close()
+
+    def send_error_response(self, error_data, status_code):
+        """إرسال استجابة خطأ"""
+        self.send_response(status_code)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Access-Control-Allow-Origin', '*')
+        self.end_headers()
+
+        response_json = json.dumps(error_data, ensure_ascii=False)
+        self.wfile.write(response_json.encode('utf-8'))
@@ -0,0 +1,71 @@
+"""
+ITPF Legal System - Arabic Normalizer and Light Stemmer
+توحيد الكلمات العربية وتجذيرها الخفيف لتطبيقها بنفس الطريقة عند الفهرسة وعند البحث
+
+normalize_arabic() strips diacritics and tatweel and folds alef, yaa, taa
+marbuta, hamza-on-waw/yaa forms. light_stem() removes the definite article,
+attached conjunction/preposition prefixes and common plural, dual and pronoun
+suffixes (Light10-style rules), so "المتسابق" and "متسابقين" share the term
+"متسابق". analyze_token() is the single entry point used by the index and by
+query processing and is cached per distinct token.
+"""
+
+import re
+from functools import lru_cache
+
+ARABIC_LETTERS = re.compile(r'[\u0600-\u06FF]')
+
+# التشكيل وعلامات القرآن والتطويل
+DIACRITICS = re.compile(r'[\u0610-\u061A\u064B-\u065F\u0670\u06D6-\u06DC\u06DF-\u06E8\u06EA-\u06ED\u0640]')
+
+LETTER_FOLDING = str.maketrans({
+    'أ': 'ا', 'إ': 'ا', 'آ': 'ا', 'ٱ': 'ا',
+    'ى': 'ي', 'ئ': 'ي',
+    'ؤ': 'و',
+    'ة': 'ه',
+})
+
+# أداة التعريف مع حروف العطف والجر المتصلة (الأطول أولاً)، وواو العطف وحدها
+DEFINITE_PREFIXES = ('وال', 'بال', 'كال', 'فال', 'لل', 'ال')
+CONJUNCTION_PREFIX = 'و'
+# لواحق الجمع والمثنى والضمائر (بعد التوحيد تصبح ة هاء)
+SUFFIXES = ('ها', 'ان', 'ات', 'ون', 'ين', 'يه', 'ه', 'ي')
+
+MIN_STEM_LENGTH = 2
+
+ANALYZE_CACHE_SIZE = 65536
+
+
+def is_arabic(text: str) -> bool:
+    """هل يحتوي النص على حروف عربية"""
+    return ARABIC_LETTERS.search(text) is not None
+
+
+def normalize_arabic(text: str) -> str:
+    """إزالة التشكيل والتطويل وتوحيد أشكال الألف والياء والتاء المربوطة"""
+    return DIACRITICS.sub('', text).translate(LETTER_FOLDING)
+
+
+def light_stem(token: str) -> str:
+    """تجذير خفيف لكلمة عربية موحدة: إزالة أداة التعريف والسوابق واللواحق"""
+    stem = token
+    if len(stem) > 3 and stem[0] == CONJUNCTION_PREFIX and not stem.startswith(DEFINITE_PREFIXES):
+        stem = stem[1:]
+    for prefix in DEFINITE_PREFIXES:
+        if stem.startswith(prefix) and len(stem) - len(prefix) >= MIN_STEM_LENGTH:
+            stem = stem[len(prefix):]
+            break
+    for suffix in SUFFIXES:
+        if stem.endswith(suffix) and len(stem) - len(suffix) >= MIN_STEM_LENGTH + 1:
+            stem = stem[:-len(suffix)]
+            break
+    return stem
+
+
+@lru_cache(maxsize=ANALYZE_CACHE_SIZE)
+def analyze_token(token: str) -> str:
+    """الشكل المفهرس لكلمة واحدة (حروف صغيرة، وتوحيد وتجذير للكلمات العربية)"""
+    token = token.lower()
+    if not is_arabic(token):
+        return token
+    return light_stem(normalize_arabic(token))
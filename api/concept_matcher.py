@@ -0,0 +1,192 @@
+"""
+ITPF Legal System - Concept Matcher
+مطابقة مفاهيم السؤال بمرور واحد عبر آلة Aho-Corasick مبنية مرة واحدة لكل خريطة مفاهيم
+
+A concept map (ITPF_CONCEPT_MAP, the ExpertLegalAnalyzer ontology) is compiled
+into ConceptRule entries: a concept, the trigger strings that select it and the
+weighted expansion terms it contributes. All triggers of all rules go into one
+automaton, so matching a question costs one scan of the question instead of a
+substring test per concept term. Rules of the same concept are tried in
+declaration order and the first one with a hit wins, which keeps the
+"Arabic terms, else English terms, else synonym words" precedence of the
+original loops.
+"""
+
+from collections import deque
+from dataclasses import dataclass
+from typing import Any, Dict, Hashable, Iterable, List, Mapping, Set, Tuple
+
+# أوزان مصطلحات التوسيع حسب مصدرها في خريطة المفاهيم
+TERM_WEIGHT = 1.0
+SYNONYM_WEIGHT = 0.8
+CONTEXT_WEIGHT = 0.6
+RELATED_WEIGHT = 0.4
+
+
+class PatternAutomaton:
+    """آلة Aho-Corasick لمطابقة عدة نصوص فرعية في مرور واحد"""
+
+    def __init__(self, patterns: Iterable[Tuple[str, Hashable]]):
+        # state 0 is the root; goto[state] maps a character to the next state
+        self.goto: List[Dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        self.outputs: List[Set[Hashable]] = [set()]
+
+        for pattern, payload in patterns:
+            if not pattern:
+                continue
+            state = 0
+            for char in pattern:
+                next_state = self.goto[state].get(char)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][char] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append(set())
+                state = next_state
+            self.outputs[state].add(payload)
+
+        # روابط الفشل بالعرض أولاً، ودمج مخرجات حالة الفشل في كل حالة
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, next_state in self.goto[state].items():
+                queue.append(next_state)
+                fallback = self.fail[state]
+                while fallback and char not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                target = self.goto[fallback].get(char, 0)
+                self.fail[next_state] = target if target != next_state else 0
+                self.outputs[next_state] |= self.outputs[self.fail[next_state]]
+
+    def find(self, text: str) -> Set[Hashable]:
+        """جميع الحمولات التي يظهر أحد نصوصها داخل النص"""
+        goto, fail, outputs = self.goto, self.fail, self.outputs
+        found: Set[Hashable] = set()
+        state = 0
+        for char in text:
+            while state and char not in goto[state]:
+                state = fail[state]
+            state = goto[state].get(char, 0)
+            if outputs[state]:
+                found |= outputs[state]
+        return found
+
+
+@dataclass(frozen=True)
+class ConceptRule:
+    """قاعدة مطابقة: المفهوم، نصوص التفعيل، ومصطلحات التوسيع الموزونة"""
+    concept: str
+    triggers: Tuple[str, ...]
+    expansion: Tuple[Tuple[str, float], ...]
+
+
+@dataclass(frozen=True)
+class ConceptMatch:
+    """مفهوم مطابق في السؤال مع مصطلحات توسيعه"""
+    concept: str
+    rule: int
+    expansion: Tuple[Tuple[str, float], ...]
+
+    @property
+    def terms(self) -> List[str]:
+        return [term for term, _ in self.expansion]
+
+
+def _weighted(*groups: Tuple[Iterable[str], float]) -> Tuple[Tuple[str, float], ...]:
+    """دمج مجموعات المصطلحات مع الإبقاء على أعلى وزن لكل مصطلح مكرر"""
+    weights: Dict[str, float] = {}
+    for terms, weight in groups:
+        for term in terms:
+            term = term.lower()
+            if weight > weights.get(term, 0.0):
+                weights[term] = weight
+    return tuple(weights.items())
+
+
+class ConceptMatcher:
+    """مطابقة قواعد المفاهيم المترجمة مسبقاً"""
+
+    def __init__(self, rules: Iterable[ConceptRule]):
+        self.rules: Tuple[ConceptRule, ...] = tuple(rules)
+        self.automaton = PatternAutomaton(
+            (trigger.lower(), rule_id)
+            for rule_id, rule in enumerate(self.rules)
+            for trigger in rule.triggers
+        )
+
+    def match(self, question: str) -> List[ConceptMatch]:
+        """المفاهيم المطابقة بترتيب الخريطة (أول قاعدة مطابقة لكل مفهوم)"""
+        hits = self.automaton.find(question.lower())
+        matches: List[ConceptMatch] = []
+        seen: Set[str] = set()
+        for rule_id in sorted(hits):
+            rule = self.rules[rule_id]
+            if rule.concept in seen:
+                continue
+            seen.add(rule.concept)
+            matches.append(ConceptMatch(rule.concept, rule_id, rule.expansion))
+        return matches
+
+    def expand(self, question: str) -> Dict[str, float]:
+        """مصطلحات التوسيع الموزونة لجميع المفاهيم المطابقة"""
+        weights: Dict[str, float] = {}
+        for match in self.match(question):
+            for term, weight in match.expansion:
+                if weight > weights.get(term, 0.0):
+                    weights[term] = weight
+        return weights
+
+
+def compile_concept_map(concept_map: Mapping[str, Mapping[str, Any]]) -> ConceptMatcher:
+    """ترجمة خريطة ITPF_CONCEPT_MAP إلى قواعد مطابقة
+
+    Per concept, in precedence order: an Arabic term selects the Arabic terms,
+    Arabic synonyms and context keywords; otherwise an English term selects the
+    English terms and synonyms; otherwise any word of an Arabic synonym selects
+    the Arabic terms and context keywords. Every rule also carries the first two
+    Arabic and English terms of the related concepts.
+    """
+    rules = []
+    for name, concept in concept_map.items():
+        related = []
+        for related_name in concept.get('related_concepts', []):
+            if related_name in concept_map:
+                related.extend(concept_map[related_name]['arabic_terms'][:2])
+                related.extend(concept_map[related_name]['english_terms'][:2])
+
+        arabic_synonyms = concept['synonyms']['arabic']
+        rules.append(ConceptRule(name, tuple(concept['arabic_terms']), _weighted(
+            (concept['arabic_terms'], TERM_WEIGHT),
+            (arabic_synonyms, SYNONYM_WEIGHT),
+            (concept['context_keywords'], CONTEXT_WEIGHT),
+            (related, RELATED_WEIGHT),
+        )))
+        rules.append(ConceptRule(name, tuple(concept['english_terms']), _weighted(
+            (concept['english_terms'], TERM_WEIGHT),
+            (concept['synonyms']['english'], SYNONYM_WEIGHT),
+            (related, RELATED_WEIGHT),
+        )))
+        rules.append(ConceptRule(
+            name,
+            tuple(word for synonym in arabic_synonyms for word in synonym.split()),
+            _weighted(
+                (concept['arabic_terms'], TERM_WEIGHT),
+                (concept['context_keywords'], CONTEXT_WEIGHT),
+                (related, RELATED_WEIGHT),
+            ),
+        ))
+    return ConceptMatcher(rules)
+
+
+def compile_ontology(concepts: Mapping[str, Any]) -> ConceptMatcher:
+    """ترجمة أنطولوجيا LegalConcept: أي مصطلح عربي أو إنجليزي يضيف كل مصطلحات المفهوم ومفاهيمه المرتبطة"""
+    rules = []
+    for name, concept in concepts.items():
+        terms = list(concept.arabic_terms) + list(concept.english_terms)
+        rules.append(ConceptRule(name, tuple(terms), _weighted(
+            (terms, TERM_WEIGHT),
+            (concept.related_concepts, RELATED_WEIGHT),
+        )))
+    return ConceptMatcher(rules)
@@ -0,0 +1,216 @@
+"""
+ITPF Legal System - Compiled Corpus Artifact
+ملف ثنائي مُجمّع مسبقاً للنصوص القانونية لتسريع التشغيل البارد
+
+Build:    python api/corpus_artifact.py build
+Measure:  python api/corpus_artifact.py bench
+
+Layout: MAGIC | header length (uint32 LE) | JSON header | marshal payload.
+The header carries the content hash of the JSON files the artifact was built
+from; load_artifact() re-hashes those files (no parsing) and ignores the
+artifact when they changed, so a stale build can never serve old rules.
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import sys
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from .legal_corpus import (API_DIR, CORPUS_SOURCES, ROOT_DIR, LegalCorpus,
+                               freeze_language, load_corpus, log_corpus_loaded)
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_corpus import (API_DIR, CORPUS_SOURCES, ROOT_DIR, LegalCorpus,
+                              freeze_language, load_corpus, log_corpus_loaded)
+
+MAGIC = b'ITPFCRP1'
+FORMAT_VERSION = 1
+# marshal is built into the interpreter (no import cost at cold start) and
+# writes repeated strings once as back-references, which acts as the string table
+MARSHAL_VERSION = marshal.version
+HEADER_LENGTH_BYTES = 4
+
+
+def artifact_path(source: str) -> str:
+    """مسار الملف الثنائي لمصدر معين"""
+    return os.path.join(API_DIR, f'legal_corpus_{source}.bin')
+
+
+def _thaw(value: Any) -> Any:
+    """تحويل اللقطة الثابتة إلى أنواع قابلة للتسلسل"""
+    if hasattr(value, 'items'):
+        return {key: _thaw(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_thaw(item) for item in value]
+    return value
+
+
+def _intern_strings(value: Any, table: Dict[str, str]) -> Any:
+    """توحيد النصوص المكررة بحيث يُكتب كل نص مرة واحدة (جدول النصوص)"""
+    if isinstance(value, str):
+        return table.setdefault(value, value)
+    if isinstance(value, dict):
+        return {_intern_strings(key, table): _intern_strings(item, table) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_intern_strings(item, table) for item in value]
+    return value
+
+
+def _files_version(relative_files: List[str]) -> Optional[str]:
+    """إعادة حساب بصمة ملفات المصدر بنفس طريقة legal_corpus"""
+    hasher = hashlib.sha256()
+    for relative_file in relative_files:
+        path = os.path.join(ROOT_DIR, relative_file)
+        if not os.path.exists(path):
+            return None
+        with open(path, 'rb') as f:
+            raw = f.read()
+        hasher.update(os.path.basename(path).encode('utf-8'))
+        hasher.update(raw)
+    return hasher.hexdigest()[:16]
+
+
+def build_artifact(source: str = 'split', path: Optional[str] = None) -> Dict[str, Any]:
+    """تجميع المواد والملاحق والفصول في ملف ثنائي واحد"""
+    corpus = load_corpus(source, use_artifact=False)
+    string_table: Dict[str, str] = {}
+    tree = _intern_strings({
+        "arabic": _thaw(corpus.arabic),
+        "english": _thaw(corpus.english),
+    }, string_table)
+    payload = marshal.dumps(tree, MARSHAL_VERSION)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "marshal_version": MARSHAL_VERSION,
+        "source": source,
+        "version": corpus.version,
+        "files": [os.path.relpath(file, ROOT_DIR) for file in corpus.files],
+        "string_table_size": len(string_table),
+        "payload_bytes": len(payload),
+        "payload_sha256": hashlib.sha256(payload).hexdigest()[:16],
+        "counts": {key: value for key, value in corpus.stats().items() if key.endswith(('_articles', '_appendices'))}
+    }
+    from datetime import datetime
+    header["built_at"] = datetime.now().isoformat(timespec='seconds')
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    path = path or artifact_path(source)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(HEADER_LENGTH_BYTES, 'little'))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(temp_path, path)
+    return header
+
+
+def read_header(data: bytes, magic: bytes = MAGIC) -> Tuple[Dict[str, Any], int]:
+    """قراءة رأس الملف وإرجاع موضع بداية البيانات"""
+    if data[:len(magic)] != magic:
+        raise ValueError(f"Not an ITPF {magic.decode('ascii')} artifact")
+    offset = len(magic)
+    header_length = int.from_bytes(data[offset:offset + HEADER_LENGTH_BYTES], 'little')
+    offset += HEADER_LENGTH_BYTES
+    header = json.loads(data[offset:offset + header_length].decode('utf-8'))
+    return header, offset + header_length
+
+
+def load_artifact(source: str = 'split', path: Optional[str] = None) -> Optional[LegalCorpus]:
+    """تحميل اللقطة من الملف الثنائي دفعة واحدة، أو None إذا كان غير موجود أو قديماً"""
+    path = path or artifact_path(source)
+    if not os.path.exists(path):
+        return None
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    header, payload_offset = read_header(data)
+    if (header.get("format_version") != FORMAT_VERSION or header.get("source") != source
+            or header.get("marshal_version", MARSHAL_VERSION + 1) > MARSHAL_VERSION):
+        print(f"Corpus artifact {os.path.basename(path)} has an incompatible format, ignoring it")
+        return None
+    if _files_version(header.get("files", [])) != header.get("version"):
+        print(f"Corpus artifact {os.path.basename(path)} is stale (rule files changed), ignoring it")
+        return None
+
+    tree = marshal.loads(memoryview(data)[payload_offset:])
+    languages = []
+    for name in ('arabic', 'english'):
+        language = tree.get(name, {})
+        languages.append(freeze_language(
+            language.get("metadata", {}),
+            language.get("articles", []),
+            language.get("appendices", []),
+            language.get("chapters")
+        ))
+
+    corpus = LegalCorpus(
+        source=source,
+        arabic=languages[0],
+        english=languages[1],
+        version=header["version"],
+        files=tuple(os.path.join(ROOT_DIR, file) for file in header["files"]),
+        load_seconds=time.perf_counter() - started,
+        origin='artifact'
+    )
+    log_corpus_loaded(corpus)
+    return corpus
+
+
+BENCH_SCRIPT = """
+import time
+started = time.perf_counter()
+import sys
+sys.path.insert(0, {api_dir!r})
+import search
+imported = time.perf_counter()
+arabic_data, english_data = search.load_data()
+search.simple_search({query!r}, 'both', 10, arabic_data, english_data)
+finished = time.perf_counter()
+print(finished - imported, finished - started)
+"""
+
+
+def benchmark(runs: int = 25, query: str = 'المتسابق') -> Dict[str, Dict[str, float]]:
+    """قياس زمن التشغيل البارد حتى أول إجابة بحث، مع الملف الثنائي وبدونه"""
+    import statistics
+    import subprocess
+
+    script = BENCH_SCRIPT.format(api_dir=API_DIR, query=query)
+    results = {}
+    for mode, flag in (('json', '0'), ('artifact', '1')):
+        load, in_process, wall = [], [], []
+        env = dict(os.environ, ITPF_CORPUS_ARTIFACT=flag)
+        for _ in range(runs):
+            started = time.perf_counter()
+            output = subprocess.run([sys.executable, '-c', script], env=env, capture_output=True,
+                                    text=True, check=True).stdout
+            wall.append(time.perf_counter() - started)
+            load_seconds, total_seconds = output.strip().splitlines()[-1].split()
+            load.append(float(load_seconds))
+            in_process.append(float(total_seconds))
+        results[mode] = {
+            "load_and_search_ms": round(statistics.median(load) * 1000, 2),
+            "first_answer_ms": round(statistics.median(in_process) * 1000, 2),
+            "process_wall_ms": round(statistics.median(wall) * 1000, 2),
+        }
+    return results
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        for corpus_source in CORPUS_SOURCES:
+            built = build_artifact(corpus_source)
+            print(json.dumps(built, ensure_ascii=False, indent=2))
+    elif command == 'bench':
+        print(json.dumps(benchmark(), indent=2))
+    else:
+        print("usage: python api/corpus_artifact.py [build|bench]")
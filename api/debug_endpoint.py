@@ -6,7 +6,11 @@ Debug endpoint to check DeepSeek API integration status
 
 import json
 import os
+from deepseek_client import deepseek_client
 from deepseek_integration import deepseek_integration
+from deepseek_keys import key_pool
+from model_router import model_router
+from single_flight import deepseek_flights
 
 def handler(event, context):
     """Debug handler for Vercel"""
@@ -20,12 +24,9 @@ def handler(event, context):
                 env_info[key] = masked_value
         
         # Check API keys in integration
-        api_keys_info = {
-            "total_keys": len(deepseek_integration.api_keys),
-            "current_key_index": deepseek_integration.current_key_index,
-            "current_api_key": f"{deepseek_integration.current_api_key[:8]}...{deepseek_integration.current_api_key[-4:]}" if deepseek_integration.current_api_key and len(deepseek_integration.current_api_key) > 12 else str(deepseek_integration.current_api_key),
-            "base_url": deepseek_integration.base_url
-        }
+        # Pool state: circuit breaker, error rate and latency per key
+        api_keys_info = key_pool.stats()
+        api_keys_info["base_url"] = deepseek_integration.base_url
         
         # Test a simple API call
         test_result = None
@@ -42,7 +43,12 @@ def handler(event, context):
             "status": "debug_active",
             "environment_variables": env_info,
             "api_keys_info": api_keys_info,
+            "http_client": deepseek_client.stats(),
+            "model_router": model_router.stats(),
+            "single_flight": deepseek_flights.stats(),
             "test_result": test_result,
+            # route decision of the test call (per request, so this request's call)
+            "test_route": deepseek_integration.last_route,
             "integration_loaded": deepseek_integration is not None
         }
         
@@ -0,0 +1,345 @@
+"""
+ITPF Legal System - Shared DeepSeek HTTP Client
+عميل HTTP مشترك لـ DeepSeek: اتصالات دائمة وحلقة أحداث واحدة لكل العملية
+
+Every answer module used to call requests.post() with a fresh connection
+(a TLS handshake per question), and deepseek_integration wrapped its async
+call in asyncio.run(), creating and closing an event loop per question.
+This module keeps one httpx.AsyncClient (keep-alive pool, HTTP/2 when the
+h2 package is installed) on one event loop running in a daemon thread.
+Synchronous handlers call chat() or run(); coroutines await achat() from
+any loop; stream_chat() yields the answer deltas of a streamed completion.
+Without httpx the client falls back to a pooled requests.Session.
+
+Environment:
+    DEEPSEEK_CONNECT_TIMEOUT   connect timeout in seconds (5)
+    DEEPSEEK_TIMEOUT           default read timeout in seconds (60)
+    DEEPSEEK_MAX_CONCURRENCY   requests in flight at once, also the pool size (8)
+    DEEPSEEK_HTTP2             "auto" (if h2 is installed), "1" or "0"
+"""
+
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from typing import Any, Awaitable, Dict, Iterator, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+try:
+    import h2  # noqa: F401  (httpx needs it for HTTP/2)
+    H2_AVAILABLE = True
+except ImportError:
+    H2_AVAILABLE = False
+
+BASE_URL = "https://api.deepseek.com/v1"
+CHAT_URL = f"{BASE_URL}/chat/completions"
+CONNECT_TIMEOUT = float(os.getenv('DEEPSEEK_CONNECT_TIMEOUT', '5'))
+DEFAULT_TIMEOUT = float(os.getenv('DEEPSEEK_TIMEOUT', '60'))
+MAX_CONCURRENCY = int(os.getenv('DEEPSEEK_MAX_CONCURRENCY', '8'))
+HTTP2_SETTING = os.getenv('DEEPSEEK_HTTP2', 'auto').strip().lower()
+# نهاية البث في طابور الأجزاء
+_END = object()
+
+
+def _retry_after(headers: Any) -> Optional[float]:
+    """ثواني الانتظار من ترويسة Retry-After (None إن لم تكن رقماً)"""
+    try:
+        return float(headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        return None
+
+
+class ChatResponse:
+    """استجابة HTTP بواجهة requests.Response المستخدمة في نقاط النهاية"""
+
+    def __init__(self, status_code: int, text: str, elapsed: float, http_version: str = 'HTTP/1.1',
+                 retry_after: Optional[float] = None):
+        self.status_code = status_code
+        self.text = text
+        self.elapsed = elapsed
+        self.http_version = http_version
+        self.retry_after = retry_after
+
+    @property
+    def content(self) -> bytes:
+        return self.text.encode('utf-8')
+
+    def json(self) -> Any:
+        return json.loads(self.text)
+
+
+class DeepSeekStreamError(Exception):
+    """رفض DeepSeek طلب البث (رمز حالة غير 200)"""
+
+    def __init__(self, status_code: int, text: str, retry_after: Optional[float] = None):
+        super().__init__(f"DeepSeek API {status_code}: {text[:200]}")
+        self.status_code = status_code
+        self.text = text
+        self.retry_after = retry_after
+
+
+def _stream_delta(line: str) -> Optional[str]:
+    """نص الجزء في سطر SSE من DeepSeek ('' للأسطر الأخرى، None عند [DONE])"""
+    if not line.startswith('data:'):
+        return ''
+    data = line[5:].strip()
+    if data == '[DONE]':
+        return None
+    choices = json.loads(data).get('choices') or [{}]
+    return (choices[0].get('delta') or {}).get('content') or ''
+
+
+class DeepSeekClient:
+    """عميل واحد لكل العملية: مجمع اتصالات وحد للطلبات المتزامنة"""
+
+    def __init__(self, max_concurrency: int = MAX_CONCURRENCY, connect_timeout: float = CONNECT_TIMEOUT,
+                 timeout: float = DEFAULT_TIMEOUT):
+        self.max_concurrency = max_concurrency
+        self.connect_timeout = connect_timeout
+        self.timeout = timeout
+        self.http2 = httpx is not None and (HTTP2_SETTING in ('1', 'true', 'on')
+                                            or (HTTP2_SETTING == 'auto' and H2_AVAILABLE))
+        self.transport = ('httpx+http2' if self.http2 else 'httpx') if httpx is not None else 'requests'
+        self.requests_sent = 0
+        self.failures = 0
+        self.total_seconds = 0.0
+        self.in_flight = 0
+        self._lock = threading.Lock()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._thread: Optional[threading.Thread] = None
+        self._async_client = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._session: Optional[requests.Session] = None
+        self._session_slots = threading.BoundedSemaphore(max_concurrency)
+
+    # -- event loop -------------------------------------------------------
+
+    def _ensure_loop(self) -> asyncio.AbstractEventLoop:
+        """حلقة الأحداث المشتركة (تُنشأ عند أول استخدام في خيط خلفي)"""
+        with self._lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                ready = threading.Event()
+
+                def serve():
+                    asyncio.set_event_loop(loop)
+                    loop.call_soon(ready.set)
+                    loop.run_forever()
+
+                self._thread = threading.Thread(target=serve, name='deepseek-client', daemon=True)
+                self._thread.start()
+                ready.wait()
+                self._loop = loop
+            return self._loop
+
+    def run(self, coroutine: Awaitable[Any], timeout: Optional[float] = None) -> Any:
+        """تشغيل coroutine على الحلقة المشتركة وانتظار نتيجتها من كود متزامن"""
+        loop = self._ensure_loop()
+        if threading.current_thread() is self._thread:
+            raise RuntimeError("DeepSeekClient.run() called from its own event loop; await the coroutine instead")
+        return asyncio.run_coroutine_threadsafe(coroutine, loop).result(timeout)
+
+    # -- transports -------------------------------------------------------
+
+    def _http_client(self):
+        if self._async_client is None:
+            self._async_client = httpx.AsyncClient(
+                http2=self.http2,
+                timeout=httpx.Timeout(self.timeout, connect=self.connect_timeout),
+                limits=httpx.Limits(max_connections=self.max_concurrency,
+                                    max_keepalive_connections=self.max_concurrency),
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._async_client
+
+    def _requests_session(self) -> requests.Session:
+        with self._lock:
+            if self._session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+                session.mount('https://', adapter)
+                session.mount('http://', adapter)
+                self._session = session
+            return self._session
+
+    def _record(self, started: float, failed: bool) -> None:
+        with self._lock:
+            self.requests_sent += 1
+            self.failures += failed
+            self.total_seconds += time.perf_counter() - started
+
+    async def _post_httpx(self, url: str, payload: Dict[str, Any], headers: Dict[str, str],
+                          timeout: float) -> ChatResponse:
+        client = self._http_client()
+        started = time.perf_counter()
+        failed = True
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                response = await client.post(url, json=payload, headers=headers,
+                                             timeout=httpx.Timeout(timeout, connect=self.connect_timeout))
+                failed = response.status_code >= 500
+                return ChatResponse(response.status_code, response.text, time.perf_counter() - started,
+                                    response.http_version, _retry_after(response.headers))
+            finally:
+                self.in_flight -= 1
+                self._record(started, failed)
+
+    def _post_requests(self, url: str, payload: Dict[str, Any], headers: Dict[str, str],
+                       timeout: float) -> ChatResponse:
+        session = self._requests_session()
+        started = time.perf_counter()
+        failed = True
+        with self._session_slots:
+            with self._lock:
+                self.in_flight += 1
+            try:
+                response = session.post(url, json=payload, headers=headers, timeout=(self.connect_timeout, timeout))
+                failed = response.status_code >= 500
+                return ChatResponse(response.status_code, response.text, time.perf_counter() - started,
+                                    retry_after=_retry_after(response.headers))
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self._record(started, failed)
+
+    async def _stream_httpx(self, url: str, payload: Dict[str, Any], headers: Dict[str, str],
+                            timeout: float, sink: 'queue.Queue[Any]') -> None:
+        client = self._http_client()
+        started = time.perf_counter()
+        failed = True
+        async with self._semaphore:
+            self.in_flight += 1
+            try:
+                async with client.stream('POST', url, json=payload, headers=headers,
+                                         timeout=httpx.Timeout(timeout, connect=self.connect_timeout)) as response:
+                    if response.status_code != 200:
+                        failed = response.status_code >= 500
+                        body = await response.aread()
+                        raise DeepSeekStreamError(response.status_code, body.decode('utf-8', 'replace'),
+                                                  _retry_after(response.headers))
+                    async for line in response.aiter_lines():
+                        delta = _stream_delta(line)
+                        if delta is None:
+                            break
+                        if delta:
+                            sink.put(delta)
+                failed = False
+            finally:
+                self.in_flight -= 1
+                self._record(started, failed)
+
+    def _stream_requests(self, url: str, payload: Dict[str, Any], headers: Dict[str, str],
+                         timeout: float) -> Iterator[str]:
+        session = self._requests_session()
+        started = time.perf_counter()
+        failed = True
+        with self._session_slots:
+            with self._lock:
+                self.in_flight += 1
+            try:
+                with session.post(url, json=payload, headers=headers, timeout=(self.connect_timeout, timeout),
+                                  stream=True) as response:
+                    if response.status_code != 200:
+                        failed = response.status_code >= 500
+                        raise DeepSeekStreamError(response.status_code, response.text, _retry_after(response.headers))
+                    # text/event-stream has no charset; requests would assume latin-1
+                    response.encoding = 'utf-8'
+                    for line in response.iter_lines(decode_unicode=True):
+                        delta = _stream_delta(line or '')
+                        if delta is None:
+                            break
+                        if delta:
+                            yield delta
+                failed = False
+            finally:
+                with self._lock:
+                    self.in_flight -= 1
+                self._record(started, failed)
+
+    # -- public API -------------------------------------------------------
+
+    @staticmethod
+    def _headers(api_key: str) -> Dict[str, str]:
+        return {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+
+    async def achat(self, payload: Dict[str, Any], api_key: str, timeout: Optional[float] = None,
+                    url: str = CHAT_URL) -> ChatResponse:
+        """طلب chat/completions من أي حلقة أحداث"""
+        timeout = timeout or self.timeout
+        headers = self._headers(api_key)
+        if httpx is None:
+            return await asyncio.get_running_loop().run_in_executor(
+                None, self._post_requests, url, payload, headers, timeout)
+        loop = self._ensure_loop()
+        coroutine = self._post_httpx(url, payload, headers, timeout)
+        if asyncio.get_running_loop() is loop:
+            return await coroutine
+        # the pooled AsyncClient belongs to the shared loop
+        return await asyncio.wrap_future(asyncio.run_coroutine_threadsafe(coroutine, loop))
+
+    def chat(self, payload: Dict[str, Any], api_key: str, timeout: Optional[float] = None,
+             url: str = CHAT_URL) -> ChatResponse:
+        """طلب chat/completions من كود متزامن"""
+        timeout = timeout or self.timeout
+        if httpx is None:
+            return self._post_requests(url, payload, self._headers(api_key), timeout)
+        return self.run(self._post_httpx(url, payload, self._headers(api_key), timeout))
+
+    def stream_chat(self, payload: Dict[str, Any], api_key: str, timeout: Optional[float] = None,
+                    url: str = CHAT_URL) -> Iterator[str]:
+        """طلب chat/completions بالبث: يعيد أجزاء نص الإجابة فور وصولها
+
+        timeout bounds the wait for each chunk, not the whole answer.
+        Raises DeepSeekStreamError when the API answers with an error status.
+        """
+        timeout = timeout or self.timeout
+        payload = dict(payload, stream=True)
+        headers = self._headers(api_key)
+        if httpx is None:
+            yield from self._stream_requests(url, payload, headers, timeout)
+            return
+
+        sink: 'queue.Queue[Any]' = queue.Queue()
+        future = asyncio.run_coroutine_threadsafe(
+            self._stream_httpx(url, payload, headers, timeout, sink), self._ensure_loop())
+        future.add_done_callback(lambda _: sink.put(_END))
+        try:
+            while True:
+                try:
+                    item = sink.get(timeout=timeout)
+                except queue.Empty:
+                    raise TimeoutError(f"No DeepSeek stream data for {timeout}s")
+                if item is _END:
+                    break
+                yield item
+            future.result()
+        finally:
+            # the reader went away (client disconnected): stop reading from DeepSeek
+            if not future.done():
+                future.cancel()
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'transport': self.transport,
+            'max_concurrency': self.max_concurrency,
+            'connect_timeout': self.connect_timeout,
+            'timeout': self.timeout,
+            'requests': self.requests_sent,
+            'failures': self.failures,
+            'in_flight': self.in_flight,
+            'average_seconds': round(self.total_seconds / self.requests_sent, 3) if self.requests_sent else None,
+        }
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+deepseek_client = DeepSeekClient()
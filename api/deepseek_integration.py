@@ -5,13 +5,35 @@ ITPF Legal System - DeepSeek API Integration
 
 import json
 import os
-import asyncio
-import requests
+import time
 from typing import Dict, Any, List, Optional
 
+try:
+    from .arabic_normalizer import normalize_arabic
+    from .deepseek_client import BASE_URL, deepseek_client
+    from .deepseek_keys import key_pool, pooled_achat, valid_key
+    from .model_router import classify, model_router
+    from .passage_index import excerpt
+    from .prompt_builder import ContextItem, build_prompt, log_prompt_report, max_output_tokens
+    from .request_state import RequestField
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from arabic_normalizer import normalize_arabic
+    from deepseek_client import BASE_URL, deepseek_client
+    from deepseek_keys import key_pool, pooled_achat, valid_key
+    from model_router import classify, model_router
+    from passage_index import excerpt
+    from prompt_builder import ContextItem, build_prompt, log_prompt_report, max_output_tokens
+    from request_state import RequestField
+
 class DeepSeekIntegration:
     """تكامل متقدم مع DeepSeek API لتحليل قانوني ذكي"""
     
+    # بيانات الطلب الحالي: لكل طلب متزامن قيمته (request_state)
+    last_prompt_report = RequestField()
+    last_route = RequestField()
+    
     def __init__(self):
         """تهيئة النظام مع مفاتيح API المتعددة مع تشخيص شامل"""
         self.api_keys = []
@@ -29,9 +51,8 @@ class DeepSeekIntegration:
             if value:
                 print(f"✅ {var_name}: {value[:12]}...{value[-6:]} (طول: {len(value)})")
                 # التحقق من صحة المفتاح
-                if len(value) > 20 and value.startswith('sk-'):
-                    self.api_keys.append(value)
-                    print(f"🔑 تم إضافة مفتاح صالح: {var_name}")
+                if valid_key(value):
+                    print(f"🔑 مفتاح صالح: {var_name}")
                 else:
                     print(f"⚠️ مفتاح غير صالح: {var_name} - لا يبدأ بـ sk- أو قصير جداً")
             else:
@@ -56,64 +77,25 @@ class DeepSeekIntegration:
             if alt_key and len(alt_key) > 20:
                 print(f"🔄 وُجد مفتاح بديل محتمل: {alt_key[:8]}...{alt_key[-4:]}")
         
+        # المفاتيح الفعلية من المجمع المشترك (قواطع دائرة وتوزيع حمل لكل مفتاح)
+        self.api_keys = key_pool.values()
+        
         if not self.api_keys:
             print("❌ لم يتم العثور على مفاتيح API صالحة")
             print("📝 التشخيص الكامل:")
             print(f"   - عدد متغيرات البيئة: {len(os.environ)}")
             print(f"   - متغيرات ذات صلة: {list(relevant_vars.keys())}")
             print("   - سبب محتمل: مفاتيح API غير محملة في بيئة Vercel")
-            
-            # إضافة مفتاح وهمي لمنع الأخطاء
-            self.api_keys = ['sk-dummy-key-for-testing']
         else:
             print(f"✅ تم العثور على {len(self.api_keys)} مفتاح API صالح")
         
-        self.current_key_index = 0
-        self.base_url = "https://api.deepseek.com/v1"
-        self.client = None
-        self._setup_client()
-    
-    def _setup_client(self):
-        """إعداد عميل API مع تبديل المفاتيح التلقائي"""
-        # Using requests instead of OpenAI client for better compatibility
-        self.current_api_key = self.api_keys[self.current_key_index] if self.api_keys else None
-    
-    def _switch_api_key(self):
-        """تبديل مفتاح API في حالة الخطأ"""
-        self.current_key_index = (self.current_key_index + 1) % len(self.api_keys)
-        self._setup_client()
+        self.base_url = BASE_URL
+        self.client = deepseek_client
+        self.key_pool = key_pool
     
     def analyze_query_complexity(self, question: str) -> str:
-        """تحليل تعقيد السؤال لتحديد النمط المناسب"""
-        question_lower = question.lower()
-        
-        # مؤشرات التعقيد العالي
-        complex_indicators = [
-            'قارن', 'اربط', 'حلل', 'استنتج', 'ما الفرق', 'كيف يؤثر',
-            'ما العلاقة', 'في أي حالة', 'متى يجب', 'كيف يمكن',
-            'compare', 'analyze', 'relate', 'difference', 'relationship'
-        ]
-        
-        # مؤشرات البحث البسيط
-        simple_indicators = [
-            'ما هي', 'ما هو', 'اذكر', 'عرف', 'what is', 'define', 'list'
-        ]
-        
-        # أسئلة عن الملاحق تحتاج تحليل متخصص
-        if 'ملحق' in question_lower or 'appendix' in question_lower:
-            return 'deepseek_reasoner'
-        
-        # فحص مؤشرات التعقيد
-        for indicator in complex_indicators:
-            if indicator in question_lower:
-                return 'deepseek_reasoner'
-        
-        for indicator in simple_indicators:
-            if indicator in question_lower:
-                return 'local_fast'
-                
-        # افتراضي للأسئلة المتوسطة
-        return 'deepseek_chat'
+        """تحليل تعقيد السؤال لتحديد النمط المناسب (local_fast / deepseek_chat / deepseek_reasoner)"""
+        return classify(question)
     
     def create_legal_prompt(self, question: str, context: List[Dict[str, Any]], mode: str, language: str = 'arabic') -> str:
         """إنشاء prompt متخصص للتحليل القانوني"""
@@ -177,92 +159,37 @@ Your methodology:
 - لغة واضحة ومفهومة
 - تركيز على الجوانب العملية"""
 
-        # تحضير السياق القانوني
-        context_text = ""
-        if context:
-            context_text = "\n\nالمراجع القانونية المتاحة:\n"
-            for i, ref in enumerate(context[:5], 1):
-                context_text += f"{i}. المادة {ref.get('article_number', 'غير محدد')}: {ref.get('title', '')}\n"
-                context_text += f"   النص: {ref.get('content', '')[:300]}...\n\n"
+        # تحضير السياق القانوني (أنسب الجمل للسؤال بدلاً من أول 300 حرف)
+        context_items = [
+            ContextItem(f"{i}. المادة {ref.get('article_number', 'غير محدد')}: {ref.get('title', '')}",
+                        excerpt(ref.get('content', ''), question.split(), 300),
+                        float(ref.get('score', 0) or 0))
+            for i, ref in enumerate(context[:5], 1)
+        ]
         
-        user_prompt = f"""السؤال: {question}
+        user_template = """السؤال: {question}
 
-{context_text}
+{context}
 
 يرجى تقديم إجابة شاملة ودقيقة مع الاستناد للمواد القانونية المحددة."""
+        if context_items:
+            user_template = user_template.replace('{context}', 'المراجع القانونية المتاحة:\n{context}')
 
-        return system_prompt, user_prompt
+        # تجميع البرومبت ضمن ميزانية الرموز
+        prompt = build_prompt(system_prompt, question, context_items, user_template, mode=mode)
+        self.last_prompt_report = prompt.report.to_dict()
+        log_prompt_report(prompt.report)
+        return prompt.system, prompt.user
     
-    async def get_deepseek_response(self, question: str, context: List[Dict[str, Any]], mode: str) -> Dict[str, Any]:
-        """الحصول على استجابة من DeepSeek API"""
-        try:
-            system_prompt, user_prompt = self.create_legal_prompt(question, context, mode)
-            
-            model = "deepseek-reasoner" if mode == "deepseek_reasoner" else "deepseek-chat"
-            
-            response = self.client.chat.completions.create(
-                model=model,
-                messages=[
-                    {"role": "system", "content": system_prompt},
-                    {"role": "user", "content": user_prompt}
-                ],
-                max_tokens=4000 if mode == "deepseek_chat" else 8000,
-                temperature=0.1,
-                stream=False
-            )
-            
-            return {
-                "success": True,
-                "response": response.choices[0].message.content,
-                "model_used": model,
-                "tokens_used": response.usage.total_tokens if hasattr(response, 'usage') else 0
-            }
-            
-        except Exception as e:
-            # محاولة تبديل مفتاح API
-            self._switch_api_key()
-            
-            # محاولة ثانية
-            try:
-                response = self.client.chat.completions.create(
-                    model=model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    max_tokens=4000 if mode == "deepseek_chat" else 8000,
-                    temperature=0.1,
-                    stream=False
-                )
-                
-                return {
-                    "success": True,
-                    "response": response.choices[0].message.content,
-                    "model_used": model,
-                    "tokens_used": response.usage.total_tokens if hasattr(response, 'usage') else 0
-                }
-                
-            except Exception as e2:
-                return {
-                    "success": False,
-                    "error": f"خطأ في API: {str(e2)}",
-                    "fallback_needed": True
-                }
+    async def get_deepseek_response(self, question: str, context: List[Dict[str, Any]], mode: str,
+                                    timeout: float = 60) -> Dict[str, Any]:
+        """الحصول على استجابة من DeepSeek API (مع تبديل المفاتيح عند الفشل)"""
+        return await self._get_deepseek_response_with_retry(question, context, mode, timeout=timeout)
     
     def enhance_arabic_text(self, text: str) -> str:
         """تحسين النص العربي للمعالجة الأفضل"""
-        # توحيد الحروف العربية
-        replacements = {
-            'أ': 'ا', 'إ': 'ا', 'آ': 'ا',
-            'ة': 'ه',
-            'ى': 'ي'
-        }
-        
-        enhanced_text = text
-        for old, new in replacements.items():
-            enhanced_text = enhanced_text.replace(old, new)
-        
-        return enhanced_text
+        # توحيد الحروف العربية وإزالة التشكيل (نفس توحيد الفهرس)
+        return normalize_arabic(text)
     
     def create_enhanced_summary(self, question: str, deepseek_response: str, local_results: List[Dict[str, Any]]) -> str:
         """إنشاء ملخص محسن يجمع بين DeepSeek والنتائج المحلية"""
@@ -286,111 +213,103 @@ Your methodology:
 
         return enhanced_summary
 
+    def create_local_summary(self, question: str, legal_context: List[Dict[str, Any]], language: str = 'arabic') -> str:
+        """إجابة محلية من أنسب جمل المراجع (مسار local_fast وبديل DeepSeek)"""
+        terms = question.split()
+        lines = []
+        for item in legal_context[:3]:
+            label = item.get('title') or item.get('article_number', '')
+            lines.append(f"**{label}**\n{excerpt(str(item.get('content', '')), terms, 300)}")
+        if not lines:
+            return ("No matching legal text was found for this question." if language == 'english'
+                    else "لم يتم العثور على نص قانوني مطابق لهذا السؤال.")
+        heading = "**Relevant legal texts:**" if language == 'english' else "**النصوص القانونية ذات الصلة:**"
+        return heading + "\n\n" + "\n\n".join(lines)
+
     def generate_intelligent_legal_response(self, question: str, legal_context: List[Dict[str, Any]], language: str = 'arabic') -> str:
-        """Generate intelligent legal response using DeepSeek API with real integration"""
-        try:
-            # Analyze question complexity to choose appropriate model
-            mode = self.analyze_query_complexity(question)
-            print(f"🔍 Question complexity analysis: {mode}")
-            
-            # Get DeepSeek response with retry logic
-            result = asyncio.run(self._get_deepseek_response_with_retry(question, legal_context, mode, language))
-            
+        """Generate a legal response on the route chosen by the model router
+
+        Definitional and lookup questions are answered locally; chat and
+        reasoner questions go to DeepSeek within the route's latency budget
+        and fall back to the cheaper route on timeout or failure. The route
+        decision is kept in self.last_route.
+        """
+        decision = model_router.decide(question)
+        print(f"🔍 Question complexity analysis: {decision.requested} -> {decision.route}")
+        
+        def remote(route: str, timeout: float) -> Optional[str]:
+            result = self.client.run(self._get_deepseek_response_with_retry(question, legal_context, route, language, timeout))
             if result.get("success"):
                 print(f"✅ DeepSeek API call successful, tokens used: {result.get('tokens_used', 'unknown')}")
                 return result["response"]
-            else:
-                error_msg = result.get('error', 'Unknown error')
-                print(f"❌ DeepSeek API call failed: {error_msg}")
-                return f"AI analysis unavailable: {error_msg}"
-                
-        except Exception as e:
-            print(f"❌ DeepSeek integration error: {str(e)}")
-            return f"AI system error: {str(e)}"
-
-    async def _get_deepseek_response_with_retry(self, question: str, context: List[Dict[str, Any]], mode: str, language: str = 'arabic') -> Dict[str, Any]:
-        """Enhanced DeepSeek API call with retry logic using requests"""
-        max_retries = len(self.api_keys) if self.api_keys else 1
+            print(f"❌ DeepSeek API call failed: {result.get('error', 'Unknown error')}")
+            return None
         
-        for attempt in range(max_retries):
-            try:
-                system_prompt, user_prompt = self.create_legal_prompt(question, context, mode, language)
-                
-                model = "deepseek-reasoner" if mode == "deepseek_reasoner" else "deepseek-chat"
-                print(f"🤖 Calling DeepSeek API with model: {model} (attempt {attempt + 1}/{max_retries})")
-                
-                if not self.current_api_key:
-                    raise Exception("No API key available")
-                
-                # Use requests for direct API call
-                headers = {
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.current_api_key}"
-                }
-                
-                payload = {
-                    "model": model,
-                    "messages": [
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    "max_tokens": 4000 if mode == "deepseek_chat" else 8000,
-                    "temperature": 0.1,
-                    "stream": False
-                }
-                
-                print(f"🔑 Using API key: {self.current_api_key[:8]}...{self.current_api_key[-4:]}")
-                
-                response = requests.post(
-                    f"{self.base_url}/chat/completions",
-                    headers=headers,
-                    json=payload,
-                    timeout=60
-                )
-                
-                print(f"📡 HTTP Status: {response.status_code}")
-                
-                if response.status_code == 200:
-                    result = response.json()
-                    message_content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
-                    
-                    if message_content:
-                        print("✅ DeepSeek API call successful")
-                        return {
-                            "success": True,
-                            "response": message_content,
-                            "model_used": model,
-                            "tokens_used": result.get('usage', {}).get('total_tokens', 0)
-                        }
-                    else:
-                        raise Exception("Empty response from DeepSeek")
-                        
-                elif response.status_code == 401:
-                    error_msg = f"Authentication failed with key {self.current_api_key[:8]}..."
-                    print(f"❌ {error_msg}")
-                    raise Exception(error_msg)
-                    
-                elif response.status_code == 402:
-                    raise Exception("Insufficient balance - need to add funds")
-                    
-                else:
-                    error_data = response.json() if response.content else {}
-                    raise Exception(f"HTTP {response.status_code}: {error_data}")
-                
-            except Exception as e:
-                print(f"⚠️ API call attempt {attempt + 1} failed: {str(e)}")
+        answer = model_router.run_sync(decision, remote,
+                                       lambda: self.create_local_summary(question, legal_context, language))
+        self.last_route = decision.to_dict()
+        return answer
+
+    async def _get_deepseek_response_with_retry(self, question: str, context: List[Dict[str, Any]], mode: str, language: str = 'arabic',
+                                                timeout: float = 60) -> Dict[str, Any]:
+        """DeepSeek API call through the key pool (moves to the next healthy key on key errors)"""
+        try:
+            system_prompt, user_prompt = self.create_legal_prompt(question, context, mode, language)
+            
+            model = "deepseek-reasoner" if mode == "deepseek_reasoner" else "deepseek-chat"
+            print(f"🤖 Calling DeepSeek API with model: {model} ({len(self.key_pool)} keys in pool)")
+            
+            payload = {
+                "model": model,
+                "messages": [
+                    {"role": "system", "content": system_prompt},
+                    {"role": "user", "content": user_prompt}
+                ],
+                "max_tokens": max_output_tokens(mode),
+                "temperature": 0.1,
+                "stream": False
+            }
+            
+            # كل محاولات المفاتيح معاً ضمن المهلة
+            response = await pooled_achat(payload, timeout=timeout, deadline=time.perf_counter() + timeout)
+            if response is None:
+                raise Exception("No healthy API key available")
+            
+            print(f"📡 HTTP Status: {response.status_code}")
+            
+            if response.status_code == 200:
+                result = response.json()
+                message_content = result.get('choices', [{}])[0].get('message', {}).get('content', '')
                 
-                # Try next API key if available
-                if attempt < max_retries - 1 and self.api_keys:
-                    self._switch_api_key()
-                    print(f"🔄 Switching to API key {self.current_key_index + 1}")
-                else:
-                    # All attempts failed
+                if message_content:
+                    print("✅ DeepSeek API call successful")
                     return {
-                        "success": False,
-                        "error": f"All API attempts failed. Last error: {str(e)}",
-                        "fallback_needed": True
+                        "success": True,
+                        "response": message_content,
+                        "model_used": model,
+                        "tokens_used": result.get('usage', {}).get('total_tokens', 0),
+                        "prompt_tokens": self.last_prompt_report
                     }
+                else:
+                    raise Exception("Empty response from DeepSeek")
+            
+            elif response.status_code == 401:
+                raise Exception("Authentication failed for every available key")
+            
+            elif response.status_code == 402:
+                raise Exception("Insufficient balance - need to add funds")
+            
+            else:
+                error_data = response.json() if response.content else {}
+                raise Exception(f"HTTP {response.status_code}: {error_data}")
+            
+        except Exception as e:
+            print(f"⚠️ DeepSeek API call failed: {str(e)}")
+            return {
+                "success": False,
+                "error": f"All API attempts failed. Last error: {str(e)}",
+                "fallback_needed": True
+            }
 
 # إنشاء مثيل عام للاستخدام
 deepseek_integration = DeepSeekIntegration()
\ No newline at end of file
@@ -0,0 +1,310 @@
+"""
+ITPF Legal System - DeepSeek API Key Pool
+مجمع مفاتيح DeepSeek مع قواطع دائرة لكل مفتاح
+
+Each endpoint used to find its own keys in the environment and rotate to the
+next one only after an exception (answer.py even re-scanned the environment
+on every failed request), so a key that had run out of balance or was
+rate limited was tried again on the next question. The pool keeps per-key
+health and a circuit breaker:
+
+    closed     the key is healthy and takes traffic
+    open       the key is skipped until its cooldown ends
+               401 (bad key) -> AUTH_COOLDOWN, 402 (no balance) -> QUOTA_COOLDOWN,
+               429 -> Retry-After or RATE_LIMIT_COOLDOWN,
+               FAILURE_THRESHOLD consecutive 5xx/network errors -> BASE_COOLDOWN,
+               doubled on every reopen up to MAX_COOLDOWN
+    half_open  the cooldown is over: one probe request at a time; success
+               closes the breaker, failure reopens it
+
+Healthy keys are picked by fewest requests in flight, then least recently
+used, so load spreads across them. pooled_chat() / pooled_achat() send a
+request through deepseek_client and move on to the next healthy key on
+errors another key could avoid.
+"""
+
+import asyncio
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+
+try:
+    from .deepseek_client import CHAT_URL, ChatResponse, deepseek_client
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from deepseek_client import CHAT_URL, ChatResponse, deepseek_client
+
+# أسماء متغيرات البيئة التي قد تحمل مفاتيح DeepSeek (بترتيب الأولوية)
+KEY_ENV_VARS = ['DEEPSEEK_API_KEY', 'DEEPSEEK_API_KEY_1', 'DEEPSEEK_API_KEY_2', 'DEEPSEEK_API_KEY_3',
+                'deepseek_api_key', 'DEEPSEEK_TOKEN', 'deepseek_token']
+FAILURE_THRESHOLD = int(os.getenv('DEEPSEEK_KEY_FAILURE_THRESHOLD', '3'))
+BASE_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_COOLDOWN', '30'))
+MAX_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_MAX_COOLDOWN', '600'))
+RATE_LIMIT_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_RATE_LIMIT_COOLDOWN', '20'))
+QUOTA_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_QUOTA_COOLDOWN', '1800'))
+AUTH_COOLDOWN = float(os.getenv('DEEPSEEK_KEY_AUTH_COOLDOWN', '3600'))
+# لا تُبدأ محاولة بعيدة (مفتاح آخر أو مسار أعلى) إذا تبقى أقل من هذا من المهلة
+MIN_REMOTE_SECONDS = float(os.getenv('ITPF_ROUTE_MIN_REMOTE_SECONDS', '3'))
+# أقل فاصل بين إعادة قراءة البيئة عندما يكون المجمع فارغاً
+RESCAN_INTERVAL = 60.0
+LATENCY_ALPHA = 0.3
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+
+def valid_key(value: Optional[str]) -> bool:
+    """مفتاح DeepSeek بالشكل المتوقع (sk-... وطول معقول)"""
+    return bool(value) and len(value) > 20 and value.startswith('sk-')
+
+
+def mask_key(value: str) -> str:
+    return f"{value[:8]}...{value[-4:]}" if len(value) > 12 else 'short_value'
+
+
+@dataclass
+class KeyState:
+    """صحة مفتاح واحد وحالة قاطع الدائرة الخاص به"""
+    name: str
+    value: str
+    state: str = CLOSED
+    requests: int = 0
+    errors: int = 0
+    consecutive_failures: int = 0
+    in_flight: int = 0
+    latency: Optional[float] = None
+    opened_until: float = 0.0
+    cooldown: float = 0.0
+    quota_exhausted: bool = False
+    last_status: Optional[int] = None
+    last_error: str = ''
+    last_used: float = 0.0
+
+    def to_dict(self, now: float) -> Dict[str, Any]:
+        return {
+            'name': self.name,
+            'key': mask_key(self.value),
+            'state': self.state,
+            'requests': self.requests,
+            'errors': self.errors,
+            'error_rate': round(self.errors / self.requests, 4) if self.requests else 0.0,
+            'consecutive_failures': self.consecutive_failures,
+            'in_flight': self.in_flight,
+            'latency_ms': round(self.latency * 1000) if self.latency is not None else None,
+            'quota_exhausted': self.quota_exhausted,
+            'retry_in_seconds': round(max(0.0, self.opened_until - now), 1) if self.state == OPEN else 0.0,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+        }
+
+
+class KeyLease:
+    """مفتاح مستعار لطلب واحد؛ يُعاد إلى المجمع بـ release()"""
+
+    def __init__(self, slot: KeyState, probe: bool):
+        self.slot = slot
+        self.probe = probe
+        self.started = time.perf_counter()
+
+    @property
+    def key(self) -> str:
+        return self.slot.value
+
+    @property
+    def name(self) -> str:
+        return self.slot.name
+
+
+class DeepSeekKeyPool:
+    """مفاتيح DeepSeek مع توزيع الحمل وقواطع الدائرة"""
+
+    def __init__(self):
+        self.slots: List[KeyState] = []
+        self._lock = threading.Lock()
+        self._scanned_at = 0.0
+        self.reload()
+
+    def reload(self) -> int:
+        """قراءة المفاتيح من البيئة (تحتفظ بحالة المفاتيح المعروفة)"""
+        with self._lock:
+            known = {slot.value: slot for slot in self.slots}
+            slots = []
+            for name in KEY_ENV_VARS:
+                value = os.environ.get(name, '').strip()
+                if valid_key(value) and value not in {slot.value for slot in slots}:
+                    slots.append(known.get(value) or KeyState(name, value))
+            self.slots = slots
+            self._scanned_at = time.time()
+            return len(slots)
+
+    def __len__(self) -> int:
+        return len(self.slots)
+
+    def values(self) -> List[str]:
+        return [slot.value for slot in self.slots]
+
+    def _refresh(self, slot: KeyState, now: float) -> None:
+        if slot.state == OPEN and now >= slot.opened_until:
+            slot.state = HALF_OPEN
+
+    def acquire(self) -> Optional[KeyLease]:
+        """أنسب مفتاح سليم للطلب التالي، أو None إذا كانت كل المفاتيح معطلة"""
+        if not self.slots and time.time() - self._scanned_at > RESCAN_INTERVAL:
+            self.reload()
+        now = time.time()
+        with self._lock:
+            for slot in self.slots:
+                self._refresh(slot, now)
+            # a key whose cooldown is over gets one probe request at a time;
+            # a failed probe costs the caller one retry on a healthy key
+            probes = [slot for slot in self.slots if slot.state == HALF_OPEN and slot.in_flight == 0]
+            healthy = [slot for slot in self.slots if slot.state == CLOSED]
+            if probes:
+                slot = min(probes, key=lambda slot: slot.opened_until)
+                probe = True
+            elif healthy:
+                slot = min(healthy, key=lambda slot: (slot.in_flight, slot.last_used))
+                probe = False
+            else:
+                return None
+            slot.in_flight += 1
+            slot.last_used = now
+            return KeyLease(slot, probe)
+
+    def release(self, lease: KeyLease, status_code: Optional[int] = None, error: str = '',
+                retry_after: Optional[float] = None) -> None:
+        """تسجيل نتيجة الطلب: status_code من DeepSeek أو error عند فشل الاتصال"""
+        slot = lease.slot
+        now = time.time()
+        with self._lock:
+            slot.in_flight -= 1
+            slot.requests += 1
+            slot.last_status = status_code
+            if status_code is not None and status_code < 400:
+                elapsed = time.perf_counter() - lease.started
+                slot.latency = elapsed if slot.latency is None else (
+                    LATENCY_ALPHA * elapsed + (1 - LATENCY_ALPHA) * slot.latency)
+                slot.state = CLOSED
+                slot.consecutive_failures = 0
+                slot.cooldown = 0.0
+                slot.quota_exhausted = False
+                return
+            if status_code is not None and 400 <= status_code < 500 and status_code not in (401, 402, 429):
+                # the request was bad, not the key
+                return
+
+            slot.errors += 1
+            slot.consecutive_failures += 1
+            slot.last_error = error or f"HTTP {status_code}"
+            if status_code == 401:
+                self._open(slot, now, AUTH_COOLDOWN)
+            elif status_code == 402:
+                slot.quota_exhausted = True
+                self._open(slot, now, QUOTA_COOLDOWN)
+            elif status_code == 429:
+                self._open(slot, now, retry_after or RATE_LIMIT_COOLDOWN)
+            elif lease.probe or slot.consecutive_failures >= FAILURE_THRESHOLD:
+                self._open(slot, now, min(MAX_COOLDOWN, slot.cooldown * 2 or BASE_COOLDOWN))
+
+    def cancel(self, lease: KeyLease) -> None:
+        """إعادة مفتاح دون نتيجة (انقطع العميل قبل اكتمال الطلب)"""
+        with self._lock:
+            lease.slot.in_flight -= 1
+
+    def _open(self, slot: KeyState, now: float, cooldown: float) -> None:
+        slot.state = OPEN
+        slot.cooldown = cooldown
+        slot.opened_until = now + cooldown
+        print(f"🔌 DeepSeek key {slot.name} disabled for {cooldown:.0f}s ({slot.last_error})")
+
+    def stats(self) -> Dict[str, Any]:
+        now = time.time()
+        with self._lock:
+            for slot in self.slots:
+                self._refresh(slot, now)
+            keys = [slot.to_dict(now) for slot in self.slots]
+        return {
+            'total_keys': len(keys),
+            'healthy_keys': sum(key['state'] == CLOSED for key in keys),
+            'keys': keys,
+        }
+
+
+def retryable(status_code: Optional[int]) -> bool:
+    """خطأ قد لا يتكرر مع مفتاح آخر (None = فشل الاتصال)"""
+    return status_code is None or status_code in (401, 402, 429) or status_code >= 500
+
+
+def _attempt_timeout(timeout: Optional[float], deadline: Optional[float], first: bool) -> Tuple[bool, Optional[float]]:
+    """(هل تُجرب المحاولة، مهلتها): كل مفتاح يأخذ ما تبقى حتى الموعد النهائي فقط
+
+    A retry on another key is not started once fewer than MIN_REMOTE_SECONDS
+    are left, so N keys can no longer take N times the caller's budget.
+    """
+    if deadline is None:
+        return True, timeout
+    remaining = deadline - time.perf_counter()
+    if remaining <= 0 or (not first and remaining < MIN_REMOTE_SECONDS):
+        return False, None
+    return True, remaining if timeout is None else min(timeout, remaining)
+
+
+def pooled_chat(payload: Dict[str, Any], timeout: Optional[float] = None,
+                url: str = CHAT_URL, deadline: Optional[float] = None) -> Optional[ChatResponse]:
+    """deepseek_client.chat() بالمفاتيح السليمة: ينتقل للمفتاح التالي عند الأخطاء القابلة لذلك
+
+    timeout caps each attempt; deadline (a time.perf_counter() value) caps
+    them all together. Returns the last response, or None when no key was
+    available, every attempt failed to connect or the deadline ran out.
+    """
+    response = None
+    for attempt in range(max(1, len(key_pool))):
+        proceed, attempt_timeout = _attempt_timeout(timeout, deadline, attempt == 0)
+        if not proceed:
+            break
+        lease = key_pool.acquire()
+        if lease is None:
+            break
+        try:
+            response = deepseek_client.chat(payload, lease.key, timeout=attempt_timeout, url=url)
+        except Exception as e:
+            print(f"⚠️ DeepSeek request with {lease.name} failed: {str(e)}")
+            key_pool.release(lease, error=str(e))
+            continue
+        key_pool.release(lease, response.status_code, retry_after=response.retry_after)
+        if not retryable(response.status_code):
+            break
+    return response
+
+
+async def pooled_achat(payload: Dict[str, Any], timeout: Optional[float] = None,
+                       url: str = CHAT_URL, deadline: Optional[float] = None) -> Optional[ChatResponse]:
+    """نسخة async من pooled_chat()"""
+    response = None
+    for attempt in range(max(1, len(key_pool))):
+        proceed, attempt_timeout = _attempt_timeout(timeout, deadline, attempt == 0)
+        if not proceed:
+            break
+        lease = key_pool.acquire()
+        if lease is None:
+            break
+        try:
+            response = await deepseek_client.achat(payload, lease.key, timeout=attempt_timeout, url=url)
+        except asyncio.CancelledError:
+            # the caller's latency budget ran out (asyncio.wait_for)
+            key_pool.cancel(lease)
+            raise
+        except Exception as e:
+            print(f"⚠️ DeepSeek request with {lease.name} failed: {str(e)}")
+            key_pool.release(lease, error=str(e))
+            continue
+        key_pool.release(lease, response.status_code, retry_after=response.retry_after)
+        if not retryable(response.status_code):
+            break
+    return response
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+key_pool = DeepSeekKeyPool()
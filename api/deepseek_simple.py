@@ -6,30 +6,32 @@ ITPF Legal System - Simplified DeepSeek Integration
 
 import json
 import os
-import requests
 from typing import Dict, Any, List, Optional
 
+try:
+    from .deepseek_keys import key_pool, pooled_chat
+    from .passage_index import excerpt
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from deepseek_keys import key_pool, pooled_chat
+    from passage_index import excerpt
+
 class SimpleDeepSeekIntegration:
     """تكامل مبسط مع DeepSeek API"""
     
     def __init__(self):
         """تهيئة النظام"""
-        self.api_keys = []
-        self.current_key_index = 0
         self.base_url = "https://api.deepseek.com/v1/chat/completions"
         
-        # جمع مفاتيح API
-        potential_keys = ['DEEPSEEK_API_KEY', 'DEEPSEEK_API_KEY_1', 'DEEPSEEK_API_KEY_2', 'DEEPSEEK_API_KEY_3']
-        
-        for key_name in potential_keys:
-            value = os.environ.get(key_name)
-            if value and len(value) > 20:
-                self.api_keys.append(value)
-                print(f"🔑 DeepSeek Key Found: {key_name}")
+        # مفاتيح API من المجمع المشترك (قواطع دائرة لكل مفتاح)
+        self.api_keys = key_pool.values()
+        for slot in key_pool.slots:
+            print(f"🔑 DeepSeek Key Found: {slot.name}")
         
         print(f"📊 Total DeepSeek API Keys: {len(self.api_keys)}")
         
-        # تعيين المفتاح الحالي
+        # المفتاح الأول للتشخيص فقط؛ الطلبات تختار أنسب مفتاح سليم
         self.current_api_key = self.api_keys[0] if self.api_keys else None
         
         if not self.current_api_key:
@@ -47,7 +49,8 @@ class SimpleDeepSeekIntegration:
             # إعداد السياق القانوني
             context_text = ""
             for item in legal_context[:5]:  # أول 5 مراجع فقط
-                context_text += f"• {item.get('title', 'مادة قانونية')}: {item.get('content', '')[:200]}...\n"
+                # أنسب الجمل للسؤال بدلاً من أول 200 حرف
+                context_text += f"• {item.get('title', 'مادة قانونية')}: {excerpt(item.get('content', ''), question.split(), 200)}\n"
             
             # إعداد النظام
             system_prompt = """أنت خبير قانوني متخصص في قوانين الاتحاد الدولي لالتقاط الأوتاد (ITPF). 
@@ -78,15 +81,13 @@ class SimpleDeepSeekIntegration:
                 "max_tokens": 800
             }
             
-            headers = {
-                "Authorization": f"Bearer {self.current_api_key}",
-                "Content-Type": "application/json"
-            }
+            print("🚀 Calling DeepSeek API...")
             
-            print(f"🚀 Calling DeepSeek API...")
+            # إرسال الطلب عبر العميل المشترك (اتصال دائم) بأنسب مفتاح سليم
+            response = pooled_chat(payload, timeout=30, url=self.base_url)
             
-            # إرسال الطلب
-            response = requests.post(self.base_url, json=payload, headers=headers, timeout=30)
+            if response is None:
+                return "AI analysis unavailable: no healthy API key"
             
             print(f"📊 DeepSeek Response Status: {response.status_code}")
             
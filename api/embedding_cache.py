@@ -0,0 +1,143 @@
+"""
+ITPF Legal Search - Query Embedding Cache
+ذاكرة مؤقتة لتمثيلات الأسئلة المتكررة لتجنب تشغيل النموذج عند كل طلب
+
+Keys are the language plus the question after Arabic normalization, lower
+casing and whitespace/punctuation trimming, so "ما هي شروط المشاركة؟" and
+"ما هى شروط المشاركه" share one entry. The cache is a bounded LRU; when a
+path is configured (ITPF_QUERY_EMBEDDING_CACHE) it is loaded at startup and
+written back every SAVE_INTERVAL new entries, so a warm process hands its
+embeddings to the next one.
+"""
+
+import json
+import logging
+import os
+import threading
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import numpy as np
+
+try:
+    from .arabic_normalizer import normalize_arabic
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from arabic_normalizer import normalize_arabic
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_SIZE = int(os.getenv('ITPF_QUERY_EMBEDDING_CACHE_SIZE', '1024'))
+DEFAULT_PATH = os.getenv('ITPF_QUERY_EMBEDDING_CACHE', '')
+SAVE_INTERVAL = 32
+QUERY_TRIM = ' \t\n?؟.!،,'
+
+
+def normalize_query(query: str) -> str:
+    """الشكل الموحد للسؤال المستخدم كمفتاح"""
+    return ' '.join(normalize_arabic(query).lower().split()).strip(QUERY_TRIM)
+
+
+class QueryEmbeddingCache:
+    """ذاكرة LRU محدودة الحجم لتمثيلات الأسئلة مع عدادات الإصابة"""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, path: str = DEFAULT_PATH, model_name: str = ''):
+        self.max_size = max_size
+        self.path = path
+        self.model_name = model_name
+        self.entries: 'OrderedDict[Tuple[str, str], np.ndarray]' = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._unsaved = 0
+        self._lock = threading.Lock()
+        if self.path:
+            self.load()
+
+    def get(self, query: str, language: str) -> Optional[np.ndarray]:
+        """التمثيل المحفوظ للسؤال أو None"""
+        key = (language, normalize_query(query))
+        with self._lock:
+            embedding = self.entries.get(key)
+            if embedding is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return embedding
+
+    def put(self, query: str, language: str, embedding: Any) -> None:
+        """حفظ تمثيل السؤال (يُحذف الأقدم استخداماً عند الامتلاء)"""
+        embedding = np.array(embedding, dtype=np.float32)
+        embedding.setflags(write=False)
+        key = (language, normalize_query(query))
+        with self._lock:
+            self.entries[key] = embedding
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+            self._unsaved += 1
+            should_save = bool(self.path) and self._unsaved >= SAVE_INTERVAL
+        if should_save:
+            self.save()
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.misses = self._unsaved = 0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'persisted_to': self.path or None,
+        }
+
+    def save(self) -> bool:
+        """كتابة المدخلات إلى القرص (كتابة ذرية)"""
+        if not self.path:
+            return False
+        with self._lock:
+            keys = list(self.entries)
+            vectors = [self.entries[key] for key in keys]
+            self._unsaved = 0
+        try:
+            temp_path = self.path + '.tmp.npz'
+            np.savez(
+                temp_path,
+                keys=np.array([json.dumps(key, ensure_ascii=False) for key in keys]),
+                vectors=np.stack(vectors) if vectors else np.zeros((0, 0), dtype=np.float32),
+                model_name=np.array(self.model_name),
+            )
+            os.replace(temp_path, self.path)
+            return True
+        except OSError as e:
+            logger.warning(f"Could not save query embedding cache: {e}")
+            return False
+
+    def load(self) -> int:
+        """تحميل المدخلات المحفوظة إن كانت لنفس النموذج"""
+        if not self.path or not os.path.exists(self.path):
+            return 0
+        try:
+            with np.load(self.path) as saved:
+                if str(saved['model_name']) != self.model_name:
+                    logger.info("Query embedding cache was built with another model, ignoring it")
+                    return 0
+                keys = [tuple(json.loads(key)) for key in saved['keys']]
+                vectors = saved['vectors']
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f"Could not load query embedding cache: {e}")
+            return 0
+
+        with self._lock:
+            for key, vector in list(zip(keys, vectors))[-self.max_size:]:
+                vector = np.array(vector, dtype=np.float32)
+                vector.setflags(write=False)
+                self.entries[key] = vector
+        logger.info(f"Loaded {len(keys)} cached query embeddings")
+        return len(keys)
@@ -11,10 +11,26 @@ import asyncio
 from typing import List, Dict, Any, Optional, Tuple
 import os
 import pickle
-from .vector_store import pinecone_store
+from concurrent.futures import ThreadPoolExecutor
+try:
+    from .vector_backends import NumpyVectorStore, VectorStore, configured_backend, create_vector_store
+    from .local_vector_index import (IndexDelta, LocalVectorIndex, chunk_hash, diff_indexes, load_vector_index,
+                                     normalize_rows, save_vector_index, texts_version, vector_ids)
+    from .embedding_cache import QueryEmbeddingCache
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from vector_backends import NumpyVectorStore, VectorStore, configured_backend, create_vector_store
+    from local_vector_index import (IndexDelta, LocalVectorIndex, chunk_hash, diff_indexes, load_vector_index,
+                                    normalize_rows, save_vector_index, texts_version, vector_ids)
+    from embedding_cache import QueryEmbeddingCache
 
 logger = logging.getLogger(__name__)
 
+# حجم دفعة التمثيل وعدد العمال (encode يحرر GIL أثناء الحساب)
+EMBEDDING_BATCH_SIZE = int(os.getenv('ITPF_EMBEDDING_BATCH_SIZE', '32'))
+EMBEDDING_WORKERS = int(os.getenv('ITPF_EMBEDDING_WORKERS', '2'))
+
 class LegalEmbeddingsManager:
     """مدير التمثيل المتجه للنصوص القانونية"""
     
@@ -27,6 +43,21 @@ class LegalEmbeddingsManager:
         self.model_name = "paraphrase-multilingual-MiniLM-L12-v2"  # Supports Arabic and English
         self.use_pinecone = False
         self.pinecone_ready = False
+        # VECTOR_BACKEND=pinecone|numpy|hnsw (default: Pinecone when a key is set, else exact numpy)
+        self.vector_backend = configured_backend()
+        self.vector_store: VectorStore = (
+            create_vector_store(self.vector_backend) if self.vector_backend != 'pinecone' else NumpyVectorStore()
+        )
+        self.vector_indexes: Dict[str, LocalVectorIndex] = {}
+        self.query_cache = QueryEmbeddingCache(model_name=self.model_name)
+        self.index_deltas: Dict[str, IndexDelta] = {}
+        # rebuilt indexes are saved only after the vector store took all of their vectors
+        self._unsaved_indexes: Dict[str, LocalVectorIndex] = {}
+        self._encode_pool: Optional[ThreadPoolExecutor] = None
+        # created inside the loop that uses it: on Python 3.9 a lock binds to
+        # the loop current at construction, not the one that awaits it
+        self._model_lock: Optional[asyncio.Lock] = None
+        self._model_lock_loop: Optional[asyncio.AbstractEventLoop] = None
         
     async def initialize_model(self, pinecone_api_key: str = None):
         """تهيئة نموذج التمثيل المتجه وPinecone"""
@@ -35,17 +66,22 @@ class LegalEmbeddingsManager:
             self.model = SentenceTransformer(self.model_name)
             logger.info("Sentence transformer model loaded successfully")
             
-            # Try to initialize Pinecone
-            if pinecone_api_key or os.getenv("PINECONE_API_KEY"):
+            # Pick the vector backend; Pinecone falls back to the exact local store
+            backend = self.vector_backend
+            if pinecone_api_key and backend == 'numpy' and not os.getenv('VECTOR_BACKEND'):
+                backend = 'pinecone'
+            if backend == 'pinecone':
                 logger.info("Initializing Pinecone vector store...")
+                pinecone_store = create_vector_store('pinecone')
                 self.pinecone_ready = await pinecone_store.initialize_pinecone(pinecone_api_key)
                 if self.pinecone_ready:
                     self.use_pinecone = True
+                    self.vector_store = pinecone_store
                     logger.info("Pinecone vector store ready!")
                 else:
                     logger.warning("Pinecone initialization failed, using local embeddings")
             else:
-                logger.info("No Pinecone API key provided, using local embeddings only")
+                logger.info(f"Using local {self.vector_store.name} vector store")
             
             return True
         except Exception as e:
@@ -168,43 +204,74 @@ class LegalEmbeddingsManager:
         
         return ' | '.join(content_parts)
     
-    async def create_embeddings(self, texts: Dict[str, Any], language: str) -> Tuple[List[Dict], np.ndarray]:
-        """إنشاء التمثيل المتجه للنصوص"""
-        try:
+    def build_chunks(self, texts: Dict[str, Any], language: str) -> List[Dict[str, Any]]:
+        """تقسيم مواد وملاحق لغة واحدة إلى مقاطع"""
+        all_chunks = []
+        
+        # Process articles
+        for article in texts.get('articles', []):
+            chunks = self.smart_chunk_legal_text(article, language)
+            all_chunks.extend(chunks)
+        
+        # Process appendices
+        for appendix in texts.get('appendices', []):
+            chunks = self.smart_chunk_appendix(appendix, language)
+            all_chunks.extend(chunks)
+        
+        return all_chunks
+    
+    def chunk_text(self, chunk: Dict[str, Any]) -> str:
+        """النص المُمثل للمقطع: العنوان ثم المحتوى"""
+        # Combine title and content for better semantic understanding
+        text_content = ""
+        if chunk.get('title'):
+            text_content += chunk['title'] + " "
+        if chunk.get('content'):
+            text_content += chunk['content']
+        return text_content.strip()
+    
+    async def _ensure_model(self):
+        """تحميل النموذج مرة واحدة حتى عند بناء اللغتين بالتوازي"""
+        loop = asyncio.get_running_loop()
+        if self._model_lock is None or self._model_lock_loop is not loop:
+            self._model_lock = asyncio.Lock()
+            self._model_lock_loop = loop
+        async with self._model_lock:
             if not self.model:
                 await self.initialize_model()
                 if not self.model:
                     raise Exception("Failed to initialize embeddings model")
-            
+    
+    async def encode_texts(self, texts: List[str]) -> np.ndarray:
+        """تمثيل النصوص على دفعات موزعة على مجموعة العمال"""
+        await self._ensure_model()
+        if self._encode_pool is None:
+            self._encode_pool = ThreadPoolExecutor(max_workers=EMBEDDING_WORKERS, thread_name_prefix="embed")
+        
+        loop = asyncio.get_running_loop()
+        batches = [texts[i:i + EMBEDDING_BATCH_SIZE] for i in range(0, len(texts), EMBEDDING_BATCH_SIZE)]
+        encoded = await asyncio.gather(*(
+            loop.run_in_executor(
+                self._encode_pool,
+                lambda batch=batch: self.model.encode(batch, batch_size=EMBEDDING_BATCH_SIZE, show_progress_bar=False)
+            )
+            for batch in batches
+        ))
+        return np.vstack(encoded) if encoded else np.zeros((0, 0), dtype=np.float32)
+    
+    async def create_embeddings(self, texts: Dict[str, Any], language: str) -> Tuple[List[Dict], np.ndarray]:
+        """إنشاء التمثيل المتجه للنصوص"""
+        try:
             # Create chunks
-            all_chunks = []
-            
-            # Process articles
-            for article in texts.get('articles', []):
-                chunks = self.smart_chunk_legal_text(article, language)
-                all_chunks.extend(chunks)
-            
-            # Process appendices
-            for appendix in texts.get('appendices', []):
-                chunks = self.smart_chunk_appendix(appendix, language)
-                all_chunks.extend(chunks)
-            
+            all_chunks = self.build_chunks(texts, language)
             logger.info(f"Created {len(all_chunks)} chunks for {language} texts")
             
             # Extract text content for embedding
-            texts_to_embed = []
-            for chunk in all_chunks:
-                # Combine title and content for better semantic understanding
-                text_content = ""
-                if chunk.get('title'):
-                    text_content += chunk['title'] + " "
-                if chunk.get('content'):
-                    text_content += chunk['content']
-                texts_to_embed.append(text_content.strip())
+            texts_to_embed = [self.chunk_text(chunk) for chunk in all_chunks]
             
             # Create embeddings
             logger.info(f"Creating embeddings for {len(texts_to_embed)} texts...")
-            embeddings = self.model.encode(texts_to_embed, show_progress_bar=True)
+            embeddings = await self.encode_texts(texts_to_embed)
             
             logger.info(f"Created embeddings with shape: {embeddings.shape}")
             
@@ -214,104 +281,153 @@ class LegalEmbeddingsManager:
             logger.error(f"Embeddings creation error: {e}")
             raise
     
-    async def process_all_texts(self, arabic_texts: Dict[str, Any], english_texts: Dict[str, Any]):
-        """معالجة جميع النصوص وإنشاء التمثيل المتجه"""
+    async def build_language_index(self, texts: Dict[str, Any], language: str) -> LocalVectorIndex:
+        """فهرس المتجهات للغة: يُعاد تمثيل المقاطع الجديدة أو المتغيرة فقط
+
+        The rebuilt index is saved by save_language_index() once the vector
+        store has synced it. Saving it earlier would make the next run see
+        the same hashes and never retry vectors whose upsert failed.
+        """
+        chunks = self.build_chunks(texts, language)
+        chunk_texts = [self.chunk_text(chunk) for chunk in chunks]
+        version = texts_version(chunk_texts, self.model_name)
+        
+        previous = load_vector_index(language, model_name=self.model_name)
+        if previous is not None and previous.version == version:
+            logger.info(f"Loaded precomputed {language} vector index: {len(previous)} chunks (memory-mapped)")
+            self.index_deltas[language] = IndexDelta(reused=len(previous))
+            return self._set_language_index(previous)
+        
+        # Reuse the rows of unchanged chunks, encode the rest
+        hashes = [chunk_hash(text, self.model_name) for text in chunk_texts]
+        reusable = previous.rows_by_hash() if previous is not None else {}
+        missing = [row for row, chunk_digest in enumerate(hashes) if chunk_digest not in reusable]
+        logger.info(f"{language}: {len(chunks) - len(missing)} chunks unchanged, encoding {len(missing)}")
+        
+        encoded = await self.encode_texts([chunk_texts[row] for row in missing]) if missing else None
+        dimension = encoded.shape[1] if encoded is not None else (previous.dimension if previous is not None else 0)
+        embeddings = np.empty((len(chunks), dimension), dtype=np.float32)
+        for row, chunk_digest in enumerate(hashes):
+            if chunk_digest in reusable:
+                embeddings[row] = previous.embeddings[reusable[chunk_digest]]
+        if missing:
+            # normalize only the new rows, the copied ones already are
+            embeddings[missing] = normalize_rows(encoded)
+        
+        index = LocalVectorIndex(language, chunks, embeddings, self.model_name, version, normalized=True,
+                                 hashes=hashes, ids=vector_ids(chunks, language))
+        delta = diff_indexes(previous, index)
+        delta.reused, delta.encoded = len(chunks) - len(missing), len(missing)
+        self.index_deltas[language] = delta
+        self._unsaved_indexes[language] = index
+        return self._set_language_index(index)
+    
+    def save_language_index(self, language: str) -> None:
+        """حفظ فهرس اللغة المعاد بناؤه (بعد مزامنة ناجحة لخلفية المتجهات)"""
+        index = self._unsaved_indexes.pop(language, None)
+        if index is None:
+            return
+        try:
+            save_vector_index(index)
+            logger.info(f"Saved {language} vector index ({len(index)} chunks)")
+        except OSError as e:
+            # read-only deployments keep the in-memory index for this process
+            logger.warning(f"Could not save {language} vector index: {e}")
+    
+    def _set_language_index(self, index: LocalVectorIndex) -> LocalVectorIndex:
+        self.vector_indexes[index.language] = index
+        if index.language == 'ar':
+            self.arabic_chunks, self.arabic_embeddings = index.chunks, index.embeddings
+        else:
+            self.english_chunks, self.english_embeddings = index.chunks, index.embeddings
+        return index
+    
+    async def sync_vector_store(self, language: str, full: bool = False):
+        """مزامنة خلفية المتجهات مع فهرس اللغة (Pinecone: المتغيرات فقط)"""
+        return await self.vector_store.sync_index(
+            self.vector_indexes[language], self.index_deltas.get(language), full=full
+        )
+    
+    async def process_all_texts(self, arabic_texts: Dict[str, Any], english_texts: Dict[str, Any],
+                                full_sync: bool = False) -> Optional[Dict[str, Any]]:
+        """معالجة جميع النصوص وإنشاء التمثيل المتجه
+
+        Returns the vector store's sync report per language (None for local
+        backends, an UpsertReport listing the failed batches for Pinecone),
+        or None when processing itself failed.
+        """
         try:
             logger.info("Starting embeddings processing for all texts...")
             
-            # Process Arabic texts
-            logger.info("Processing Arabic texts...")
-            self.arabic_chunks, self.arabic_embeddings = await self.create_embeddings(arabic_texts, 'ar')
-            
-            # Store in Pinecone if available
-            if self.use_pinecone and self.arabic_chunks and self.arabic_embeddings is not None:
-                logger.info("Storing Arabic embeddings in Pinecone...")
-                await pinecone_store.store_embeddings(self.arabic_chunks, self.arabic_embeddings, 'ar')
-            
-            # Process English texts  
-            logger.info("Processing English texts...")
-            self.english_chunks, self.english_embeddings = await self.create_embeddings(english_texts, 'en')
-            
-            # Store in Pinecone if available
-            if self.use_pinecone and self.english_chunks and self.english_embeddings is not None:
-                logger.info("Storing English embeddings in Pinecone...")
-                await pinecone_store.store_embeddings(self.english_chunks, self.english_embeddings, 'en')
+            # Arabic and English are built concurrently; unchanged chunks are not re-encoded
+            logger.info("Processing Arabic and English texts...")
+            await asyncio.gather(
+                self.build_language_index(arabic_texts, 'ar'),
+                self.build_language_index(english_texts, 'en'),
+            )
+            
+            # Feed the vector backend (Pinecone: only new, changed and removed vector ids)
+            reports = {}
+            for language in ('ar', 'en'):
+                reports[language] = report = await self.sync_vector_store(language, full=full_sync)
+                if report is None or report.ok:
+                    self.save_language_index(language)
+                else:
+                    # the next run diffs against the last clean index and retries these vectors
+                    logger.warning(f"{language} vector index not saved: {len(report.failed_ids)} vectors not synced")
+                    self._unsaved_indexes.pop(language, None)
             
-            logger.info(f"Embeddings processing complete!")
+            logger.info("Embeddings processing complete!")
             logger.info(f"Arabic: {len(self.arabic_chunks)} chunks, {self.arabic_embeddings.shape}")
             logger.info(f"English: {len(self.english_chunks)} chunks, {self.english_embeddings.shape}")
             
             if self.use_pinecone:
                 logger.info("Embeddings stored in Pinecone vector database")
             
-            return True
+            return reports
             
         except Exception as e:
             logger.error(f"Text processing error: {e}")
-            return False
+            return None
+    
+    def encode_query(self, query: str, language: str, load_model: bool = False) -> Optional[np.ndarray]:
+        """تمثيل السؤال (الأسئلة المتكررة لا تمر بالنموذج)، أو None إذا لم يكن النموذج محملاً"""
+        query_embedding = self.query_cache.get(query, language)
+        if query_embedding is not None:
+            return query_embedding
+        if self.model is None and load_model:
+            logger.info(f"Loading sentence transformer model: {self.model_name}")
+            self.model = SentenceTransformer(self.model_name)
+        if self.model is None:
+            return None
+        query_embedding = self.model.encode([query])
+        self.query_cache.put(query, language, query_embedding)
+        return query_embedding
     
     async def semantic_search(self, query: str, language: str, top_k: int = 5) -> List[Dict[str, Any]]:
         """البحث الدلالي في النصوص"""
         try:
-            if not self.model:
+            # the model encode runs in a worker thread, not on the caller's event loop
+            query_embedding = await asyncio.to_thread(self.encode_query, query, language)
+            if query_embedding is None:
                 raise Exception("Embeddings model not initialized")
             
-            # Create query embedding
-            query_embedding = self.model.encode([query])
+            # Search the configured backend (Pinecone, exact numpy or local HNSW)
+            logger.info(f"Using {self.vector_store.name} for semantic search")
+            results = await self.vector_store.semantic_search(
+                query_embedding[0], 
+                language, 
+                top_k
+            )
             
-            # Use Pinecone if available, otherwise fallback to local search
-            if self.use_pinecone and self.pinecone_ready:
-                logger.info("Using Pinecone for semantic search")
-                results = await pinecone_store.semantic_search(
-                    query_embedding[0], 
-                    language, 
-                    top_k
-                )
-                
-                # Format results for consistency
-                for result in results:
-                    result['similarity_score'] = result.pop('score', 0)
-                
-                return results
-            else:
-                logger.info("Using local embeddings for semantic search")
-                return await self._local_semantic_search(query_embedding, language, top_k)
-            
-        except Exception as e:
-            logger.error(f"Semantic search error: {e}")
-            return []
-    
-    async def _local_semantic_search(self, query_embedding: np.ndarray, language: str, top_k: int = 5) -> List[Dict[str, Any]]:
-        """البحث الدلالي المحلي (عندما لا يتوفر Pinecone)"""
-        try:
-            # Choose language-specific data
-            if language == 'ar':
-                chunks = self.arabic_chunks
-                embeddings = self.arabic_embeddings
-            else:
-                chunks = self.english_chunks
-                embeddings = self.english_embeddings
-                
-            if chunks is None or embeddings is None:
-                raise Exception(f"No local embeddings available for language: {language}")
-            
-            # Compute similarity scores
-            similarities = np.dot(embeddings, query_embedding.T).flatten()
-            
-            # Get top-k results
-            top_indices = np.argsort(similarities)[-top_k:][::-1]
-            
-            results = []
-            for idx in top_indices:
-                result = chunks[idx].copy()
-                result['similarity_score'] = float(similarities[idx])
-                result['rank'] = len(results) + 1
-                results.append(result)
+            # Format results for consistency
+            for result in results:
+                result['similarity_score'] = result.pop('score', 0)
             
             return results
             
         except Exception as e:
-            logger.error(f"Local semantic search error: {e}")
+            logger.error(f"Semantic search error: {e}")
             return []
     
     async def get_embeddings_stats(self) -> Dict[str, Any]:
@@ -322,8 +438,10 @@ class LegalEmbeddingsManager:
                 'model_loaded': self.model is not None,
                 'arabic_ready': self.arabic_embeddings is not None,
                 'english_ready': self.english_embeddings is not None,
+                'vector_backend': self.vector_store.name,
                 'pinecone_enabled': self.use_pinecone,
-                'pinecone_ready': self.pinecone_ready
+                'pinecone_ready': self.pinecone_ready,
+                'query_embedding_cache': self.query_cache.stats()
             }
             
             if self.arabic_embeddings is not None:
@@ -334,10 +452,9 @@ class LegalEmbeddingsManager:
                 stats['english_chunks'] = len(self.english_chunks)
                 stats['english_embedding_shape'] = self.english_embeddings.shape
             
-            # Add Pinecone stats if available
-            if self.pinecone_ready:
-                pinecone_stats = await pinecone_store.get_index_stats()
-                stats['pinecone_stats'] = pinecone_stats
+            # Add backend stats (Pinecone index stats when connected)
+            backend_stats = await self.vector_store.get_index_stats()
+            stats['pinecone_stats' if self.use_pinecone else 'vector_store_stats'] = backend_stats
                 
             return stats
             
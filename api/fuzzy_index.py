@@ -0,0 +1,107 @@
+"""
+ITPF Legal System - Fuzzy Word Index
+فهرس حروف للمطابقة التقريبية للكلمات بدلاً من difflib على كل مادة في كل طلب
+
+The vocabulary is the whitespace-separated words of the content field, the
+same words difflib.get_close_matches used to see after content_text.split().
+Each word is indexed under its characters with their counts. A lookup sums
+the shared character counts per word from those postings - difflib's own
+quick_ratio() upper bound - drops every word that cannot reach the cutoff and
+scores the survivors with SequenceMatcher.ratio(), so candidates, scores and
+cutoff are exactly what difflib returned. Lookups are cached per term;
+per-document results are a filter over the cached candidates.
+"""
+
+import heapq
+import threading
+from collections import Counter
+from difflib import SequenceMatcher
+from functools import lru_cache
+from typing import Any, Dict, List, Set, Tuple
+
+try:
+    from .legal_index import LegalIndex, get_index
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_index import LegalIndex, get_index
+
+DEFAULT_CUTOFF = 0.6
+LOOKUP_CACHE_SIZE = 1024
+FUZZY_CACHE_SIZE = 16
+
+
+class FuzzyIndex:
+    """فهرس تقريبي لكلمات حقل المحتوى في فهرس لغة واحدة"""
+
+    def __init__(self, index: LegalIndex, field: str = 'content'):
+        self.index = index
+        self.field = field
+        # كلمات كل مستند بعدد تكرارها (difflib كان يرى التكرارات أيضاً)
+        self.doc_words: List[Counter] = [Counter(doc.texts[field].split()) for doc in index.documents]
+        self.word_docs: Dict[str, List[int]] = {}
+        for doc_id, words in enumerate(self.doc_words):
+            for word in words:
+                self.word_docs.setdefault(word, []).append(doc_id)
+
+        # حرف -> (الكلمة، عدد مرات الحرف فيها)
+        self.char_postings: Dict[str, List[Tuple[str, int]]] = {}
+        for word in self.word_docs:
+            for char, count in Counter(word).items():
+                self.char_postings.setdefault(char, []).append((word, count))
+
+        self.lookup = lru_cache(maxsize=LOOKUP_CACHE_SIZE)(self._lookup)
+
+    def _lookup(self, term: str, cutoff: float = DEFAULT_CUTOFF) -> Tuple[Tuple[str, float], ...]:
+        """كلمات المفردات القريبة من المصطلح مع درجة التشابه، الأعلى أولاً"""
+        # عدد الحروف المشتركة لكل كلمة من قوائم الحروف (= حد quick_ratio في difflib)
+        overlap: Dict[str, int] = Counter()
+        for char, count in Counter(term).items():
+            for word, word_count in self.char_postings.get(char, ()):
+                overlap[word] += count if count < word_count else word_count
+
+        matcher = SequenceMatcher()
+        matcher.set_seq2(term)
+        candidates = []
+        for word, common in overlap.items():
+            if 2.0 * common / (len(word) + len(term)) < cutoff:
+                continue
+            matcher.set_seq1(word)
+            ratio = matcher.ratio()
+            if ratio >= cutoff:
+                candidates.append((ratio, word))
+        candidates.sort(reverse=True)
+        return tuple((word, ratio) for ratio, word in candidates)
+
+    def close_matches(self, term: str, doc_id: int, n: int = 3,
+                      cutoff: float = DEFAULT_CUTOFF) -> List[str]:
+        """مثل difflib.get_close_matches(term, content.split(), n, cutoff) لمستند واحد"""
+        words = self.doc_words[doc_id]
+        scored = [(ratio, word) for word, ratio in self.lookup(term, cutoff) for _ in range(words.get(word, 0))]
+        return [word for _, word in heapq.nlargest(n, scored)]
+
+    def documents_close_to(self, term: str, cutoff: float = DEFAULT_CUTOFF) -> Set[int]:
+        """المستندات التي تحتوي كلمة قريبة من المصطلح"""
+        return {doc_id for word, _ in self.lookup(term, cutoff) for doc_id in self.word_docs[word]}
+
+
+_fuzzy_cache: Dict[int, Tuple[LegalIndex, FuzzyIndex]] = {}
+_fuzzy_lock = threading.Lock()
+
+
+def get_fuzzy_index(data: Any) -> FuzzyIndex:
+    """إرجاع الفهرس التقريبي لبيانات اللغة (يُبنى مرة واحدة لكل فهرس)"""
+    index = get_index(data)
+    entry = _fuzzy_cache.get(id(index))
+    if entry is not None and entry[0] is index:
+        return entry[1]
+
+    with _fuzzy_lock:
+        entry = _fuzzy_cache.get(id(index))
+        if entry is None or entry[0] is not index:
+            if len(_fuzzy_cache) >= FUZZY_CACHE_SIZE:
+                _fuzzy_cache.clear()
+            entry = (index, FuzzyIndex(index))
+            _fuzzy_cache[id(index)] = entry
+        return entry[1]
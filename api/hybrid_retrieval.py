@@ -0,0 +1,315 @@
+"""
+ITPF Legal System - Hybrid Retrieval
+استرجاع هجين: ترتيب BM25F المعجمي والبحث الدلالي بالمتجهات مدمجان في قائمة واحدة
+
+The lexical side is the shared BM25F ranker; the semantic side is the
+embeddings manager's vector backend (Pinecone, numpy or HNSW). Both run
+concurrently and their rankings are fused per article/appendix with
+reciprocal rank fusion (sum of weight / (RRF_K + rank)) or, with
+fusion='weighted', a weighted sum of max-normalized scores. Every result
+keeps its lexical and semantic rank and score so callers can show the
+breakdown. When the semantic side is unavailable the fused score is the
+BM25F score itself, so the ranking is exactly the lexical one.
+
+The semantic side is optional. Loading the embeddings model costs seconds and
+a lot of memory, so the lightweight serverless handlers never import it: it
+is used when the embeddings module is already loaded in the process (the
+self-hosted app that initialized the model) or when ITPF_HYBRID_SEMANTIC=1,
+and is skipped with ITPF_HYBRID_SEMANTIC=0. ITPF_HYBRID_FUSION and
+ITPF_HYBRID_WEIGHTS ("lexical=1,semantic=0.7") set the defaults.
+"""
+
+import asyncio
+import importlib
+import os
+import sys
+import threading
+from dataclasses import dataclass
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from .legal_corpus import DEFAULT_SOURCE, get_corpus
+    from .legal_index import INDEX_CACHE_SIZE, IndexedDocument, LegalIndex
+    from .legal_ranker import LANGUAGES, get_ranker
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_corpus import DEFAULT_SOURCE, get_corpus
+    from legal_index import INDEX_CACHE_SIZE, IndexedDocument, LegalIndex
+    from legal_ranker import LANGUAGES, get_ranker
+
+RRF_K = 60
+FUSION_METHODS = ('rrf', 'weighted')
+DEFAULT_FUSION = os.getenv('ITPF_HYBRID_FUSION', 'rrf')
+DEFAULT_WEIGHTS = {'lexical': 1.0, 'semantic': 1.0}
+DEFAULT_WEIGHTS.update(
+    (name.strip(), float(value))
+    for name, _, value in (pair.partition('=') for pair in os.getenv('ITPF_HYBRID_WEIGHTS', '').split(','))
+    if name.strip() in DEFAULT_WEIGHTS and value
+)
+# الحد الأدنى لعدد النتائج المجلوبة من كل طرف قبل الدمج
+CANDIDATES_PER_SIDE = 30
+
+LANGUAGE_CODES = {'arabic': 'ar', 'english': 'en'}
+CHUNK_KINDS = {'article': 'article', 'subsection': 'article', 'appendix': 'appendix', 'appendix_section': 'appendix'}
+
+
+@dataclass
+class HybridResult:
+    """نتيجة مدمجة مع تفصيل الدرجات من كل طرف"""
+    doc: IndexedDocument
+    language: str
+    score: float = 0.0
+    lexical_rank: Optional[int] = None
+    lexical_score: float = 0.0
+    semantic_rank: Optional[int] = None
+    semantic_score: float = 0.0
+    matched_terms: Tuple[str, ...] = ()
+
+    @property
+    def item(self) -> Mapping[str, Any]:
+        return self.doc.item
+
+    @property
+    def kind(self) -> str:
+        return self.doc.kind
+
+    def breakdown(self) -> Dict[str, Any]:
+        return {
+            'fused': round(self.score, 6),
+            'lexical': {'rank': self.lexical_rank, 'score': round(self.lexical_score, 4)},
+            'semantic': {'rank': self.semantic_rank, 'score': round(self.semantic_score, 4)},
+        }
+
+
+def loaded_embeddings_manager(setting_name: str) -> Optional[Any]:
+    """مدير التمثيل المتجه إن كانت وحدة embeddings محملة في العملية، وإلا None
+
+    The manager is returned when the module is already loaded, or imported
+    when the environment variable setting_name is "1"; "0" turns the
+    caller's feature off. Works both inside the api package and for the
+    top-level handler imports serverless platforms use.
+    """
+    setting = os.getenv(setting_name, 'auto').strip().lower()
+    if setting in ('0', 'false', 'off'):
+        return None
+    package = __package__ or ''
+    name = f'{package}.embeddings' if package else 'embeddings'
+    module = sys.modules.get(name)
+    if module is None and setting in ('1', 'true', 'on'):
+        try:
+            module = importlib.import_module(name)
+        except ImportError as e:
+            print(f"Embeddings unavailable for {setting_name}: {e}")
+            return None
+    return getattr(module, 'embeddings_manager', None) if module else None
+
+
+def _semantic_manager() -> Optional[Any]:
+    """مدير التمثيل المتجه إن كانت فهارس المتجهات جاهزة في هذه العملية، وإلا None"""
+    manager = loaded_embeddings_manager('ITPF_HYBRID_SEMANTIC')
+    if manager is None or not manager.vector_indexes:
+        return None
+    return manager
+
+
+_loop: Optional[asyncio.AbstractEventLoop] = None
+_loop_thread: Optional[threading.Thread] = None
+_loop_lock = threading.Lock()
+
+
+def _retrieval_loop() -> asyncio.AbstractEventLoop:
+    """حلقة أحداث الاسترجاع المشتركة (تُنشأ عند أول استخدام في خيط خلفي)
+
+    Separate from the DeepSeek client's loop, so retrieval never queues
+    behind LLM traffic or holds it up.
+    """
+    global _loop, _loop_thread
+    with _loop_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            ready = threading.Event()
+
+            def serve():
+                asyncio.set_event_loop(loop)
+                loop.call_soon(ready.set)
+                loop.run_forever()
+
+            _loop_thread = threading.Thread(target=serve, name='hybrid-retrieval', daemon=True)
+            _loop_thread.start()
+            ready.wait()
+            _loop = loop
+        return _loop
+
+
+_document_keys: Dict[int, Tuple[LegalIndex, Dict[Tuple[str, str], int]]] = {}
+_document_keys_lock = threading.Lock()
+
+
+def _documents_by_number(index: LegalIndex) -> Dict[Tuple[str, str], int]:
+    """(النوع، الرقم) -> رقم المستند، لربط مقاطع المتجهات بالمواد والملاحق"""
+    entry = _document_keys.get(id(index))
+    if entry is not None and entry[0] is index:
+        return entry[1]
+    keys: Dict[Tuple[str, str], int] = {}
+    for doc in index.documents:
+        number = doc.item.get('article_number' if doc.kind == 'article' else 'appendix_number')
+        if number is not None:
+            keys.setdefault((doc.kind, str(number)), doc.doc_id)
+        if doc.item.get('title'):
+            keys.setdefault((doc.kind, 'title:' + str(doc.item['title'])), doc.doc_id)
+    with _document_keys_lock:
+        # the entry keeps its index alive, so the cache is bounded like the index cache
+        if len(_document_keys) >= INDEX_CACHE_SIZE:
+            _document_keys.clear()
+        _document_keys[id(index)] = (index, keys)
+    return keys
+
+
+def _chunk_document(index: LegalIndex, chunk: Mapping[str, Any]) -> Optional[int]:
+    """المادة أو الملحق الذي ينتمي إليه مقطع نتيجة البحث الدلالي"""
+    kind = CHUNK_KINDS.get(chunk.get('type'))
+    if kind is None:
+        return None
+    keys = _documents_by_number(index)
+    number = chunk.get('article_number' if kind == 'article' else 'appendix_number')
+    if number is not None and (kind, str(number)) in keys:
+        return keys[(kind, str(number))]
+    title = chunk.get('parent_title') or chunk.get('title')
+    return keys.get((kind, f'title:{title}')) if title else None
+
+
+def _fuse(results: Dict[int, HybridResult], fusion: str, weights: Mapping[str, float], semantic: bool) -> None:
+    """حساب الدرجة المدمجة لكل نتيجة"""
+    if not semantic:
+        for result in results.values():
+            result.score = result.lexical_score
+        return
+    lexical_weight = weights.get('lexical', 1.0)
+    semantic_weight = weights.get('semantic', 1.0)
+    if fusion == 'weighted':
+        top_lexical = max((result.lexical_score for result in results.values()), default=0.0) or 1.0
+        top_semantic = max((result.semantic_score for result in results.values()), default=0.0) or 1.0
+        for result in results.values():
+            result.score = (lexical_weight * result.lexical_score / top_lexical +
+                            semantic_weight * max(result.semantic_score, 0.0) / top_semantic)
+        return
+    for result in results.values():
+        score = 0.0
+        if result.lexical_rank is not None:
+            score += lexical_weight / (RRF_K + result.lexical_rank)
+        if result.semantic_rank is not None:
+            score += semantic_weight / (RRF_K + result.semantic_rank)
+        result.score = score
+
+
+async def _semantic_hits(manager: Any, query: str, language: str, count: int) -> List[Mapping[str, Any]]:
+    try:
+        return await manager.semantic_search(query, LANGUAGE_CODES[language], count)
+    except Exception as e:
+        print(f"Semantic retrieval failed, using lexical ranking only: {e}")
+        return []
+
+
+def _merge(index: LegalIndex, language: str, lexical: Sequence[Any], semantic: Sequence[Mapping[str, Any]],
+           kind: Optional[str]) -> Dict[int, HybridResult]:
+    """جمع ترتيبي الطرفين لكل مادة أو ملحق"""
+    results: Dict[int, HybridResult] = {}
+    for rank, ranked in enumerate(lexical, 1):
+        results[ranked.doc.doc_id] = HybridResult(ranked.doc, language, lexical_rank=rank, lexical_score=ranked.score,
+                                                  matched_terms=ranked.matched_terms)
+    semantic_rank = 0
+    for hit in semantic:
+        doc_id = _chunk_document(index, hit)
+        if doc_id is None:
+            continue
+        doc = index.documents[doc_id]
+        if kind is not None and doc.kind != kind:
+            continue
+        result = results.setdefault(doc_id, HybridResult(doc, language))
+        if result.semantic_rank is None:
+            # the best chunk of a document gives its semantic rank
+            semantic_rank += 1
+            result.semantic_rank = semantic_rank
+            result.semantic_score = float(hit.get('similarity_score', hit.get('score', 0.0)))
+    return results
+
+
+def _prepare(query: str, language: str, k: int, terms: Optional[Sequence[str]], fusion: str,
+             weights: Optional[Mapping[str, float]], source: str,
+             data: Optional[Mapping[str, Mapping[str, Any]]]) -> Tuple[List[Tuple[str, Any]], List[str], int, Dict[str, float]]:
+    if fusion not in FUSION_METHODS:
+        raise ValueError(f"Unknown fusion method '{fusion}', expected one of {FUSION_METHODS}")
+    languages = [LANGUAGES[language]] if language in LANGUAGES else ['arabic', 'english']
+    if data is None:
+        corpus = get_corpus(source)
+        data = {name: corpus.language_data(name) for name in languages}
+    rankers = [(name, get_ranker(data[name])) for name in languages if data.get(name)]
+    lexical_terms = list(terms) if terms is not None else [query]
+    return rankers, lexical_terms, max(k, CANDIDATES_PER_SIDE), dict(DEFAULT_WEIGHTS, **(weights or {}))
+
+
+def _top(fused: List[HybridResult], k: int) -> List[HybridResult]:
+    fused.sort(key=lambda result: (-result.score, result.language, result.doc.doc_id))
+    return fused[:k]
+
+
+async def retrieve(query: str, language: str = 'both', k: int = 10, kind: Optional[str] = None,
+                   terms: Optional[Sequence[str]] = None, fusion: str = DEFAULT_FUSION,
+                   weights: Optional[Mapping[str, float]] = None, source: str = DEFAULT_SOURCE,
+                   data: Optional[Mapping[str, Mapping[str, Any]]] = None) -> List[HybridResult]:
+    """الاسترجاع الهجين لسؤال واحد
+
+    terms: lexical query terms (defaults to the query itself); the semantic
+    side always embeds the full question. data: optional {'arabic': ...,
+    'english': ...} language data to search instead of the shared corpus.
+    """
+    rankers, lexical_terms, candidates, weights = _prepare(query, language, k, terms, fusion, weights, source, data)
+    manager = _semantic_manager()
+    if manager is None:
+        return _retrieve_lexical(rankers, lexical_terms, k, kind)
+
+    # both sides of both languages run concurrently; BM25F runs in a worker thread
+    lexical_tasks = [asyncio.to_thread(ranker.rank_terms, lexical_terms, candidates, kind, name)
+                     for name, ranker in rankers]
+    semantic_tasks = [_semantic_hits(manager, query, name, candidates) for name, _ in rankers]
+    outcomes = await asyncio.gather(*lexical_tasks, *semantic_tasks)
+
+    fused: List[HybridResult] = []
+    for position, (name, ranker) in enumerate(rankers):
+        results = _merge(ranker.index, name, outcomes[position], outcomes[len(rankers) + position], kind)
+        _fuse(results, fusion, weights, True)
+        fused.extend(results.values())
+    return _top(fused, k)
+
+
+def _retrieve_lexical(rankers: Sequence[Tuple[str, Any]], terms: Sequence[str], k: int,
+                     kind: Optional[str]) -> List[HybridResult]:
+    """الطرف المعجمي وحده: الدرجة المدمجة هي درجة BM25F"""
+    fused: List[HybridResult] = []
+    for name, ranker in rankers:
+        results = _merge(ranker.index, name, ranker.rank_terms(terms, k, kind, name), (), kind)
+        _fuse(results, 'rrf', DEFAULT_WEIGHTS, False)
+        fused.extend(results.values())
+    return _top(fused, k)
+
+
+def retrieve_sync(query: str, language: str = 'both', k: int = 10, kind: Optional[str] = None,
+                  terms: Optional[Sequence[str]] = None, fusion: str = DEFAULT_FUSION,
+                  weights: Optional[Mapping[str, float]] = None, source: str = DEFAULT_SOURCE,
+                  data: Optional[Mapping[str, Mapping[str, Any]]] = None) -> List[HybridResult]:
+    """نسخة متزامنة لمعالجات BaseHTTPRequestHandler
+
+    Without the semantic side no event loop is involved. With it, retrieve()
+    runs on the module's shared retrieval loop rather than a new loop per
+    request. From code that is already inside an event loop, await
+    retrieve() instead.
+    """
+    if _semantic_manager() is None:
+        rankers, lexical_terms, _, _ = _prepare(query, language, k, terms, fusion, weights, source, data)
+        return _retrieve_lexical(rankers, lexical_terms, k, kind)
+    loop = _retrieval_loop()
+    if threading.current_thread() is _loop_thread:
+        raise RuntimeError("retrieve_sync() called from the retrieval loop; await retrieve() instead")
+    return asyncio.run_coroutine_threadsafe(
+        retrieve(query, language, k, kind, terms, fusion, weights, source, data), loop
+    ).result()
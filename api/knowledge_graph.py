@@ -0,0 +1,157 @@
+"""
+ITPF Legal System - Precomputed Knowledge Graph
+خريطة المعرفة القانونية مبنية مسبقاً: الكيانات والمراجع المتقاطعة والتجميعات الدلالية في ملف ثنائي
+
+Build:    python api/knowledge_graph.py build
+Measure:  python api/knowledge_graph.py bench
+
+AdvancedLegalReasoning used to build its graph at startup by running every
+relationship pattern and a pairwise word-set similarity over the whole
+corpus. The graph is now computed offline, one file per corpus source and
+language, with adjacency lists (edge indexes per article) so lookups no
+longer scan every cross reference.
+
+Layout is the one of corpus_artifact: MAGIC | header length | JSON header |
+marshal payload. The header carries the corpus version (content hash of the
+rule files) and a hash of the patterns and keywords the graph was computed
+with; load_graph() ignores a graph built from other rules or other patterns
+and the caller computes it in-process instead.
+"""
+
+import hashlib
+import json
+import marshal
+import os
+import sys
+import time
+from typing import Any, Dict, Optional
+
+try:
+    from .advanced_legal_reasoning import LEGAL_TERMS, RELATION_THRESHOLD, AdvancedLegalReasoning
+    from .corpus_artifact import HEADER_LENGTH_BYTES, MARSHAL_VERSION, read_header
+    from .legal_corpus import API_DIR, CORPUS_SOURCES, LegalCorpus, get_corpus
+except ImportError:
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from advanced_legal_reasoning import LEGAL_TERMS, RELATION_THRESHOLD, AdvancedLegalReasoning
+    from corpus_artifact import HEADER_LENGTH_BYTES, MARSHAL_VERSION, read_header
+    from legal_corpus import API_DIR, CORPUS_SOURCES, LegalCorpus, get_corpus
+
+MAGIC = b'ITPFKGR1'
+FORMAT_VERSION = 1
+LANGUAGES = ('arabic', 'english')
+
+
+def graph_path(source: str, language: str) -> str:
+    """مسار ملف الخريطة لمصدر ولغة"""
+    return os.path.join(API_DIR, f'knowledge_graph_{source}_{language}.bin')
+
+
+def patterns_version(reasoning: AdvancedLegalReasoning) -> str:
+    """بصمة الأنماط والكلمات التي تُحسب بها الخريطة"""
+    config = [reasoning.relationship_patterns, reasoning.entity_patterns, reasoning.cluster_keywords,
+              sorted(LEGAL_TERMS), RELATION_THRESHOLD]
+    return hashlib.sha256(json.dumps(config, ensure_ascii=False).encode('utf-8')).hexdigest()[:16]
+
+
+def build_graph_artifact(source: str, language: str, path: Optional[str] = None) -> Dict[str, Any]:
+    """حساب خريطة المعرفة للغة وكتابتها في ملف ثنائي"""
+    corpus = get_corpus(source)
+    reasoning = AdvancedLegalReasoning()
+    started = time.perf_counter()
+    graph = reasoning.compute_graph(corpus.language_data(language))
+    build_seconds = time.perf_counter() - started
+    payload = marshal.dumps(graph, MARSHAL_VERSION)
+
+    header = {
+        "format_version": FORMAT_VERSION,
+        "marshal_version": MARSHAL_VERSION,
+        "source": source,
+        "language": language,
+        "corpus_version": corpus.version,
+        "patterns_version": patterns_version(reasoning),
+        "nodes": len(graph['nodes']),
+        "edges": len(graph['edges']),
+        "clusters": {name: len(members) for name, members in graph['clusters'].items()},
+        "build_seconds": round(build_seconds, 4),
+        "payload_bytes": len(payload),
+    }
+    header_bytes = json.dumps(header, ensure_ascii=False).encode('utf-8')
+
+    path = path or graph_path(source, language)
+    temp_path = path + '.tmp'
+    with open(temp_path, 'wb') as f:
+        f.write(MAGIC)
+        f.write(len(header_bytes).to_bytes(HEADER_LENGTH_BYTES, 'little'))
+        f.write(header_bytes)
+        f.write(payload)
+    os.replace(temp_path, path)
+    return header
+
+
+def load_graph(corpus: LegalCorpus, language: str, reasoning: AdvancedLegalReasoning,
+               path: Optional[str] = None) -> Optional[Dict[str, Any]]:
+    """الخريطة المبنية مسبقاً للغة، أو None إذا كان الملف غير موجود أو لا يطابق النصوص والأنماط"""
+    path = path or graph_path(corpus.source, language)
+    if not os.path.exists(path):
+        return None
+
+    started = time.perf_counter()
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    header, payload_offset = read_header(data, MAGIC)
+    if (header.get("format_version") != FORMAT_VERSION or header.get("language") != language
+            or header.get("marshal_version", MARSHAL_VERSION + 1) > MARSHAL_VERSION):
+        print(f"Knowledge graph {os.path.basename(path)} has an incompatible format, ignoring it")
+        return None
+    if (header.get("corpus_version") != corpus.version
+            or header.get("patterns_version") != patterns_version(reasoning)):
+        print(f"Knowledge graph {os.path.basename(path)} is stale (rules or patterns changed), ignoring it")
+        return None
+
+    graph = marshal.loads(memoryview(data)[payload_offset:])
+    print(f"🧠 Knowledge graph loaded ({corpus.source}, {language}): {header['nodes']} nodes, "
+          f"{header['edges']} edges in {(time.perf_counter() - started) * 1000:.1f}ms")
+    return graph
+
+
+def benchmark(source: str = 'split', language: str = 'arabic', runs: int = 5) -> Dict[str, Optional[float]]:
+    """قياس زمن بناء الخريطة داخل العملية مقابل تحميلها من الملف
+
+    A missing or stale artifact is built first; if it still cannot be loaded
+    (e.g. a read-only checkout), load_ms is None.
+    """
+    corpus = get_corpus(source)
+    reasoning = AdvancedLegalReasoning()
+    if load_graph(corpus, language, reasoning) is None:
+        try:
+            build_graph_artifact(source, language)
+        except OSError as e:
+            print(f"Could not build the knowledge graph artifact: {e}")
+    build, load = [], []
+    for _ in range(runs):
+        started = time.perf_counter()
+        reasoning.compute_graph(corpus.language_data(language))
+        build.append(time.perf_counter() - started)
+        started = time.perf_counter()
+        graph = load_graph(corpus, language, reasoning)
+        if graph is not None:
+            reasoning.apply_graph(graph)
+            load.append(time.perf_counter() - started)
+    return {
+        "compute_ms": round(min(build) * 1000, 2),
+        "load_ms": round(min(load) * 1000, 2) if load else None,
+    }
+
+
+if __name__ == "__main__":
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        for corpus_source in CORPUS_SOURCES:
+            for graph_language in LANGUAGES:
+                built = build_graph_artifact(corpus_source, graph_language)
+                print(json.dumps(built, ensure_ascii=False, indent=2))
+    elif command == 'bench':
+        print(json.dumps(benchmark(), indent=2))
+    else:
+        print("usage: python api/knowledge_graph.py [build|bench]")
@@ -0,0 +1,265 @@
+"""
+ITPF Legal System - Shared Legal Corpus
+مصدر موحد للنصوص القانونية: تحليل القواعد العربية والإنجليزية مرة واحدة لكل عملية
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT_DIR = os.path.dirname(API_DIR)
+
+# المصادر المتاحة:
+# split    - ملفات arabic_data_part{i}.json و english_data_part{i}.json (تستخدمها أغلب نقاط النهاية)
+# complete - ملفات *_legal_rules_complete_authentic.json داخل مجلد api
+CORPUS_SOURCES = ('split', 'complete')
+DEFAULT_SOURCE = 'split'
+SPLIT_PARTS = 3
+
+EMPTY_LANGUAGE = MappingProxyType({})
+
+
+@dataclass(frozen=True)
+class LegalCorpus:
+    """لقطة من النصوص القانونية مشتركة بين جميع المعالجات
+
+    Only the structure is frozen: the language mappings and their
+    article/appendix sequences are read-only, but the article and appendix
+    dicts themselves are plain dicts shared by every caller (they go straight
+    into JSON responses). Code that annotates an item must copy it first, as
+    the search functions and the legal reasoning engine do.
+    """
+    source: str
+    arabic: Mapping[str, Any]
+    english: Mapping[str, Any]
+    version: str
+    files: Tuple[str, ...]
+    load_seconds: float
+    origin: str = 'json'
+
+    def language_data(self, language: str) -> Mapping[str, Any]:
+        """إرجاع بيانات اللغة المطلوبة"""
+        return self.arabic if language in ('arabic', 'ar') else self.english
+
+    def stats(self) -> Dict[str, Any]:
+        """إحصائيات اللقطة الحالية"""
+        return {
+            "source": self.source,
+            "version": self.version,
+            "files": [os.path.basename(path) for path in self.files],
+            "load_seconds": round(self.load_seconds, 4),
+            "origin": self.origin,
+            "arabic_articles": len(self.arabic.get('articles', ())),
+            "arabic_appendices": len(self.arabic.get('appendices', ())),
+            "english_articles": len(self.english.get('articles', ())),
+            "english_appendices": len(self.english.get('appendices', ())),
+        }
+
+
+def _read_json(path: str, hasher) -> Optional[Dict[str, Any]]:
+    """قراءة ملف JSON مع تحديث بصمة المحتوى"""
+    if not os.path.exists(path):
+        return None
+    with open(path, 'rb') as f:
+        raw = f.read()
+    hasher.update(os.path.basename(path).encode('utf-8'))
+    hasher.update(raw)
+    return json.loads(raw.decode('utf-8'))
+
+
+def freeze_language(metadata: Dict[str, Any], articles: List[Dict[str, Any]],
+                     appendices: List[Dict[str, Any]], chapters: List[Dict[str, Any]] = None) -> Mapping[str, Any]:
+    """تجميد هيكل بيانات لغة واحدة في شكل موحد (المواد والملاحق نفسها قواميس مشتركة)"""
+    if not articles and not appendices:
+        return EMPTY_LANGUAGE
+
+    language_data = {
+        "metadata": MappingProxyType(dict(metadata or {})),
+        "articles": tuple(articles),
+        "appendices": tuple(appendices),
+    }
+    if chapters is not None:
+        language_data["chapters"] = tuple(chapters)
+    return MappingProxyType(language_data)
+
+
+def _flatten_chapters(chapters: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """استخراج المواد من هيكل الفصول الإنجليزي"""
+    articles = []
+    for chapter in chapters:
+        articles.extend(chapter.get('articles', []))
+    return articles
+
+
+def _load_split_source(hasher, files: List[str]) -> Tuple[Mapping[str, Any], Mapping[str, Any]]:
+    """تحميل الملفات المقسمة مع الرجوع للملفات الكاملة عند غيابها"""
+    # Arabic parts: metadata and appendices come from part 1, articles from every part
+    arabic_metadata, arabic_articles, arabic_appendices = {}, [], []
+    for i in range(1, SPLIT_PARTS + 1):
+        arabic_file = os.path.join(API_DIR, f'arabic_data_part{i}.json')
+        try:
+            part_data = _read_json(arabic_file, hasher)
+            if part_data is None:
+                continue
+            files.append(arabic_file)
+            if i == 1:
+                arabic_metadata = part_data.get("metadata", {})
+                arabic_appendices = part_data.get("appendices", [])
+            arabic_articles.extend(part_data.get("articles", []))
+        except Exception as e:
+            print(f"Error loading Arabic part {i}: {str(e)}")
+
+    if not arabic_articles:
+        fallback_file = os.path.join(ROOT_DIR, "arabic_legal_rules_complete_authentic.json")
+        try:
+            fallback = _read_json(fallback_file, hasher)
+            if fallback:
+                files.append(fallback_file)
+                arabic_metadata = fallback.get("metadata", {})
+                arabic_articles = fallback.get("articles", [])
+                arabic_appendices = fallback.get("appendices", [])
+        except Exception as e:
+            print(f"Error loading Arabic fallback data: {str(e)}")
+
+    # English parts: chapters from every part, flattened into articles as well
+    english_metadata, english_chapters, english_appendices = {}, [], []
+    for i in range(1, SPLIT_PARTS + 1):
+        english_file = os.path.join(API_DIR, f'english_data_part{i}.json')
+        try:
+            part_data = _read_json(english_file, hasher)
+            if part_data is None:
+                continue
+            files.append(english_file)
+            if i == 1:
+                english_metadata = part_data.get("metadata", {})
+                english_appendices = part_data.get("appendices", [])
+            if 'chapters' in part_data:
+                english_chapters.extend(part_data['chapters'])
+            else:
+                english_chapters.append({"articles": part_data.get("articles", [])})
+        except Exception as e:
+            print(f"Error loading English part {i}: {str(e)}")
+
+    english_articles = _flatten_chapters(english_chapters)
+    if not english_articles:
+        fallback_file = os.path.join(ROOT_DIR, "english_legal_rules_complete_authentic.json")
+        try:
+            fallback = _read_json(fallback_file, hasher)
+            if fallback:
+                files.append(fallback_file)
+                english_metadata = fallback.get("metadata", {})
+                english_chapters = fallback.get("chapters", [])
+                english_articles = _flatten_chapters(english_chapters) or fallback.get("articles", [])
+                english_appendices = fallback.get("appendices", [])
+        except Exception as e:
+            print(f"Error loading English fallback data: {str(e)}")
+
+    return (
+        freeze_language(arabic_metadata, arabic_articles, arabic_appendices),
+        freeze_language(english_metadata, english_articles, english_appendices, english_chapters),
+    )
+
+
+def _load_complete_source(hasher, files: List[str]) -> Tuple[Mapping[str, Any], Mapping[str, Any]]:
+    """تحميل الملفات الكاملة الموثقة من مجلد api"""
+    languages = []
+    for name in ('arabic', 'english'):
+        data_file = os.path.join(API_DIR, f'{name}_legal_rules_complete_authentic.json')
+        try:
+            data = _read_json(data_file, hasher) or {}
+            if data:
+                files.append(data_file)
+        except Exception as e:
+            print(f"Error loading {name} complete data: {str(e)}")
+            data = {}
+
+        chapters = data.get("chapters")
+        articles = _flatten_chapters(chapters) if chapters else data.get("articles", [])
+        languages.append(freeze_language(
+            data.get("metadata", {}), articles, data.get("appendices", []),
+            (chapters or []) if name == 'english' else None
+        ))
+
+    return languages[0], languages[1]
+
+
+def load_corpus(source: str = DEFAULT_SOURCE, use_artifact: bool = True) -> LegalCorpus:
+    """تحليل ملفات المصدر وإنشاء لقطة جديدة (بدون تخزين مؤقت)
+
+    When a compiled artifact for the source exists and still matches the JSON
+    files on disk it is used instead of parsing them (see corpus_artifact.py).
+    """
+    if source not in CORPUS_SOURCES:
+        raise ValueError(f"Unknown corpus source: {source}")
+
+    if use_artifact and os.environ.get('ITPF_CORPUS_ARTIFACT', '1') != '0':
+        try:
+            try:
+                from .corpus_artifact import load_artifact
+            except ImportError:
+                from corpus_artifact import load_artifact
+            corpus = load_artifact(source)
+            if corpus is not None:
+                return corpus
+        except Exception as e:
+            print(f"Corpus artifact unavailable, parsing JSON instead: {str(e)}")
+
+    started = time.perf_counter()
+    hasher = hashlib.sha256()
+    files: List[str] = []
+
+    if source == 'split':
+        arabic, english = _load_split_source(hasher, files)
+    else:
+        arabic, english = _load_complete_source(hasher, files)
+
+    corpus = LegalCorpus(
+        source=source,
+        arabic=arabic,
+        english=english,
+        version=hasher.hexdigest()[:16],
+        files=tuple(files),
+        load_seconds=time.perf_counter() - started
+    )
+
+    log_corpus_loaded(corpus)
+    return corpus
+
+
+def log_corpus_loaded(corpus: LegalCorpus) -> None:
+    """طباعة ملخص التحميل"""
+    stats = corpus.stats()
+    print(f"Legal corpus loaded ({corpus.source}, {corpus.origin}) - Arabic: {stats['arabic_articles']} articles, {stats['arabic_appendices']} appendices")
+    print(f"Legal corpus loaded ({corpus.source}, {corpus.origin}) - English: {stats['english_articles']} articles, {stats['english_appendices']} appendices")
+
+
+_corpus_cache: Dict[str, LegalCorpus] = {}
+_corpus_lock = threading.Lock()
+
+
+def get_corpus(source: str = DEFAULT_SOURCE) -> LegalCorpus:
+    """إرجاع اللقطة المشتركة للعملية الحالية (تحليل الملفات مرة واحدة فقط)"""
+    corpus = _corpus_cache.get(source)
+    if corpus is not None:
+        return corpus
+
+    with _corpus_lock:
+        corpus = _corpus_cache.get(source)
+        if corpus is None:
+            corpus = load_corpus(source)
+            _corpus_cache[source] = corpus
+        return corpus
+
+
+def reload_corpus(source: str = DEFAULT_SOURCE) -> LegalCorpus:
+    """إعادة تحميل المصدر بعد تعديل الملفات على القرص"""
+    with _corpus_lock:
+        corpus = load_corpus(source)
+        _corpus_cache[source] = corpus
+        return corpus
@@ -0,0 +1,322 @@
+"""
+ITPF Legal System - Inverted Index
+فهرس مقلوب للمواد والملاحق يُبنى مرة واحدة لكل لقطة من النصوص القانونية
+
+Every search path used to run ``term in content.lower()`` over each article on
+every request. The index tokenizes the corpus once; a posting records the
+document, field, positions and term frequency of a token. Substring semantics
+of the old scans are preserved: a single-word term matches every indexed
+token that contains it (the expansion is computed once per term over the
+vocabulary, not over the texts), and multi-word terms are matched as phrases
+using token positions. Terms carrying punctuation are confirmed against the
+stored field text of the candidate documents only.
+
+Every token is also analyzed once at index time (arabic_normalizer: folding
+and light stemming). The analyzed forms are kept per document and in
+``term_postings`` for ranking, and a single-word term additionally matches
+words sharing its stem, so "متسابقين" finds "المتسابق".
+"""
+
+import re
+import threading
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from .arabic_normalizer import DIACRITICS, analyze_token
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from arabic_normalizer import DIACRITICS, analyze_token
+
+TOKEN_PATTERN = re.compile(r'\w+')
+NUMBER_PATTERN = re.compile(r'\d+')
+
+# الحقول المفهرسة لكل مادة أو ملحق (number: رقم المادة أو الملحق)
+FIELDS = ('title', 'section', 'content', 'number')
+NUMBER_KEYS = ('article_number', 'appendix_number', 'number')
+
+MATCH_CACHE_SIZE = 4096
+INDEX_CACHE_SIZE = 16
+
+
+def fold_text(text: str) -> str:
+    """إزالة التشكيل والتطويل وتصغير الحروف قبل التقسيم
+
+    \\w does not match the harakat, so "المُتَسَابِق" would otherwise split
+    into fragments; the index and the queries both go through this first.
+    """
+    return DIACRITICS.sub('', text).lower()
+
+
+def tokenize(text: str) -> List[str]:
+    """تقسيم النص إلى كلمات بحروف صغيرة"""
+    return TOKEN_PATTERN.findall(fold_text(text))
+
+
+def analyze(text: str) -> List[str]:
+    """الأشكال المفهرسة لكلمات النص (نفس المعالجة عند الفهرسة والبحث)"""
+    return [analyze_token(token) for token in TOKEN_PATTERN.findall(fold_text(text))]
+
+
+def field_text(value: Any) -> str:
+    """تحويل قيمة الحقل إلى نص كما كانت تفعل عمليات البحث (محتوى الملاحق قد يكون قاموساً)"""
+    if value is None:
+        return ''
+    return value if isinstance(value, str) else str(value)
+
+
+@dataclass(frozen=True)
+class Posting:
+    """ظهور كلمة في حقل واحد من مستند واحد"""
+    doc_id: int
+    field: str
+    positions: Tuple[int, ...]
+
+    @property
+    def tf(self) -> int:
+        return len(self.positions)
+
+
+@dataclass(frozen=True)
+class IndexedDocument:
+    """مادة أو ملحق مفهرس مع نصوص حقوله بحروف صغيرة وأشكالها المعالجة"""
+    doc_id: int
+    kind: str  # 'article' | 'appendix'
+    item: Mapping[str, Any]
+    texts: Mapping[str, str]
+    terms: Mapping[str, Tuple[str, ...]]
+    lengths: Mapping[str, int]
+    numbers: FrozenSet[str]
+
+
+class LegalIndex:
+    """فهرس مقلوب على مستوى الكلمات لمواد وملاحق لغة واحدة"""
+
+    def __init__(self, articles: Iterable[Mapping[str, Any]], appendices: Iterable[Mapping[str, Any]] = ()):
+        self.documents: List[IndexedDocument] = []
+        self.postings: Dict[str, List[Posting]] = {}
+        self.term_postings: Dict[str, List[Posting]] = {}
+        self.stem_words: Dict[str, Tuple[str, ...]] = {}
+        self._match_cache: Dict[str, Dict[int, Dict[str, int]]] = {}
+        self._expansion_cache: Dict[Tuple[str, str], Tuple[str, ...]] = {}
+
+        for item in articles:
+            self._add_document(item, 'article')
+        for item in appendices:
+            self._add_document(item, 'appendix')
+
+        self.vocabulary: Tuple[str, ...] = tuple(sorted(self.postings))
+        stem_words: Dict[str, List[str]] = defaultdict(list)
+        for word in self.vocabulary:
+            stem_words[analyze_token(word)].append(word)
+        self.stem_words = {stem: tuple(words) for stem, words in stem_words.items()}
+        # one line per word: expansions are found with str.find instead of a Python loop over the vocabulary
+        self._vocabulary_text = '\n' + '\n'.join(self.vocabulary) + '\n'
+        self.articles = [doc for doc in self.documents if doc.kind == 'article']
+        self.appendices = [doc for doc in self.documents if doc.kind == 'appendix']
+
+    def _add_document(self, item: Mapping[str, Any], kind: str) -> None:
+        """إضافة مستند إلى الفهرس"""
+        if not isinstance(item, Mapping):
+            return
+        doc_id = len(self.documents)
+        texts, terms, lengths = {}, {}, {}
+        for field in FIELDS:
+            if field == 'number':
+                value = next((item[key] for key in NUMBER_KEYS if item.get(key) is not None), None)
+            else:
+                value = item.get(field)
+            text = fold_text(field_text(value))
+            tokens = TOKEN_PATTERN.findall(text)
+            field_terms = tuple(analyze_token(token) for token in tokens)
+            texts[field] = text
+            terms[field] = field_terms
+            lengths[field] = len(tokens)
+
+            for source, postings in ((tokens, self.postings), (field_terms, self.term_postings)):
+                positions: Dict[str, List[int]] = defaultdict(list)
+                for position, token in enumerate(source):
+                    positions[token].append(position)
+                for token, token_positions in positions.items():
+                    postings.setdefault(token, []).append(Posting(doc_id, field, tuple(token_positions)))
+
+        self.documents.append(IndexedDocument(
+            doc_id=doc_id,
+            kind=kind,
+            item=item,
+            texts=texts,
+            terms=terms,
+            lengths=lengths,
+            numbers=frozenset(NUMBER_PATTERN.findall(texts['content']))
+        ))
+
+    def expand(self, token: str, mode: str = 'contains') -> Tuple[str, ...]:
+        """كلمات المفردات التي تحتوي الكلمة (أو تبدأ/تنتهي بها)"""
+        key = (token, mode)
+        expansion = self._expansion_cache.get(key)
+        if expansion is None:
+            if mode == 'exact':
+                expansion = (token,) if token in self.postings else ()
+            else:
+                needle = '\n' + token if mode == 'prefix' else token + '\n' if mode == 'suffix' else token
+                expansion = tuple(self._find_words(needle))
+            # keyed by user query words, so bounded like the match cache
+            if len(self._expansion_cache) >= MATCH_CACHE_SIZE:
+                self._expansion_cache.clear()
+            self._expansion_cache[key] = expansion
+        return expansion
+
+    def _find_words(self, needle: str) -> List[str]:
+        """البحث عن الكلمات التي تحتوي المقطع داخل نص المفردات"""
+        text = self._vocabulary_text
+        words = []
+        position = text.find(needle)
+        while position != -1:
+            start = text.rfind('\n', 0, position + (1 if needle[0] == '\n' else 0)) + 1
+            end = text.find('\n', position + len(needle.rstrip('\n')))
+            words.append(text[start:end])
+            position = text.find(needle, end)
+        return words
+
+    def match(self, term: str) -> Dict[int, Dict[str, int]]:
+        """عدد ظهور المصطلح في كل حقل من كل مستند: {doc_id: {field: count}}"""
+        term = fold_text(term)
+        cached = self._match_cache.get(term)
+        if cached is not None:
+            return cached
+
+        tokens = TOKEN_PATTERN.findall(term)
+        if not tokens:
+            # no word characters at all: nothing to look up, scan the stored texts
+            matches = self._verify(term, {doc.doc_id: dict.fromkeys(FIELDS, 1) for doc in self.documents})
+        elif len(tokens) == 1:
+            matches = self._match_token(tokens[0])
+            if term != tokens[0]:
+                matches = self._verify(term, matches)
+        else:
+            matches = self._verify(term, self._match_phrase(tokens))
+
+        if len(self._match_cache) >= MATCH_CACHE_SIZE:
+            self._match_cache.clear()
+        self._match_cache[term] = matches
+        return matches
+
+    def _match_token(self, token: str) -> Dict[int, Dict[str, int]]:
+        matches: Dict[int, Dict[str, int]] = {}
+        words = dict.fromkeys(self.expand(token))
+        words.update(dict.fromkeys(self.stem_words.get(analyze_token(token), ())))
+        for word in words:
+            occurrences = max(word.count(token), 1)
+            for posting in self.postings[word]:
+                fields = matches.setdefault(posting.doc_id, {})
+                fields[posting.field] = fields.get(posting.field, 0) + len(posting.positions) * occurrences
+        return matches
+
+    def _match_phrase(self, tokens: List[str]) -> Dict[int, Dict[str, int]]:
+        """مطابقة عبارة: أول كلمة تنتهي بالمقطع، الوسطى مطابقة، والأخيرة تبدأ به"""
+        slots = []
+        for i, token in enumerate(tokens):
+            mode = 'suffix' if i == 0 else 'prefix' if i == len(tokens) - 1 else 'exact'
+            positions: Dict[Tuple[int, str], set] = defaultdict(set)
+            for word in self.expand(token, mode):
+                for posting in self.postings[word]:
+                    positions[(posting.doc_id, posting.field)].update(posting.positions)
+            if not positions:
+                return {}
+            slots.append(positions)
+
+        matches: Dict[int, Dict[str, int]] = {}
+        for key, starts in slots[0].items():
+            count = sum(
+                1 for start in starts
+                if all(start + offset in slot.get(key, ()) for offset, slot in enumerate(slots[1:], 1))
+            )
+            if count:
+                matches.setdefault(key[0], {})[key[1]] = count
+        return matches
+
+    def _verify(self, term: str, candidates: Dict[int, Dict[str, int]]) -> Dict[int, Dict[str, int]]:
+        """التحقق من المرشحين بمطابقة النص الكامل للحقل"""
+        matches: Dict[int, Dict[str, int]] = {}
+        for doc_id, fields in candidates.items():
+            texts = self.documents[doc_id].texts
+            for field in fields:
+                count = texts[field].count(term)
+                if count:
+                    matches.setdefault(doc_id, {})[field] = count
+        return matches
+
+    def surface_forms(self, term: str, doc: Optional[IndexedDocument] = None) -> List[str]:
+        """الكلمات الأصلية التي تعود إلى الشكل المعالج (الموجودة في المستند إن حُدد)"""
+        words = self.stem_words.get(term, ())
+        if doc is None:
+            return list(words)
+        return [word for word in words if any(word in doc.texts[field] for field in ('title', 'content'))]
+
+    def contains(self, doc_id: int, field: str, term: str) -> bool:
+        """هل يظهر المصطلح في حقل المستند"""
+        return bool(self.match(term).get(doc_id, {}).get(field))
+
+    def documents_matching(self, term: str, fields: Optional[Sequence[str]] = None) -> List[IndexedDocument]:
+        """المستندات التي يظهر فيها المصطلح مرتبة حسب ترتيب النصوص"""
+        matches = self.match(term)
+        return [
+            self.documents[doc_id] for doc_id in sorted(matches)
+            if fields is None or any(matches[doc_id].get(field) for field in fields)
+        ]
+
+
+_index_cache: Dict[int, Tuple[Any, LegalIndex]] = {}
+_index_lock = threading.Lock()
+
+
+def _language_items(data: Any) -> Tuple[List[Mapping[str, Any]], List[Mapping[str, Any]]]:
+    """استخراج المواد والملاحق من بيانات لغة أو من قائمة مستندات"""
+    if isinstance(data, Mapping):
+        articles = list(data.get('articles', []))
+        if not articles and 'chapters' in data:
+            for chapter in data['chapters']:
+                articles.extend(chapter.get('articles', []))
+        return articles, list(data.get('appendices', []))
+
+    articles, appendices = [], []
+    for item in data or []:
+        if isinstance(item, Mapping) and 'appendix_number' in item:
+            appendices.append(item)
+        else:
+            articles.append(item)
+    return articles, appendices
+
+
+def get_index(data: Any) -> LegalIndex:
+    """إرجاع فهرس بيانات اللغة (يُبنى مرة واحدة لكل كائن بيانات)
+
+    The shared corpus snapshot lives for the whole process, so its index is
+    built once. The data object is kept alongside the index so its id() is
+    never reused while the cache entry exists.
+    """
+    key = id(data)
+    entry = _index_cache.get(key)
+    if entry is not None and entry[0] is data:
+        return entry[1]
+
+    with _index_lock:
+        entry = _index_cache.get(key)
+        if entry is None or entry[0] is not data:
+            if len(_index_cache) >= INDEX_CACHE_SIZE:
+                _index_cache.clear()
+            articles, appendices = _language_items(data)
+            entry = (data, LegalIndex(articles, appendices))
+            _index_cache[key] = entry
+        return entry[1]
+
+
+if __name__ == "__main__":
+    # التشكيل لا يغير كلمات الاستعلام: "عُقُوبَة المُتَسَابِق" = "عقوبة المتسابق"
+    for with_marks, without_marks in (('عُقُوبَة المُتَسَابِق', 'عقوبة المتسابق'), ('المـــتسابق', 'المتسابق')):
+        assert analyze(with_marks) == analyze(without_marks), (analyze(with_marks), analyze(without_marks))
+        assert tokenize(with_marks) == tokenize(without_marks)
+    print("legal_index: diacritics checks passed")
@@ -0,0 +1,189 @@
+"""
+ITPF Legal System - BM25F Ranking
+ترتيب المواد والملاحق بخوارزمية BM25F مع أوزان لحقول العنوان والقسم والمحتوى والرقم
+
+Scores replace the hand-tuned counters the endpoints used to add up
+(+2/+3 per term, +10/+5/+15, ...). All corpus statistics - document
+frequencies, average field lengths and the per-posting BM25F impact - are
+computed once when the ranker is built from the shared index, so a query only
+sums precomputed impacts for its tokens.
+"""
+
+import math
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Tuple
+
+try:
+    from .legal_corpus import DEFAULT_SOURCE, get_corpus
+    from .legal_index import FIELDS, IndexedDocument, LegalIndex, get_index, tokenize
+    from .arabic_normalizer import analyze_token, normalize_arabic
+except ImportError:
+    import os
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_corpus import DEFAULT_SOURCE, get_corpus
+    from legal_index import FIELDS, IndexedDocument, LegalIndex, get_index, tokenize
+    from arabic_normalizer import analyze_token, normalize_arabic
+
+# أوزان الحقول: العنوان أهم من القسم، والقسم أهم من المحتوى
+# (رقم المادة أو الملحق يطابق أسئلة مثل "الملحق 9" أو "Article 146")
+FIELD_WEIGHTS = {'title': 3.0, 'section': 1.5, 'content': 1.0, 'number': 2.0}
+# تطبيع الطول لكل حقل (العناوين قصيرة ومتقاربة الطول)
+FIELD_B = {'title': 0.3, 'section': 0.3, 'content': 0.75, 'number': 0.0}
+K1 = 1.2
+
+RANKER_CACHE_SIZE = 16
+
+# أدوات الاستفهام والحروف الشائعة لا تُحتسب في الاستعلام
+QUERY_STOPWORDS = frozenset({
+    'ما', 'ماذا', 'هل', 'كيف', 'كم', 'متى', 'أين', 'لماذا', 'هو', 'هي', 'في', 'من', 'على', 'عن', 'إلى', 'الى',
+    'أو', 'او', 'و', 'ثم', 'مع', 'التي', 'الذي', 'هذا', 'هذه', 'ذلك', 'تلك',
+    'what', 'which', 'who', 'when', 'where', 'why', 'how', 'many', 'much', 'is', 'are', 'was', 'be', 'do', 'does',
+    'the', 'a', 'an', 'of', 'for', 'to', 'in', 'on', 'at', 'by', 'and', 'or', 'with', 'this', 'that', 'it',
+})
+NORMALIZED_STOPWORDS = frozenset(normalize_arabic(word) for word in QUERY_STOPWORDS)
+
+LANGUAGES = {'ar': 'arabic', 'arabic': 'arabic', 'en': 'english', 'english': 'english'}
+
+
+@dataclass(frozen=True)
+class RankedDocument:
+    """نتيجة مرتبة مع درجة BM25F والكلمات المطابقة"""
+    doc: IndexedDocument
+    score: float
+    language: str
+    matched_terms: Tuple[str, ...]
+
+    @property
+    def item(self) -> Mapping[str, Any]:
+        return self.doc.item
+
+    @property
+    def kind(self) -> str:
+        return self.doc.kind
+
+
+class BM25FRanker:
+    """مرتب BM25F لفهرس لغة واحدة"""
+
+    def __init__(self, index: LegalIndex, field_weights: Optional[Dict[str, float]] = None,
+                 field_b: Optional[Dict[str, float]] = None, k1: float = K1):
+        self.index = index
+        self.field_weights = dict(field_weights or FIELD_WEIGHTS)
+        self.field_b = dict(field_b or FIELD_B)
+        self.k1 = k1
+
+        documents = index.documents
+        self.document_count = len(documents)
+        self.avg_lengths = {
+            field: (sum(doc.lengths[field] for doc in documents) / self.document_count) if documents else 0.0
+            for field in FIELDS
+        }
+
+        # طول كل حقل نسبة إلى المتوسط
+        norms = []
+        for doc in documents:
+            doc_norms = {}
+            for field in FIELDS:
+                average = self.avg_lengths[field] or 1.0
+                b = self.field_b.get(field, 0.75)
+                doc_norms[field] = 1.0 - b + b * doc.lengths[field] / average
+            norms.append(doc_norms)
+
+        # الأثر المسبق لكل كلمة في كل مستند: idf * tf' * (k1 + 1) / (k1 + tf')
+        self.idf: Dict[str, float] = {}
+        self._impacts: Dict[str, Tuple[Tuple[int, float], ...]] = {}
+        # the ranker works on analyzed terms (folded and lightly stemmed), same as the queries
+        for token, postings in index.term_postings.items():
+            pseudo_tf: Dict[int, float] = {}
+            for posting in postings:
+                weight = self.field_weights.get(posting.field, 0.0)
+                if weight:
+                    pseudo_tf[posting.doc_id] = pseudo_tf.get(posting.doc_id, 0.0) + \
+                        weight * len(posting.positions) / norms[posting.doc_id][posting.field]
+            if not pseudo_tf:
+                continue
+            df = len(pseudo_tf)
+            idf = math.log(1.0 + (self.document_count - df + 0.5) / (df + 0.5))
+            self.idf[token] = idf
+            self._impacts[token] = tuple(
+                (doc_id, idf * tf * (k1 + 1.0) / (k1 + tf)) for doc_id, tf in pseudo_tf.items()
+            )
+
+    def query_tokens(self, terms: Iterable[str]) -> List[str]:
+        """الأشكال المعالجة الفريدة لكلمات الاستعلام من قائمة مصطلحات أو عبارات"""
+        tokens = []
+        for term in terms:
+            tokens.extend(
+                analyze_token(token) for token in tokenize(term)
+                if normalize_arabic(token) not in NORMALIZED_STOPWORDS
+            )
+        return list(dict.fromkeys(tokens))
+
+    def score_terms(self, terms: Iterable[str]) -> Tuple[Dict[int, float], Dict[int, List[str]]]:
+        """درجات BM25F لكل مستند والكلمات المطابقة فيه"""
+        scores: Dict[int, float] = Counter()
+        matched: Dict[int, List[str]] = {}
+        for token in self.query_tokens(terms):
+            for doc_id, impact in self._impacts.get(token, ()):
+                scores[doc_id] += impact
+                matched.setdefault(doc_id, []).append(token)
+        return scores, matched
+
+    def rank(self, query: str, k: int = 10, kind: Optional[str] = None, language: str = '') -> List[RankedDocument]:
+        """أفضل k مستندات للاستعلام (kind: 'article' أو 'appendix' للتقييد)"""
+        return self.rank_terms([query], k, kind, language)
+
+    def rank_terms(self, terms: Iterable[str], k: int = 10, kind: Optional[str] = None,
+                   language: str = '') -> List[RankedDocument]:
+        """ترتيب المستندات لقائمة مصطلحات"""
+        scores, matched = self.score_terms(terms)
+        documents = self.index.documents
+        ranked = [
+            RankedDocument(documents[doc_id], score, language, tuple(matched[doc_id]))
+            for doc_id, score in scores.items()
+            if kind is None or documents[doc_id].kind == kind
+        ]
+        # ties keep corpus order
+        ranked.sort(key=lambda result: (-result.score, result.doc.doc_id))
+        return ranked[:k]
+
+
+_ranker_cache: Dict[int, Tuple[LegalIndex, BM25FRanker]] = {}
+_ranker_lock = threading.Lock()
+
+
+def get_ranker(data: Any) -> BM25FRanker:
+    """إرجاع مرتب بيانات اللغة (تُحسب الإحصائيات مرة واحدة لكل فهرس)"""
+    index = get_index(data)
+    entry = _ranker_cache.get(id(index))
+    if entry is not None and entry[0] is index:
+        return entry[1]
+
+    with _ranker_lock:
+        entry = _ranker_cache.get(id(index))
+        if entry is None or entry[0] is not index:
+            if len(_ranker_cache) >= RANKER_CACHE_SIZE:
+                _ranker_cache.clear()
+            entry = (index, BM25FRanker(index))
+            _ranker_cache[id(index)] = entry
+        return entry[1]
+
+
+def rank(query: str, language: str = 'both', k: int = 10, kind: Optional[str] = None,
+         source: str = DEFAULT_SOURCE) -> List[RankedDocument]:
+    """واجهة الترتيب المشتركة لجميع نقاط النهاية
+
+    language: 'arabic'/'ar', 'english'/'en' or 'both' (results of both
+    languages merged by score).
+    """
+    corpus = get_corpus(source)
+    languages = [LANGUAGES[language]] if language in LANGUAGES else ['arabic', 'english']
+
+    results: List[RankedDocument] = []
+    for name in languages:
+        results.extend(get_ranker(corpus.language_data(name)).rank(query, k, kind, name))
+    results.sort(key=lambda result: -result.score)
+    return results[:k]
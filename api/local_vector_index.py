@@ -0,0 +1,262 @@
+"""
+ITPF Legal Search - Local Exact Vector Index
+فهرس متجهات محلي دقيق: مصفوفة تمثيل محسوبة مسبقاً ومحفوظة على القرص
+
+Build:    python -m api.local_vector_index build   (needs the embeddings model once)
+
+Per language the index is two files next to the corpus artifacts:
+legal_vectors_<lang>.npy holds the chunk embeddings as L2-normalized float32
+rows, legal_vectors_<lang>.json holds the chunk metadata, a stable vector id
+and a content hash per chunk, plus the model name and a hash of all embedded
+texts. At startup the matrix is memory-mapped, so no chunk is re-encoded; when
+some texts change only the chunks whose hash changed are encoded again (the
+rest of the rows are copied) and diff_indexes() names the vector ids to
+upsert or delete. Rows are normalized, so a query is one matrix-vector
+product (cosine similarity) and an argpartition top-k.
+"""
+
+import hashlib
+import json
+import logging
+import os
+from collections import Counter
+from dataclasses import dataclass, field
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+API_DIR = os.path.dirname(os.path.abspath(__file__))
+FORMAT_VERSION = 2
+
+
+def index_paths(language: str, directory: Optional[str] = None) -> Tuple[str, str]:
+    """مسارا ملف المصفوفة وملف البيانات الوصفية للغة"""
+    base = os.path.join(directory or API_DIR, f'legal_vectors_{language}')
+    return base + '.npy', base + '.json'
+
+
+def normalize_rows(matrix: Any) -> np.ndarray:
+    """تحويل المتجهات إلى float32 بطول 1 (الصفوف الصفرية تبقى صفرية)"""
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if matrix.ndim == 1:
+        matrix = matrix.reshape(1, -1)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def texts_version(texts: Iterable[str], model_name: str) -> str:
+    """بصمة النصوص المُمثلة والنموذج، لاكتشاف الفهرس القديم"""
+    hasher = hashlib.sha256(model_name.encode('utf-8'))
+    for text in texts:
+        hasher.update(b'\x00')
+        hasher.update(text.encode('utf-8'))
+    return hasher.hexdigest()[:16]
+
+
+def chunk_hash(text: str, model_name: str) -> str:
+    """بصمة مقطع واحد (النص المُمثل والنموذج)"""
+    return texts_version([text], model_name)
+
+
+def vector_ids(chunks: List[Dict[str, Any]], language: str) -> List[str]:
+    """معرفات ثابتة للمتجهات مستقلة عن موضع المقطع
+
+    chunk_id alone is not unique (appendices without a number all become
+    app_unknown_<lang>), so repeated ids get an occurrence suffix.
+    """
+    seen: Counter = Counter()
+    ids = []
+    for chunk in chunks:
+        base = f"{language}_{chunk['chunk_id']}"
+        ids.append(base if not seen[base] else f"{base}_{seen[base]}")
+        seen[base] += 1
+    return ids
+
+
+@dataclass
+class IndexDelta:
+    """الفرق بين فهرسين: صفوف للرفع، معرفات للحذف، وعدد المقاطع المعاد استخدامها
+
+    rebuilt: there was no previous local index, so the ids already in a
+    remote store are unknown (e.g. the old position-based
+    {lang}_{chunk_id}_{i} ids) and the store should drop the language first.
+    """
+    upserted: List[int] = field(default_factory=list)
+    deleted: List[str] = field(default_factory=list)
+    reused: int = 0
+    encoded: int = 0
+    rebuilt: bool = False
+
+    def stats(self) -> Dict[str, int]:
+        return {'upserted': len(self.upserted), 'deleted': len(self.deleted),
+                'reused': self.reused, 'encoded': self.encoded}
+
+
+class LocalVectorIndex:
+    """بحث دقيق بتشابه جيب التمام على مصفوفة متجهات لغة واحدة"""
+
+    def __init__(self, language: str, chunks: List[Dict[str, Any]], embeddings: Any,
+                 model_name: str, version: str, normalized: bool = False,
+                 hashes: Optional[List[str]] = None, ids: Optional[List[str]] = None):
+        self.language = language
+        self.chunks = chunks
+        # a memory-mapped matrix from load_vector_index() is already normalized
+        self.embeddings = embeddings if normalized else normalize_rows(embeddings)
+        self.model_name = model_name
+        self.version = version
+        self.hashes = list(hashes) if hashes is not None else [''] * len(chunks)
+        self.ids = list(ids) if ids is not None else vector_ids(chunks, language)
+        if not len(self.chunks) == self.embeddings.shape[0] == len(self.hashes) == len(self.ids):
+            raise ValueError(f"{len(self.chunks)} chunks but {self.embeddings.shape[0]} vectors")
+
+    def rows_by_hash(self) -> Dict[str, int]:
+        """بصمة المقطع -> رقم الصف (لإعادة استخدام المتجهات غير المتغيرة)"""
+        return {chunk_digest: row for row, chunk_digest in enumerate(self.hashes) if chunk_digest}
+
+    def __len__(self) -> int:
+        return len(self.chunks)
+
+    @property
+    def dimension(self) -> int:
+        return int(self.embeddings.shape[1])
+
+    def search(self, query_embedding: Any, top_k: int = 5) -> List[Tuple[int, float]]:
+        """أفضل k صفوف (الفهرس، التشابه) مرتبة تنازلياً"""
+        count = len(self.chunks)
+        top_k = min(top_k, count)
+        if top_k <= 0:
+            return []
+
+        query = normalize_rows(query_embedding)[0]
+        similarities = self.embeddings @ query
+        if top_k < count:
+            # O(n) selection of the top k, then only those k are sorted
+            top_indices = np.argpartition(-similarities, top_k - 1)[:top_k]
+        else:
+            top_indices = np.arange(count)
+        top_indices = top_indices[np.argsort(-similarities[top_indices], kind='stable')]
+        return [(int(idx), float(similarities[idx])) for idx in top_indices]
+
+    def results(self, query_embedding: Any, top_k: int = 5) -> List[Dict[str, Any]]:
+        """نتائج البحث بصيغة semantic_search (نسخة من المقطع مع الدرجة والترتيب)"""
+        results = []
+        for idx, similarity in self.search(query_embedding, top_k):
+            result = dict(self.chunks[idx])
+            result['similarity_score'] = similarity
+            result['rank'] = len(results) + 1
+            results.append(result)
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'chunks': len(self.chunks),
+            'dimension': self.dimension,
+            'model_name': self.model_name,
+            'version': self.version,
+            'memory_mapped': isinstance(self.embeddings, np.memmap),
+        }
+
+
+def save_vector_index(index: LocalVectorIndex, directory: Optional[str] = None) -> Dict[str, Any]:
+    """حفظ المصفوفة والبيانات الوصفية (كتابة ذرية عبر ملفات مؤقتة)"""
+    matrix_path, metadata_path = index_paths(index.language, directory)
+    header = {
+        'format_version': FORMAT_VERSION,
+        'language': index.language,
+        'model_name': index.model_name,
+        'version': index.version,
+        'count': len(index),
+        'dimension': index.dimension,
+    }
+
+    temp_matrix_path = matrix_path + '.tmp.npy'
+    np.save(temp_matrix_path, np.ascontiguousarray(index.embeddings, dtype=np.float32))
+    temp_metadata_path = metadata_path + '.tmp'
+    with open(temp_metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(dict(header, ids=index.ids, hashes=index.hashes, chunks=index.chunks), f, ensure_ascii=False)
+    os.replace(temp_matrix_path, matrix_path)
+    os.replace(temp_metadata_path, metadata_path)
+    return header
+
+
+def load_vector_index(language: str, version: Optional[str] = None, model_name: Optional[str] = None,
+                      directory: Optional[str] = None) -> Optional[LocalVectorIndex]:
+    """تحميل الفهرس المحفوظ مع ربط المصفوفة بالذاكرة، أو None إذا كان غير موجود أو قديماً"""
+    matrix_path, metadata_path = index_paths(language, directory)
+    if not (os.path.exists(matrix_path) and os.path.exists(metadata_path)):
+        return None
+
+    try:
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            metadata = json.load(f)
+        if metadata.get('format_version') != FORMAT_VERSION:
+            return None
+        if version is not None and metadata.get('version') != version:
+            logger.info(f"Vector index for {language} is stale (texts changed), rebuilding")
+            return None
+        if model_name is not None and metadata.get('model_name') != model_name:
+            logger.info(f"Vector index for {language} was built with {metadata.get('model_name')}, rebuilding")
+            return None
+
+        embeddings = np.load(matrix_path, mmap_mode='r')
+        if embeddings.dtype != np.float32 or embeddings.shape != (metadata['count'], metadata['dimension']):
+            return None
+        return LocalVectorIndex(language, metadata['chunks'], embeddings,
+                                metadata['model_name'], metadata['version'], normalized=True,
+                                hashes=metadata['hashes'], ids=metadata['ids'])
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not load vector index for {language}: {e}")
+        return None
+
+
+def diff_indexes(previous: Optional[LocalVectorIndex], current: LocalVectorIndex) -> IndexDelta:
+    """معرفات المتجهات الجديدة أو المتغيرة (للرفع) والمحذوفة (للحذف) بين نسختين"""
+    if previous is None:
+        return IndexDelta(upserted=list(range(len(current))), rebuilt=True)
+    previous_hashes = dict(zip(previous.ids, previous.hashes))
+    current_ids = set(current.ids)
+    return IndexDelta(
+        upserted=[row for row, (vector_id, chunk_digest) in enumerate(zip(current.ids, current.hashes))
+                  if previous_hashes.get(vector_id) != chunk_digest],
+        deleted=[vector_id for vector_id in previous.ids if vector_id not in current_ids],
+    )
+
+
+async def build_vector_indexes() -> Dict[str, Any]:
+    """بناء فهارس المتجهات للغتين من اللقطة المشتركة وحفظها، مع تقرير مزامنة خلفية المتجهات
+
+    Every language has 'synced': False when processing failed or the vector
+    store did not take all of its vectors ('sync' lists the failed batches).
+    """
+    from .embeddings import embeddings_manager
+    from .legal_corpus import get_corpus
+
+    corpus = get_corpus()
+    reports = await embeddings_manager.process_all_texts(corpus.arabic, corpus.english)
+    results = {}
+    for language in ('ar', 'en'):
+        index = embeddings_manager.vector_indexes.get(language)
+        result = dict(index.stats(), changes=embeddings_manager.index_deltas[language].stats()) if index else {}
+        report = reports.get(language) if reports is not None else None
+        result['sync'] = report.stats() if report is not None else None
+        result['synced'] = reports is not None and (report is None or report.ok)
+        results[language] = result
+    return results
+
+
+if __name__ == "__main__":
+    import asyncio
+    import sys
+
+    command = sys.argv[1] if len(sys.argv) > 1 else 'build'
+    if command == 'build':
+        logging.basicConfig(level=logging.INFO)
+        results = asyncio.run(build_vector_indexes())
+        print(json.dumps(results, indent=2))
+        if not all(result['synced'] for result in results.values()):
+            sys.exit(1)
+    else:
+        print("usage: python -m api.local_vector_index build")
@@ -6,12 +6,20 @@
 from fastapi import FastAPI, HTTPException
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-import json
 import os
 import re
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+try:
+    from .legal_corpus import get_corpus, reload_corpus
+    from .legal_index import get_index
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_corpus import get_corpus, reload_corpus
+    from legal_index import get_index
+
 app = FastAPI(
     title="ITPF Legal Search API - Simplified",
     description="نسخة مبسطة للاختبار مع الحفاظ على سلامة النصوص",
@@ -34,23 +42,14 @@ class SimplifiedLegalTextLoader:
         self.loaded = False
         
     async def load_data(self):
-        """تحميل البيانات القانونية"""
+        """تحميل البيانات القانونية من اللقطة المشتركة"""
         if self.loaded:
             return
             
         try:
-            # تحميل البيانات العربية
-            arabic_file = os.path.join(self.api_dir, "arabic_legal_rules_complete_authentic.json")
-            if os.path.exists(arabic_file):
-                with open(arabic_file, 'r', encoding='utf-8') as f:
-                    self.arabic_data = json.load(f)
-            
-            # تحميل البيانات الإنجليزية
-            english_file = os.path.join(self.api_dir, "english_legal_rules_complete_authentic.json")
-            if os.path.exists(english_file):
-                with open(english_file, 'r', encoding='utf-8') as f:
-                    self.english_data = json.load(f)
-                    
+            corpus = get_corpus('complete')
+            self.arabic_data = corpus.arabic or None
+            self.english_data = corpus.english or None
             self.loaded = True
             
         except Exception as e:
@@ -127,10 +126,8 @@ class SimplifiedLegalTextLoader:
         
         # فحص البيانات الإنجليزية
         if self.english_data:
-            english_articles = []
-            # استخراج المقالات من الفصول
-            for chapter in self.english_data.get('chapters', []):
-                english_articles.extend(chapter.get('articles', []))
+            # المقالات مستخرجة مسبقاً من الفصول في اللقطة المشتركة
+            english_articles = self.english_data.get('articles', [])
             english_appendices = self.english_data.get('appendices', [])
             
             # فحص الأرقام
@@ -196,12 +193,9 @@ class SimplifiedLegalTextLoader:
         
         # البحث في البيانات العربية
         if language in ["arabic", "both"] and self.arabic_data:
-            arabic_articles = self.arabic_data.get('articles', [])
-            for item in arabic_articles:
-                title = item.get('title', '').lower()
-                content = item.get('content', '').lower()
-                
-                if query_lower in title or query_lower in content:
+            for doc in get_index(self.arabic_data).documents_matching(query_lower, ('title', 'content')):
+                if doc.kind == 'article':
+                    item = doc.item
                     results.append({
                         "id": item.get('article_number', ''),
                         "title": item.get('title', ''),
@@ -215,13 +209,9 @@ class SimplifiedLegalTextLoader:
         
         # البحث في البيانات الإنجليزية
         if language in ["english", "both"] and self.english_data:
-            english_articles = self.english_data.get('articles', [])
-            
-            for item in english_articles:
-                title = item.get('title', '').lower()
-                content = item.get('content', '').lower()
-                
-                if query_lower in title or query_lower in content:
+            for doc in get_index(self.english_data).documents_matching(query_lower, ('title', 'content')):
+                if doc.kind == 'article':
+                    item = doc.item
                     results.append({
                         "id": item.get('article_number', ''),
                         "title": item.get('title', ''),
@@ -336,6 +326,7 @@ async def restore_from_reference():
                 shutil.copy2(complete_file, target_file)
                 
         # إعادة تحميل البيانات والتحقق
+        reload_corpus('complete')
         text_loader.loaded = False
         await text_loader.load_data()
         new_integrity = await text_loader.verify_integrity()
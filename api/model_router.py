@@ -0,0 +1,243 @@
+"""
+ITPF Legal System - Model Router
+توجيه الأسئلة حسب التعقيد: الأسئلة التعريفية والبحثية محلياً، والمعقدة فقط إلى DeepSeek
+
+classify() (formerly DeepSeekIntegration.analyze_query_complexity) picks one
+of three routes:
+
+    local_fast          definitions and article lookups, answered from the
+                        local retrieval and formatting code
+    deepseek_chat       ordinary scenario questions
+    deepseek_reasoner   comparisons, multi-article reasoning, appendices
+
+Every route has a latency budget (ITPF_ROUTE_BUDGET_<ROUTE>, seconds) that
+is the end-to-end SLO of a question sent to it. A remote route gets what is
+left of that budget as its timeout; when it times out or fails the router
+falls back to the next cheaper route (reasoner -> chat -> local) while at
+least MIN_REMOTE_SECONDS remain, and to the local answer otherwise. The
+RouteDecision of every question is returned for the response metadata, and
+per-route counts and SLO misses are kept for the stats endpoints.
+"""
+
+import asyncio
+import os
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
+
+try:
+    from .deepseek_keys import MIN_REMOTE_SECONDS
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from deepseek_keys import MIN_REMOTE_SECONDS
+
+LOCAL_ROUTE = 'local_fast'
+ROUTES = (LOCAL_ROUTE, 'deepseek_chat', 'deepseek_reasoner')
+# المسار الأرخص عند تجاوز الميزانية أو الفشل
+CHEAPER_ROUTE = {'deepseek_reasoner': 'deepseek_chat', 'deepseek_chat': LOCAL_ROUTE}
+ROUTE_MODELS = {'deepseek_chat': 'deepseek-chat', 'deepseek_reasoner': 'deepseek-reasoner'}
+DEFAULT_BUDGETS = {LOCAL_ROUTE: 1.0, 'deepseek_chat': 20.0, 'deepseek_reasoner': 45.0}
+LATENCY_BUDGETS = {route: float(os.getenv(f'ITPF_ROUTE_BUDGET_{route.upper()}', str(seconds)))
+                   for route, seconds in DEFAULT_BUDGETS.items()}
+
+# مؤشرات التعقيد العالي (تُطابق من بداية الكلمة لتشمل تصريفاتها: analyzed, relationship)
+COMPLEX_INDICATORS = [
+    'قارن', 'اربط', 'حلل', 'استنتج', 'ما الفرق', 'كيف يؤثر',
+    'ما العلاقة', 'في أي حالة', 'متى يجب', 'كيف يمكن',
+    'compare', 'analyze', 'relate', 'difference', 'relationship'
+]
+# صيغ التعريف والسرد في بداية السؤال فقط
+DEFINITION_PREFIXES = [
+    'ما معنى', 'ما تعريف', 'عرف', 'اذكر',
+    'define', 'definition of', 'meaning of', 'list'
+]
+# "ما هو الوتد؟" / "what is a peg?": سؤال تعريف إذا كان المسؤول عنه قصيراً
+WHAT_IS_PREFIXES = ['ما هو', 'ما هي', 'what is', 'what are', "what's"]
+MAX_DEFINITION_WORDS = 3
+# الشرط والأرقام تعني سيناريو يحتاج تحليلاً لا تعريفاً
+SCENARIO_WORDS = ['if', 'unless', 'when', 'إذا', 'اذا', 'وإذا', 'فإذا', 'لو', 'ولو', 'عندما', 'حال']
+
+
+def _phrases(phrases: Sequence[str]) -> str:
+    return '|'.join(re.escape(phrase) for phrase in sorted(phrases, key=len, reverse=True))
+
+
+COMPLEX_PATTERN = re.compile(rf'(?<!\w)(?:{_phrases(COMPLEX_INDICATORS)})', re.IGNORECASE)
+DEFINITION_PATTERN = re.compile(rf'^\s*(?:{_phrases(DEFINITION_PREFIXES)})(?!\w)|^\s*what does .+ mean\W*$',
+                                re.IGNORECASE)
+WHAT_IS_PATTERN = re.compile(rf'^\s*(?:{_phrases(WHAT_IS_PREFIXES)})(?!\w)(.*)$', re.IGNORECASE)
+SCENARIO_PATTERN = re.compile(rf'\d|(?<!\w)(?:{_phrases(SCENARIO_WORDS)})(?!\w)', re.IGNORECASE)
+# "المادة 12" / "article 12" دون سؤال عن حالة: بحث عن نص
+ARTICLE_LOOKUP = re.compile(r'^\s*(?:نص\s+)?(?:المادة|مادة|article|rule)\s*\d+\s*[؟?]?\s*$', re.IGNORECASE)
+DIACRITICS = re.compile(r'[\u064B-\u065F\u0670\u0640]')
+
+
+def classify(question: str) -> str:
+    """تحليل تعقيد السؤال لتحديد المسار المناسب
+
+    local_fast is only for definitions, enumerations and article lookups;
+    indicators are matched on word boundaries ("specialist" is not "list",
+    "يعرف" is not "عرف") and any condition or number keeps the question on
+    a DeepSeek route.
+    """
+    question_lower = DIACRITICS.sub('', question).lower().strip()
+
+    # أسئلة عن الملاحق تحتاج تحليل متخصص
+    if 'ملحق' in question_lower or 'appendix' in question_lower:
+        return 'deepseek_reasoner'
+
+    if COMPLEX_PATTERN.search(question_lower):
+        return 'deepseek_reasoner'
+
+    if ARTICLE_LOOKUP.match(question_lower):
+        return LOCAL_ROUTE
+
+    if SCENARIO_PATTERN.search(question_lower):
+        return 'deepseek_chat'
+
+    if DEFINITION_PATTERN.match(question_lower):
+        return LOCAL_ROUTE
+
+    what_is = WHAT_IS_PATTERN.match(question_lower)
+    if what_is and len(re.findall(r'\w+', what_is.group(1))) <= MAX_DEFINITION_WORDS:
+        return LOCAL_ROUTE
+
+    # افتراضي للأسئلة المتوسطة
+    return 'deepseek_chat'
+
+
+@dataclass
+class RouteDecision:
+    """قرار التوجيه لسؤال واحد كما يظهر في بيانات الاستجابة"""
+    requested: str
+    route: str
+    reason: str
+    budget_seconds: float
+    elapsed_ms: float = 0.0
+    slo_met: bool = True
+    attempts: List[Dict[str, Any]] = field(default_factory=list)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return asdict(self)
+
+
+class ModelRouter:
+    """تنفيذ قرار التوجيه ضمن ميزانية الزمن مع الرجوع للمسار الأرخص"""
+
+    def __init__(self, budgets: Optional[Dict[str, float]] = None):
+        self.budgets = dict(budgets or LATENCY_BUDGETS)
+        self.counts: Dict[str, int] = {route: 0 for route in ROUTES}
+        self.fallbacks = 0
+        self.slo_misses = 0
+        self.total_ms: Dict[str, float] = {route: 0.0 for route in ROUTES}
+        self._lock = threading.Lock()
+
+    def decide(self, question: str, allowed: Sequence[str] = ROUTES) -> RouteDecision:
+        """المسار المطلوب للسؤال (يُخفض إلى أقوى مسار متاح لنقطة النهاية)"""
+        requested = classify(question)
+        route, reason = requested, 'classified'
+        while route not in allowed:
+            route, reason = CHEAPER_ROUTE[route], f'{requested} not served here'
+        return RouteDecision(requested, route, reason, self.budgets[route])
+
+    def _attempt(self, decision: RouteDecision, route: str, outcome: str, started: float) -> None:
+        decision.attempts.append({'route': route, 'outcome': outcome,
+                                  'elapsed_ms': round((time.perf_counter() - started) * 1000, 1)})
+
+    def _finish(self, decision: RouteDecision, route: str, started: float) -> None:
+        decision.route = route
+        decision.elapsed_ms = round((time.perf_counter() - started) * 1000, 1)
+        decision.slo_met = decision.elapsed_ms <= decision.budget_seconds * 1000
+        with self._lock:
+            self.counts[route] += 1
+            self.total_ms[route] += decision.elapsed_ms
+            self.fallbacks += len(decision.attempts) > 1
+            self.slo_misses += not decision.slo_met
+
+    def _next_route(self, decision: RouteDecision, route: str, deadline: float) -> str:
+        route = CHEAPER_ROUTE[route]
+        if route != LOCAL_ROUTE and deadline - time.perf_counter() < MIN_REMOTE_SECONDS:
+            decision.attempts.append({'route': route, 'outcome': 'skipped_budget', 'elapsed_ms': 0.0})
+            route = LOCAL_ROUTE
+        return route
+
+    async def run(self, decision: RouteDecision, remote: Callable[[str, float], Awaitable[Optional[Any]]],
+                  local: Callable[[], Any]) -> Any:
+        """تنفيذ القرار: remote(route, timeout) يعيد الإجابة أو None عند الفشل"""
+        started = time.perf_counter()
+        deadline = started + decision.budget_seconds
+        route = decision.route
+        while route != LOCAL_ROUTE:
+            attempt_started = time.perf_counter()
+            remaining = deadline - attempt_started
+            try:
+                answer = await asyncio.wait_for(remote(route, remaining), remaining)
+            except asyncio.TimeoutError:
+                self._attempt(decision, route, 'timeout', attempt_started)
+            except Exception as e:
+                print(f"Route {route} failed: {str(e)}")
+                self._attempt(decision, route, 'error', attempt_started)
+            else:
+                if answer is not None:
+                    self._attempt(decision, route, 'ok', attempt_started)
+                    self._finish(decision, route, started)
+                    return answer
+                self._attempt(decision, route, 'failed', attempt_started)
+            route = self._next_route(decision, route, deadline)
+
+        attempt_started = time.perf_counter()
+        answer = local()
+        self._attempt(decision, LOCAL_ROUTE, 'ok', attempt_started)
+        self._finish(decision, LOCAL_ROUTE, started)
+        return answer
+
+    def run_sync(self, decision: RouteDecision, remote: Callable[[str, float], Optional[Any]],
+                 local: Callable[[], Any]) -> Any:
+        """نسخة متزامنة من run(): remote ملزم باحترام المهلة الممررة إليه"""
+        started = time.perf_counter()
+        deadline = started + decision.budget_seconds
+        route = decision.route
+        while route != LOCAL_ROUTE:
+            attempt_started = time.perf_counter()
+            try:
+                answer = remote(route, deadline - attempt_started)
+            except Exception as e:
+                print(f"Route {route} failed: {str(e)}")
+                answer = None
+            if answer is not None:
+                self._attempt(decision, route, 'ok', attempt_started)
+                self._finish(decision, route, started)
+                return answer
+            outcome = 'timeout' if time.perf_counter() >= deadline else 'failed'
+            self._attempt(decision, route, outcome, attempt_started)
+            route = self._next_route(decision, route, deadline)
+
+        attempt_started = time.perf_counter()
+        answer = local()
+        self._attempt(decision, LOCAL_ROUTE, 'ok', attempt_started)
+        self._finish(decision, LOCAL_ROUTE, started)
+        return answer
+
+    def record(self, decision: RouteDecision, route: str, started: float,
+               outcomes: List[Tuple[str, str]]) -> None:
+        """تسجيل قرار نُفذ خارج الموجه (البث): outcomes = [(route, outcome), ...]"""
+        for attempted, outcome in outcomes:
+            decision.attempts.append({'route': attempted, 'outcome': outcome})
+        self._finish(decision, route, started)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'budgets_seconds': self.budgets,
+            'routes': {route: {'count': count,
+                               'average_ms': round(self.total_ms[route] / count, 1) if count else None}
+                       for route, count in self.counts.items()},
+            'fallbacks': self.fallbacks,
+            'slo_misses': self.slo_misses,
+        }
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+model_router = ModelRouter()
@@ -0,0 +1,291 @@
+"""
+ITPF Legal System - Passage Index
+فهرس مقاطع على مستوى الجمل لبناء سياق النموذج من أنسب المقاطع بدلاً من قص المواد
+
+Endpoints used to send the first 200-500 characters of every hit to DeepSeek,
+which cuts rules mid-sentence and drops the part that actually answers the
+question. The passage index splits every article, subsection and appendix
+section (the day_1/day_2/... structures rendered line by line) into sentences
+once, and groups short neighbouring sentences into windows of at most
+MAX_PASSAGE_CHARS. Passages keep a stable id, the document they belong to,
+the source field and their offsets in its text, so the same passage is
+addressable across requests and processes.
+
+Passages are scored with BM25 over the same analyzed tokens as the document
+ranker; select() returns the best passages of the retrieved documents that
+fit a token budget, in reading order.
+"""
+
+import math
+import os
+import re
+import threading
+from collections import Counter
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import Any, Dict, Iterable, List, Mapping, Optional, Sequence, Tuple
+
+try:
+    from .legal_index import IndexedDocument, TOKEN_PATTERN, fold_text, get_index
+    from .legal_ranker import K1, NORMALIZED_STOPWORDS, get_ranker
+    from .arabic_normalizer import analyze_token, normalize_arabic
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from legal_index import IndexedDocument, TOKEN_PATTERN, fold_text, get_index
+    from legal_ranker import K1, NORMALIZED_STOPWORDS, get_ranker
+    from arabic_normalizer import analyze_token, normalize_arabic
+
+# نهاية الجملة: علامة ترقيم يليها فراغ (لا تقسم "6.4 ثواني")، أو سطر جديد
+SENTENCE_BREAK = re.compile(r'(?<=[.!?؟;؛])\s+|\s*\n+\s*')
+MAX_PASSAGE_CHARS = 400
+MIN_PASSAGE_CHARS = 80
+# تقدير عدد رموز النموذج دون تحميل المُرمِّز: الكلمة العربية تُقسم إلى رموز أكثر من الإنجليزية،
+# والأرقام تُرمَّز كل 3 خانات، وعلامات الترقيم والرموز التعبيرية رمز لكل منها
+ARABIC_CHARS_PER_TOKEN = 3.0
+LATIN_CHARS_PER_TOKEN = 4.0
+DIGITS_PER_TOKEN = 3.0
+TOKEN_RUNS = re.compile(r'(?P<arabic>[\u0600-\u06ff\u0750-\u077f\ufb50-\ufdff\ufe70-\ufeff]+)|(?P<digits>\d+)'
+                        r'|(?P<latin>[^\W\d_]+)|(?P<other>[^\s])')
+RUN_CHARS_PER_TOKEN = {'arabic': ARABIC_CHARS_PER_TOKEN, 'digits': DIGITS_PER_TOKEN, 'latin': LATIN_CHARS_PER_TOKEN}
+DEFAULT_TOKEN_BUDGET = int(os.getenv('ITPF_CONTEXT_TOKEN_BUDGET', '600'))
+PASSAGE_B = 0.5
+
+PASSAGE_CACHE_SIZE = 16
+SPLIT_CACHE_SIZE = 4096
+
+
+def estimate_tokens(text: str) -> int:
+    """عدد تقريبي لرموز النموذج في النص (عربي وإنجليزي)"""
+    tokens = 0
+    for match in TOKEN_RUNS.finditer(text):
+        chars_per_token = RUN_CHARS_PER_TOKEN.get(match.lastgroup)
+        tokens += math.ceil(len(match.group()) / chars_per_token) if chars_per_token else 1
+    return max(1, tokens)
+
+
+@lru_cache(maxsize=SPLIT_CACHE_SIZE)
+def split_sentences(text: str) -> Tuple[Tuple[int, int], ...]:
+    """مواضع (البداية، النهاية) للجمل غير الفارغة في النص"""
+    spans = []
+    start = 0
+    for match in SENTENCE_BREAK.finditer(text):
+        if match.start() > start:
+            spans.append((start, match.start()))
+        start = match.end()
+    if start < len(text) and text[start:].strip():
+        spans.append((start, len(text)))
+    return tuple(spans)
+
+
+@lru_cache(maxsize=SPLIT_CACHE_SIZE)
+def split_passages(text: str, max_chars: int = MAX_PASSAGE_CHARS) -> Tuple[Tuple[int, int], ...]:
+    """تجميع الجمل المتجاورة في مقاطع لا تتجاوز max_chars (الجملة الطويلة تُقسم عند الفراغات)"""
+    windows: List[Tuple[int, int]] = []
+    for start, end in split_sentences(text):
+        while end - start > max_chars:
+            cut = text.rfind(' ', start, start + max_chars)
+            cut = cut if cut > start else start + max_chars
+            windows.append((start, cut))
+            start = cut + 1 if text[cut:cut + 1] == ' ' else cut
+        if windows and end - windows[-1][0] <= max_chars and (
+                windows[-1][1] - windows[-1][0] < MIN_PASSAGE_CHARS or end - start < MIN_PASSAGE_CHARS):
+            windows[-1] = (windows[-1][0], end)
+        else:
+            windows.append((start, end))
+    return tuple(windows)
+
+
+def render_structure(value: Any) -> str:
+    """تحويل محتوى منظم (قواميس وقوائم الملاحق والأقسام الفرعية) إلى أسطر نصية
+
+    A mapping whose values are all scalars becomes one line ("فردي رمح - الأول
+    - 6 سم - 6.4 ثواني"); nested values get a line each.
+    """
+    if value is None:
+        return ''
+    if isinstance(value, str):
+        return value
+    if isinstance(value, Mapping):
+        values = list(value.values())
+        if all(not isinstance(item, (Mapping, list, tuple)) for item in values):
+            return ' - '.join(str(item) for item in values if item not in (None, ''))
+        return '\n'.join(filter(None, (render_structure(item) for item in values)))
+    if isinstance(value, (list, tuple)):
+        return '\n'.join(filter(None, (render_structure(item) for item in value)))
+    return str(value)
+
+
+@dataclass(frozen=True)
+class Passage:
+    """مقطع من حقل في مادة أو ملحق مع موضعه في نص الحقل"""
+    passage_id: str
+    doc_id: int
+    kind: str
+    source: str
+    start: int
+    end: int
+    text: str
+    terms: Tuple[str, ...]
+
+    @property
+    def tokens(self) -> int:
+        return estimate_tokens(self.text)
+
+
+def _document_key(doc: IndexedDocument) -> str:
+    number = doc.item.get('article_number' if doc.kind == 'article' else 'appendix_number')
+    prefix = 'art' if doc.kind == 'article' else 'app'
+    return f"{prefix}_{number if number is not None else f'doc{doc.doc_id}'}"
+
+
+def _document_sources(doc: IndexedDocument) -> List[Tuple[str, str]]:
+    """(اسم المصدر، النص) لكل جزء قابل للتقسيم من المستند"""
+    item = doc.item
+    content = item.get('content')
+    sources = []
+    if isinstance(content, Mapping):
+        # appendix day structures: one source per day/section
+        sources.extend((f'content/{key}', render_structure(value)) for key, value in content.items())
+    else:
+        sources.append(('content', render_structure(content)))
+    for position, subsection in enumerate(item.get('subsections') or ()):
+        sources.append((f'subsections/{position}', render_structure(subsection)))
+    return [(source, text) for source, text in sources if text.strip()]
+
+
+class PassageIndex:
+    """مقاطع جميع مستندات لغة واحدة مع إحصائيات BM25"""
+
+    def __init__(self, data: Any, max_chars: int = MAX_PASSAGE_CHARS):
+        self.index = get_index(data)
+        self.ranker = get_ranker(data)
+        self.passages: List[Passage] = []
+        self.by_id: Dict[str, Passage] = {}
+        self.by_document: Dict[int, List[int]] = {}
+        self.sources: Dict[Tuple[int, str], str] = {}
+
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        for doc in self.index.documents:
+            key = _document_key(doc)
+            for source, text in _document_sources(doc):
+                self.sources[(doc.doc_id, source)] = text
+                for position, (start, end) in enumerate(split_passages(text, max_chars)):
+                    passage_text = text[start:end].strip()
+                    terms = tuple(analyze_token(token) for token in TOKEN_PATTERN.findall(fold_text(passage_text)))
+                    passage = Passage(f'{key}/{source}#{position}', doc.doc_id, doc.kind, source,
+                                      start, end, passage_text, terms)
+                    passage_number = len(self.passages)
+                    self.passages.append(passage)
+                    self.by_id.setdefault(passage.passage_id, passage)
+                    self.by_document.setdefault(doc.doc_id, []).append(passage_number)
+                    for term, tf in Counter(terms).items():
+                        postings.setdefault(term, []).append((passage_number, tf))
+
+        # الأثر المسبق لكل كلمة في كل مقطع (BM25)
+        count = len(self.passages) or 1
+        average_length = sum(len(passage.terms) for passage in self.passages) / count or 1.0
+        self._impacts: Dict[str, List[Tuple[int, float]]] = {}
+        for term, term_postings in postings.items():
+            idf = math.log(1.0 + (count - len(term_postings) + 0.5) / (len(term_postings) + 0.5))
+            self._impacts[term] = [
+                (number, idf * tf * (K1 + 1.0) /
+                 (tf + K1 * (1.0 - PASSAGE_B + PASSAGE_B * len(self.passages[number].terms) / average_length)))
+                for number, tf in term_postings
+            ]
+
+    def __len__(self) -> int:
+        return len(self.passages)
+
+    def score(self, terms: Iterable[str], doc_ids: Optional[Iterable[int]] = None) -> Dict[int, float]:
+        """درجة كل مقطع مطابق (رقم المقطع -> الدرجة)"""
+        allowed = set(doc_ids) if doc_ids is not None else None
+        scores: Dict[int, float] = Counter()
+        for token in self.ranker.query_tokens(terms):
+            for number, impact in self._impacts.get(token, ()):
+                if allowed is None or self.passages[number].doc_id in allowed:
+                    scores[number] += impact
+        return scores
+
+    def search(self, terms: Iterable[str], k: int = 10,
+               doc_ids: Optional[Iterable[int]] = None) -> List[Tuple[Passage, float]]:
+        """أفضل k مقاطع مع درجاتها"""
+        scores = self.score(terms, doc_ids)
+        best = sorted(scores.items(), key=lambda entry: (-entry[1], entry[0]))[:k]
+        return [(self.passages[number], score) for number, score in best]
+
+    def select(self, terms: Iterable[str], doc_ids: Sequence[int], budget: int = DEFAULT_TOKEN_BUDGET,
+               per_document: int = 3) -> Dict[int, List[Passage]]:
+        """أنسب المقاطع لكل مستند ضمن ميزانية الرموز
+
+        doc_ids are the retrieved documents, best first. Passages are taken
+        by score across all of them (at most per_document each) while they
+        fit the budget; a document without any matching passage gets its
+        first passage if room is left. The result maps doc_id to passages in
+        reading order, in the order of doc_ids.
+        """
+        doc_ids = list(dict.fromkeys(doc_ids))
+        scores = self.score(terms, doc_ids)
+        chosen: Dict[int, List[int]] = {doc_id: [] for doc_id in doc_ids}
+        remaining = budget
+        for number, _ in sorted(scores.items(), key=lambda entry: (-entry[1], entry[0])):
+            passage = self.passages[number]
+            if len(chosen[passage.doc_id]) < per_document and passage.tokens <= remaining:
+                chosen[passage.doc_id].append(number)
+                remaining -= passage.tokens
+        for doc_id in doc_ids:
+            first = self.by_document.get(doc_id)
+            if not chosen[doc_id] and first and self.passages[first[0]].tokens <= remaining:
+                chosen[doc_id].append(first[0])
+                remaining -= self.passages[first[0]].tokens
+        return {doc_id: [self.passages[number] for number in sorted(numbers)]
+                for doc_id, numbers in chosen.items() if numbers}
+
+    def source_text(self, passage: Passage) -> str:
+        """النص الكامل للحقل الذي أُخذ منه المقطع"""
+        return self.sources[(passage.doc_id, passage.source)]
+
+
+def excerpt(text: Any, terms: Iterable[str], max_chars: int = MAX_PASSAGE_CHARS) -> str:
+    """أنسب الجمل في نص منفرد لكلمات السؤال ضمن max_chars، بترتيب ورودها
+
+    For context items that are not corpus documents; sentences are scored by
+    the number of distinct analyzed query terms they contain.
+    """
+    text = render_structure(text)
+    query = {analyze_token(token) for term in terms for token in TOKEN_PATTERN.findall(fold_text(str(term)))
+             if normalize_arabic(token) not in NORMALIZED_STOPWORDS}
+    spans = split_sentences(text)
+    scored = []
+    for position, (start, end) in enumerate(spans):
+        sentence_terms = {analyze_token(token) for token in TOKEN_PATTERN.findall(fold_text(text[start:end]))}
+        scored.append((-len(query & sentence_terms), position))
+    chosen, used = [], 0
+    for _, position in sorted(scored):
+        start, end = spans[position]
+        if used + (end - start) <= max_chars:
+            chosen.append(position)
+            used += end - start + 1
+    if not chosen:
+        return text[:max_chars]
+    return ' '.join(text[spans[position][0]:spans[position][1]].strip() for position in sorted(chosen))
+
+
+_passage_cache: Dict[int, Tuple[Any, PassageIndex]] = {}
+_passage_lock = threading.Lock()
+
+
+def get_passage_index(data: Any) -> PassageIndex:
+    """إرجاع فهرس مقاطع بيانات اللغة (يُبنى مرة واحدة لكل كائن بيانات)"""
+    entry = _passage_cache.get(id(data))
+    if entry is not None and entry[0] is data:
+        return entry[1]
+
+    with _passage_lock:
+        entry = _passage_cache.get(id(data))
+        if entry is None or entry[0] is not data:
+            if len(_passage_cache) >= PASSAGE_CACHE_SIZE:
+                _passage_cache.clear()
+            entry = (data, PassageIndex(data))
+            _passage_cache[id(data)] = entry
+        return entry[1]
@@ -0,0 +1,152 @@
+"""
+ITPF Legal System - Prompt Builder
+تجميع رسائل DeepSeek ضمن ميزانية رموز محددة مع تقرير بالاستهلاك
+
+The endpoints used to concatenate every context string into the user prompt
+without measuring it, so the input size - and the time to first token - grew
+with whatever the search returned. build_prompt() estimates tokens offline
+(passage_index.estimate_tokens, Arabic and English aware), packs context
+items greedily by score into what is left of the input budget after the
+system prompt and the question, drops sentences already present in a
+higher-scoring item (an article and its subsection often repeat text), cuts
+the last item at a sentence boundary when it only partly fits, and reports
+the token counts of every request.
+"""
+
+import os
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Sequence, Set
+
+try:
+    from .arabic_normalizer import normalize_arabic
+    from .passage_index import estimate_tokens, split_sentences
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from arabic_normalizer import normalize_arabic
+    from passage_index import estimate_tokens, split_sentences
+
+DEFAULT_INPUT_BUDGET = int(os.getenv('DEEPSEEK_INPUT_TOKEN_BUDGET', '2500'))
+# حدود رموز الإخراج لكل نمط (كانت مكتوبة في كل نقطة نهاية على حدة)
+MAX_OUTPUT_TOKENS = {'answer': 800, 'deepseek_chat': 4000, 'deepseek_reasoner': 8000}
+# الرموز الإضافية لكل رسالة في صيغة المحادثة
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+@dataclass
+class ContextItem:
+    """مرجع واحد في السياق: عنوان ونص ودرجة الصلة"""
+    label: str
+    text: str
+    score: float = 0.0
+
+
+@dataclass
+class PromptReport:
+    """استهلاك الرموز لطلب واحد"""
+    input_budget: int
+    max_output_tokens: int
+    system_tokens: int = 0
+    question_tokens: int = 0
+    context_tokens: int = 0
+    input_tokens: int = 0
+    items_used: int = 0
+    items_truncated: int = 0
+    items_dropped: int = 0
+    duplicate_sentences: int = 0
+
+    def to_dict(self) -> Dict[str, int]:
+        return asdict(self)
+
+
+@dataclass
+class BuiltPrompt:
+    """الرسائل الجاهزة للإرسال مع تقرير الرموز"""
+    system: str
+    user: str
+    report: PromptReport
+    items: List[ContextItem] = field(default_factory=list)
+
+    @property
+    def messages(self) -> List[Dict[str, str]]:
+        return [{"role": "system", "content": self.system}, {"role": "user", "content": self.user}]
+
+
+def max_output_tokens(mode: str) -> int:
+    """حد رموز الإخراج للنمط"""
+    return MAX_OUTPUT_TOKENS.get(mode, MAX_OUTPUT_TOKENS['deepseek_chat'])
+
+
+def _sentence_key(sentence: str) -> str:
+    return ' '.join(normalize_arabic(sentence).lower().split()).strip(' .،,؛;')
+
+
+def _pack_item(item: ContextItem, remaining: int, seen: Set[str], report: PromptReport) -> Optional[ContextItem]:
+    """نص المرجع بعد حذف الجمل المكررة وقصه عند حدود الجمل ليتسع للمتبقي"""
+    header_tokens = estimate_tokens(item.label) + 1
+    sentences = []
+    for start, end in split_sentences(item.text):
+        sentence = item.text[start:end].strip()
+        key = _sentence_key(sentence)
+        if key in seen:
+            report.duplicate_sentences += 1
+            continue
+        sentences.append((sentence, key))
+    if not sentences or header_tokens >= remaining:
+        return None
+
+    kept, used = [], header_tokens
+    for sentence, key in sentences:
+        tokens = estimate_tokens(sentence) + 1
+        if used + tokens > remaining:
+            break
+        kept.append((sentence, key))
+        used += tokens
+    if not kept:
+        return None
+    if len(kept) < len(sentences):
+        report.items_truncated += 1
+    seen.update(key for _, key in kept)
+    return ContextItem(item.label, ' '.join(sentence for sentence, _ in kept), item.score)
+
+
+def format_context(items: Sequence[ContextItem]) -> str:
+    """السياق كما يُرسل: العنوان ثم النص لكل مرجع"""
+    return ''.join(f"{item.label}\n{item.text}\n\n" for item in items)
+
+
+def build_prompt(system_prompt: str, question: str, items: Sequence[ContextItem], template: str,
+                 mode: str = 'deepseek_chat', input_budget: int = DEFAULT_INPUT_BUDGET) -> BuiltPrompt:
+    """بناء رسالتي النظام والمستخدم ضمن ميزانية الإدخال
+
+    template is the user message with {question} and {context} placeholders.
+    Items are taken by score (ties keep their order) and sent in their
+    original order.
+    """
+    report = PromptReport(input_budget=input_budget, max_output_tokens=max_output_tokens(mode))
+    report.system_tokens = estimate_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+    report.question_tokens = estimate_tokens(template.format(question=question, context='')) + MESSAGE_OVERHEAD_TOKENS
+    remaining = input_budget - report.system_tokens - report.question_tokens
+
+    packed: Dict[int, ContextItem] = {}
+    seen: Set[str] = set()
+    for position in sorted(range(len(items)), key=lambda position: -items[position].score):
+        item = _pack_item(items[position], remaining, seen, report) if remaining > 0 else None
+        if item is None:
+            report.items_dropped += 1
+            continue
+        packed[position] = item
+        remaining -= estimate_tokens(item.label) + estimate_tokens(item.text) + 2
+
+    chosen = [packed[position] for position in sorted(packed)]
+    context = format_context(chosen)
+    report.items_used = len(chosen)
+    report.context_tokens = estimate_tokens(context) if chosen else 0
+    report.input_tokens = report.system_tokens + report.question_tokens + report.context_tokens
+    return BuiltPrompt(system_prompt, template.format(question=question, context=context), report, chosen)
+
+
+def log_prompt_report(report: PromptReport) -> None:
+    print(f"📏 Prompt: ~{report.input_tokens}/{report.input_budget} input tokens "
+          f"({report.items_used} refs, {report.items_dropped} dropped, "
+          f"{report.duplicate_sentences} duplicate sentences), max_tokens={report.max_output_tokens}")
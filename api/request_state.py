@@ -0,0 +1,36 @@
+"""
+ITPF Legal System - Per-Request State
+بيانات الطلب الحالي (المسار، إصابة الذاكرة، تقرير البرومبت) دون مشاركتها بين الطلبات المتزامنة
+
+The answer systems are process-wide singletons but kept per-request metadata
+(last_route, last_cache_hit, last_prompt_report) as plain attributes, so two
+concurrent requests overwrote each other's metadata. RequestField keeps the
+value in a contextvars.ContextVar instead: every request thread, asyncio task
+and the generator it iterates sees its own value, while the code keeps
+reading and writing self.last_route as before.
+
+The variable belongs to the class attribute, not to an instance; that is all
+the singletons need.
+"""
+
+from contextvars import ContextVar
+from typing import Any, Optional
+
+
+class RequestField:
+    """خاصية قيمتها لكل طلب (contextvars) بدلاً من المثيل المشترك"""
+
+    def __init__(self, default: Any = None):
+        self.default = default
+        self.var: Optional[ContextVar] = None
+
+    def __set_name__(self, owner: type, name: str) -> None:
+        self.var = ContextVar(f'{owner.__name__}.{name}', default=self.default)
+
+    def __get__(self, instance: Any, owner: type) -> Any:
+        if instance is None:
+            return self
+        return self.var.get()
+
+    def __set__(self, instance: Any, value: Any) -> None:
+        self.var.set(value)
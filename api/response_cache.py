@@ -0,0 +1,182 @@
+"""
+ITPF Legal System - Answer Response Cache
+ذاكرة مؤقتة لإجابات DeepSeek: السؤال المتكرر لا يحتاج رحلة كاملة إلى الـ API
+
+A key is the normalized question (embedding_cache.normalize_query), the
+language, the model mode, the ids of the retrieved references and the corpus
+version, hashed together: the same question answered from different
+references, or after the rulebook JSON changed, is a different entry.
+Entries expire after a TTL and the in-memory tier is a bounded LRU. A second
+tier in SQLite (by default under /tmp, the only writable path on Vercel)
+lets warm answers survive cold starts of the same instance; rows stamped
+with an older version of the same corpus source are purged when an endpoint
+loads its corpus.
+
+Only successful DeepSeek answers are stored - fallbacks are cheap to rebuild
+and would hide a recovered API.
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+try:
+    from .embedding_cache import normalize_query
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from embedding_cache import normalize_query
+
+DEFAULT_MAX_SIZE = int(os.getenv('ITPF_RESPONSE_CACHE_SIZE', '256'))
+DEFAULT_TTL = float(os.getenv('ITPF_RESPONSE_CACHE_TTL', str(24 * 3600)))
+# مسار قاعدة SQLite؛ القيمة "0" تعطل الطبقة الثانية
+DEFAULT_PATH = os.getenv('ITPF_RESPONSE_CACHE', os.path.join(tempfile.gettempdir(), 'itpf_response_cache.sqlite3'))
+DISK_MAX_ROWS = int(os.getenv('ITPF_RESPONSE_CACHE_DISK_ROWS', '5000'))
+
+
+def corpus_stamp(corpus: Any) -> str:
+    """مصدر النصوص ونسختها ("complete:3f2a...")، يُخزن مع كل إجابة"""
+    return f"{corpus.source}:{corpus.version}"
+
+
+def response_key(question: str, language: str, mode: str, context_ids: Iterable[Any], stamp: str) -> str:
+    """مفتاح الإجابة: السؤال الموحد واللغة والنمط والمراجع المسترجعة ونسخة النصوص"""
+    payload = json.dumps(
+        [normalize_query(question), language, mode, sorted(str(context_id) for context_id in context_ids), stamp],
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class ResponseCache:
+    """ذاكرة LRU بمدة صلاحية مع طبقة SQLite اختيارية"""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL, path: str = DEFAULT_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = '' if path in ('', '0') else path
+        self.entries: 'OrderedDict[str, Tuple[float, Any]]' = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_failed = False
+
+    def _connection(self) -> Optional[sqlite3.Connection]:
+        """فتح قاعدة SQLite عند أول استخدام (None إذا تعذر ذلك)"""
+        if self._db is not None or self._db_failed or not self.path:
+            return self._db
+        try:
+            db = sqlite3.connect(self.path, timeout=1.0, check_same_thread=False)
+            db.execute('CREATE TABLE IF NOT EXISTS responses ('
+                       'key TEXT PRIMARY KEY, value TEXT NOT NULL, expires REAL NOT NULL, '
+                       'corpus_version TEXT NOT NULL, created REAL NOT NULL)')
+            db.execute('DELETE FROM responses WHERE expires < ?', (time.time(),))
+            db.commit()
+            self._db = db
+        except sqlite3.Error as e:
+            print(f"Response cache disk tier unavailable: {e}")
+            self._db_failed = True
+        return self._db
+
+    def get(self, key: str) -> Optional[Any]:
+        """الإجابة المحفوظة إن كانت صالحة، وإلا None"""
+        now = time.time()
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] >= now:
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+
+            db = self._connection()
+            row = None
+            if db is not None:
+                try:
+                    row = db.execute('SELECT value, expires FROM responses WHERE key = ? AND expires >= ?',
+                                     (key, now)).fetchone()
+                except sqlite3.Error as e:
+                    print(f"Response cache read failed: {e}")
+            if row is None:
+                self.misses += 1
+                return None
+            value = json.loads(row[0])
+            self._remember(key, row[1], value)
+            self.disk_hits += 1
+            return value
+
+    def put(self, key: str, value: Any, stamp: str = '') -> None:
+        """حفظ إجابة (قابلة للتحويل إلى JSON) في الطبقتين"""
+        now = time.time()
+        expires = now + self.ttl
+        with self._lock:
+            self._remember(key, expires, value)
+            db = self._connection()
+            if db is None:
+                return
+            try:
+                db.execute('INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?)',
+                           (key, json.dumps(value, ensure_ascii=False), expires, stamp, now))
+                # keep the disk tier bounded: drop the oldest rows beyond DISK_MAX_ROWS
+                db.execute('DELETE FROM responses WHERE key IN (SELECT key FROM responses '
+                           'ORDER BY created DESC LIMIT -1 OFFSET ?)', (DISK_MAX_ROWS,))
+                db.commit()
+            except sqlite3.Error as e:
+                print(f"Response cache write failed: {e}")
+
+    def _remember(self, key: str, expires: float, value: Any) -> None:
+        self.entries[key] = (expires, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+
+    def purge(self, stamp: str) -> int:
+        """حذف إجابات النسخ الأخرى لنفس مصدر النصوص من القرص (تُستدعى بعد تحميل النصوص)"""
+        source = stamp.split(':', 1)[0]
+        with self._lock:
+            db = self._connection()
+            if db is None:
+                return 0
+            try:
+                deleted = db.execute('DELETE FROM responses WHERE corpus_version LIKE ? AND corpus_version != ?',
+                                     (f'{source}:%', stamp)).rowcount
+                db.commit()
+                return deleted
+            except sqlite3.Error as e:
+                print(f"Response cache purge failed: {e}")
+                return 0
+
+    def clear(self) -> None:
+        with self._lock:
+            self.entries.clear()
+            self.hits = self.disk_hits = self.misses = 0
+            db = self._connection()
+            if db is not None:
+                db.execute('DELETE FROM responses')
+                db.commit()
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.disk_hits + self.misses
+        return {
+            'size': len(self.entries),
+            'max_size': self.max_size,
+            'ttl_seconds': self.ttl,
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+            'hit_rate': round((self.hits + self.disk_hits) / lookups, 4) if lookups else 0.0,
+            'persisted_to': self.path or None,
+        }
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+response_cache = ResponseCache()
@@ -9,120 +9,71 @@ import re
 from typing import List, Dict, Any, Optional
 from datetime import datetime
 
+try:
+    from .legal_corpus import get_corpus
+    from .legal_ranker import get_ranker
+    from .hybrid_retrieval import DEFAULT_FUSION, retrieve_sync
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(__file__))
+    from legal_corpus import get_corpus
+    from legal_ranker import get_ranker
+    from hybrid_retrieval import DEFAULT_FUSION, retrieve_sync
+
 
 def load_data():
-    """Load legal data from split JSON files"""
-    current_dir = os.path.dirname(os.path.abspath(__file__))
-    
-    # Load Arabic data from split files
-    arabic_data = {"metadata": {}, "articles": []}
-    for i in range(1, 4):  # Load parts 1, 2, 3
-        arabic_file = os.path.join(current_dir, f"arabic_data_part{i}.json")
-        if os.path.exists(arabic_file):
-            with open(arabic_file, 'r', encoding='utf-8') as f:
-                part_data = json.load(f)
-                if i == 1:  # Get metadata from first part
-                    arabic_data["metadata"] = part_data.get("metadata", {})
-                arabic_data["articles"].extend(part_data.get("articles", []))
-    
-    # Load English data from split files
-    english_data = {"metadata": {}, "chapters": []}
-    for i in range(1, 4):  # Load parts 1, 2, 3
-        english_file = os.path.join(current_dir, f"english_data_part{i}.json")
-        if os.path.exists(english_file):
-            with open(english_file, 'r', encoding='utf-8') as f:
-                part_data = json.load(f)
-                if i == 1:  # Get metadata from first part
-                    english_data["metadata"] = part_data.get("metadata", {})
-                english_data["chapters"].extend(part_data.get("chapters", []))
-    
-    # If no split files found, try original files as fallback
-    if not arabic_data["articles"]:
-        arabic_file = os.path.join(current_dir, "../arabic_legal_rules_complete_authentic.json")
-        if os.path.exists(arabic_file):
-            with open(arabic_file, 'r', encoding='utf-8') as f:
-                arabic_data = json.load(f)
-    
-    if not english_data["chapters"]:
-        english_file = os.path.join(current_dir, "../english_legal_rules_complete_authentic.json")
-        if os.path.exists(english_file):
-            with open(english_file, 'r', encoding='utf-8') as f:
-                english_data = json.load(f)
-                
-    return arabic_data, english_data
+    """Return the shared, already-parsed legal corpus (parsed once per process)"""
+    corpus = get_corpus()
+    return corpus.arabic, corpus.english
 
 
-def simple_search(query: str, language: str = "both", max_results: int = 10, arabic_data=None, english_data=None) -> List[Dict[str, Any]]:
-    """Simple text search without embeddings"""
-    results = []
-    query_lower = query.lower()
+def simple_search(query: str, language: str = "both", max_results: int = 10, arabic_data=None, english_data=None,
+                  fusion: str = DEFAULT_FUSION) -> List[Dict[str, Any]]:
+    """Hybrid search: BM25F fused with vector similarity when the embeddings model is loaded"""
+    data = {}
     
-    # Search Arabic data
+    # Rank Arabic articles
     if language in ["ar", "arabic", "both"] and arabic_data:
-        arabic_articles = arabic_data.get('articles', [])
-        for item in arabic_articles:
-            title = item.get('title', '').lower()
-            content = item.get('content', '').lower()
-            
-            if query_lower in title or query_lower in content:
-                # Calculate simple relevance score
-                title_matches = title.count(query_lower)
-                content_matches = content.count(query_lower)
-                score = min(95, (title_matches * 10 + content_matches * 5) * 10)
-                
-                results.append({
-                    "title": item.get('title', ''),
-                    "content": item.get('content', ''),
-                    "score": score,
-                    "source": {
-                        "article": f"المادة {item.get('article_number', '')}",
-                        "section": item.get('section', 'قواعد ITPF'),
-                        "document": "قواعد الاتحاد الدولي لالتقاط الأوتاد"
-                    },
-                    "highlights": [query],
-                    "language": "arabic"
-                })
-                if len(results) >= max_results:
-                    break
+        data["arabic"] = arabic_data
     
-    # Search English data
-    if language in ["en", "english", "both"] and english_data and len(results) < max_results:
-        # Handle both direct articles and chapters/articles structure
-        english_articles = english_data.get('articles', [])
-        
-        # If no direct articles, extract from chapters
-        if not english_articles and 'chapters' in english_data:
-            for chapter in english_data['chapters']:
-                english_articles.extend(chapter.get('articles', []))
+    # Rank English articles (the index handles both direct articles and chapters/articles structure)
+    if language in ["en", "english", "both"] and english_data:
+        data["english"] = english_data
+    
+    ranked = retrieve_sync(query, language, max_results, 'article', fusion=fusion, data=data)
+    
+    # Scores are shown as percentages: the best match gets 95
+    top_score = ranked[0].score if ranked else 0.0
+    
+    results = []
+    for result in ranked:
+        item = result.item
+        if result.language == "arabic":
+            source = {
+                "article": f"المادة {item.get('article_number', '')}",
+                "section": item.get('section', 'قواعد ITPF'),
+                "document": "قواعد الاتحاد الدولي لالتقاط الأوتاد"
+            }
+        else:
+            source = {
+                "article": f"Article {item.get('article_number', '')}",
+                "section": item.get('section', 'ITPF Rules'),
+                "document": "International Tent Pegging Federation Rules"
+            }
         
-        for item in english_articles:
-            title = item.get('title', '').lower()
-            content = item.get('content', '').lower()
-            
-            if query_lower in title or query_lower in content:
-                # Calculate simple relevance score
-                title_matches = title.count(query_lower)
-                content_matches = content.count(query_lower)
-                score = min(95, (title_matches * 10 + content_matches * 5) * 10)
-                
-                results.append({
-                    "title": item.get('title', ''),
-                    "content": item.get('content', ''),
-                    "score": score,
-                    "source": {
-                        "article": f"Article {item.get('article_number', '')}",
-                        "section": item.get('section', 'ITPF Rules'),
-                        "document": "International Tent Pegging Federation Rules"
-                    },
-                    "highlights": [query],
-                    "language": "english"
-                })
-                if len(results) >= max_results:
-                    break
+        results.append({
+            "title": item.get('title', ''),
+            "content": item.get('content', ''),
+            "score": round(95 * result.score / top_score),
+            "source": source,
+            # matched terms are stems: highlight the words of this article they came from
+            "highlights": [word for term in result.matched_terms
+                           for word in get_ranker(data[result.language]).index.surface_forms(term, result.doc)] or [query],
+            "score_breakdown": result.breakdown(),
+            "language": result.language
+        })
     
-    # Sort by score
-    results.sort(key=lambda x: x['score'], reverse=True)
-    return results[:max_results]
+    return results
 
 
 from http.server import BaseHTTPRequestHandler
@@ -160,6 +111,7 @@ class handler(BaseHTTPRequestHandler):
             query = data.get("query", "").strip()
             language = data.get("language", "both")
             max_results = min(data.get("max_results", 10), 50)
+            fusion = data.get("fusion", DEFAULT_FUSION)
             
             if not query:
                 response = {
@@ -179,7 +131,7 @@ class handler(BaseHTTPRequestHandler):
             
             # Load data and perform search
             arabic_data, english_data = load_data()
-            results = simple_search(query, language, max_results, arabic_data, english_data)
+            results = simple_search(query, language, max_results, arabic_data, english_data, fusion)
             
             # Format response
             response = {
@@ -224,7 +176,8 @@ class handler(BaseHTTPRequestHandler):
             "method": "POST",
             "usage": {
                 "query": "search term",
-                "language": "both|arabic|english"
+                "language": "both|arabic|english",
+                "fusion": "rrf|weighted"
             }
         }
         
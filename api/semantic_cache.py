@@ -0,0 +1,225 @@
+"""
+ITPF Legal System - Semantic Answer Cache
+ذاكرة إجابات دلالية: السؤال المعاد صياغته يحصل على الإجابة المحفوظة دون استدعاء DeepSeek
+
+The exact response cache only helps when a question repeats word for word
+(after normalization). Users mostly rephrase: the same penalty scenario in
+other words, or the same question in Arabic and English. This layer embeds
+the incoming question with the embeddings manager's multilingual model and
+compares it with the questions already answered (one matrix-vector product
+over at most max_size normalized rows). The closest earlier question of the
+same mode and corpus stamp is returned when its cosine similarity reaches
+the threshold (ITPF_SEMANTIC_CACHE_THRESHOLD, default 0.92); the similarity
+is reported as the hit's confidence.
+
+Answers are written in the language of the question, so by default only
+questions of the same language match; ITPF_SEMANTIC_CACHE_CROSS_LANGUAGE=1
+also lets an English question reuse an Arabic answer and vice versa.
+
+Similar wording is not enough for a legal answer: "a rider scores 4 points"
+and "a rider scores 6 points" embed almost identically but have different
+answers. Every entry keeps the set of references retrieved for its question (in
+any order, as in the response cache key) and the numbers in the question, and
+a hit needs both to be the same as well.
+
+The layer needs the embeddings model. It is active when the embeddings module
+is already loaded, or when ITPF_SEMANTIC_CACHE=1 (the model is then loaded on
+first use); ITPF_SEMANTIC_CACHE=0 turns it off.
+"""
+
+import os
+import re
+import threading
+import time
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+try:
+    from .hybrid_retrieval import loaded_embeddings_manager
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from hybrid_retrieval import loaded_embeddings_manager
+
+DEFAULT_THRESHOLD = float(os.getenv('ITPF_SEMANTIC_CACHE_THRESHOLD', '0.92'))
+DEFAULT_MAX_SIZE = int(os.getenv('ITPF_SEMANTIC_CACHE_SIZE', '512'))
+DEFAULT_TTL = float(os.getenv('ITPF_SEMANTIC_CACHE_TTL', str(24 * 3600)))
+CROSS_LANGUAGE = os.getenv('ITPF_SEMANTIC_CACHE_CROSS_LANGUAGE', '0') == '1'
+
+NUMBER_PATTERN = re.compile(r'\d+')
+
+
+@dataclass
+class SemanticHit:
+    """إجابة محفوظة لسؤال مشابه مع درجة الثقة (تشابه جيب التمام)"""
+    answer: Any
+    confidence: float
+    matched_question: str
+    language: str
+    age_seconds: float
+
+    def info(self) -> Dict[str, Any]:
+        return {
+            'type': 'semantic',
+            'confidence': round(self.confidence, 4),
+            'matched_question': self.matched_question,
+            'matched_language': self.language,
+            'age_seconds': round(self.age_seconds, 1),
+        }
+
+
+@dataclass
+class _Entry:
+    question: str
+    language: str
+    mode: str
+    stamp: str
+    references: Tuple[str, ...]
+    numbers: Tuple[str, ...]
+    answer: Any
+    created: float
+    expires: float
+
+
+class SemanticAnswerCache:
+    """مصفوفة تمثيلات الأسئلة المُجابة مع إجاباتها (إزالة الأقل استخداماً عند الامتلاء)"""
+
+    def __init__(self, threshold: float = DEFAULT_THRESHOLD, max_size: int = DEFAULT_MAX_SIZE,
+                 ttl: float = DEFAULT_TTL, cross_language: bool = CROSS_LANGUAGE):
+        self.threshold = threshold
+        self.max_size = max_size
+        self.ttl = ttl
+        self.cross_language = cross_language
+        self.vectors: Optional[np.ndarray] = None
+        self.entries: List[Optional[_Entry]] = [None] * max_size
+        self.last_used = np.zeros(max_size)
+        self.hits = 0
+        self.misses = 0
+        self.confidence_total = 0.0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return sum(entry is not None for entry in self.entries)
+
+    @staticmethod
+    def _normalize(embedding: Any) -> np.ndarray:
+        vector = np.asarray(embedding, dtype=np.float32).reshape(-1)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def lookup(self, embedding: Any, question: str, language: str, mode: str, stamp: str,
+               references: Sequence[str]) -> Optional[SemanticHit]:
+        """أقرب سؤال محفوظ فوق عتبة التشابه بالمراجع والأرقام نفسها، أو None"""
+        query = self._normalize(embedding)
+        scenario = (tuple(sorted(references)), question_numbers(question))
+        now = time.time()
+        with self._lock:
+            if self.vectors is None or self.vectors.shape[1] != query.shape[0]:
+                self.misses += 1
+                return None
+            similarities = self.vectors @ query
+            for row in np.argsort(-similarities):
+                similarity = float(similarities[row])
+                if similarity < self.threshold:
+                    break
+                entry = self.entries[row]
+                if entry is None or entry.mode != mode or entry.stamp != stamp:
+                    continue
+                if (entry.references, entry.numbers) != scenario:
+                    continue
+                if entry.expires < now:
+                    self._remove(row)
+                    continue
+                if entry.language != language and not self.cross_language:
+                    continue
+                self.last_used[row] = now
+                self.hits += 1
+                self.confidence_total += similarity
+                return SemanticHit(entry.answer, similarity, entry.question, entry.language, now - entry.created)
+            self.misses += 1
+            return None
+
+    def store(self, embedding: Any, question: str, language: str, mode: str, stamp: str,
+              references: Sequence[str], answer: Any) -> None:
+        """حفظ إجابة سؤال مع تمثيله ومراجعه وأرقامه"""
+        vector = self._normalize(embedding)
+        references = tuple(sorted(references))
+        numbers = question_numbers(question)
+        now = time.time()
+        with self._lock:
+            if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+                self.vectors = np.zeros((self.max_size, vector.shape[0]), dtype=np.float32)
+                self.entries = [None] * self.max_size
+            row = self._same_question(vector, (language, mode, stamp, references, numbers))
+            if row is None:
+                free = [row for row, entry in enumerate(self.entries) if entry is None]
+                row = free[0] if free else int(np.argmin(self.last_used))
+            self.vectors[row] = vector
+            self.entries[row] = _Entry(question, language, mode, stamp, references, numbers, answer,
+                                       now, now + self.ttl)
+            self.last_used[row] = now
+
+    def _same_question(self, vector: np.ndarray, scope: Tuple[Any, ...]) -> Optional[int]:
+        """صف السؤال نفسه إن سبق حفظه (إعادة التوليد القسري تستبدل إجابته بدل تكرارها)"""
+        row = int(np.argmax(self.vectors @ vector))
+        entry = self.entries[row]
+        if (entry is not None and float(self.vectors[row] @ vector) >= 0.999
+                and (entry.language, entry.mode, entry.stamp, entry.references, entry.numbers) == scope):
+            return row
+        return None
+
+    def _remove(self, row: int) -> None:
+        self.entries[row] = None
+        self.vectors[row] = 0.0
+        self.last_used[row] = 0.0
+
+    def clear(self) -> None:
+        with self._lock:
+            self.vectors = None
+            self.entries = [None] * self.max_size
+            self.last_used[:] = 0.0
+            self.hits = self.misses = 0
+            self.confidence_total = 0.0
+
+    def stats(self) -> Dict[str, Any]:
+        lookups = self.hits + self.misses
+        return {
+            'enabled': embedding_manager() is not None,
+            'size': len(self),
+            'max_size': self.max_size,
+            'threshold': self.threshold,
+            'cross_language': self.cross_language,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 4) if lookups else 0.0,
+            'average_hit_confidence': round(self.confidence_total / self.hits, 4) if self.hits else None,
+        }
+
+
+def question_numbers(question: str) -> Tuple[str, ...]:
+    """أرقام السؤال بترتيبها (الأرقام العربية الهندية تُكتب بالأرقام الغربية)"""
+    return tuple(str(int(number)) for number in NUMBER_PATTERN.findall(question))
+
+
+def embedding_manager() -> Optional[Any]:
+    """مدير التمثيل المتجه إن كانت الذاكرة الدلالية مفعلة"""
+    return loaded_embeddings_manager('ITPF_SEMANTIC_CACHE')
+
+
+def question_embedding(question: str, language: str) -> Optional[np.ndarray]:
+    """تمثيل السؤال بنموذج مدير التمثيل المتجه، أو None إذا كانت الذاكرة الدلالية غير متاحة"""
+    manager = embedding_manager()
+    if manager is None:
+        return None
+    forced = os.getenv('ITPF_SEMANTIC_CACHE', 'auto').strip().lower() in ('1', 'true', 'on')
+    try:
+        return manager.encode_query(question, language, load_model=forced)
+    except Exception as e:
+        print(f"Semantic cache embedding failed: {e}")
+        return None
+
+
+# المثيل المشترك لجميع نقاط النهاية في العملية
+semantic_cache = SemanticAnswerCache()
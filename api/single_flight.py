@@ -0,0 +1,110 @@
+"""
+ITPF Legal System - Single-Flight Request Coalescing
+دمج الطلبات المتطابقة الجارية: سؤال واحد يطرحه عدة حكام في اللحظة نفسها يكلف طلب DeepSeek واحداً
+
+The response cache only helps once an answer exists. During a competition
+many judges ask the same question within seconds, and every one of them used
+to miss the cache and send its own DeepSeek request. SingleFlight.do(key, fn)
+runs fn once per key at a time: the first caller (the leader) makes the call
+and the callers that arrive while it runs (followers) wait for its result, or
+its exception, instead of making their own.
+
+A follower waits at most its own timeout; when that runs out it gets None,
+which the callers already treat as a failed upstream call. Streamed answers
+use join()/finish() directly: the leader streams to its own client and the
+followers get its full text when the stream completes.
+"""
+
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class _Flight:
+    """طلب جارٍ واحد والمنتظرون لنتيجته"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result: Any = None
+        self.error: Optional[BaseException] = None
+        self.followers = 0
+
+
+class SingleFlight:
+    """تنفيذ واحد لكل مفتاح في الوقت نفسه، ونتيجته لكل الطالبين"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.flights: Dict[str, _Flight] = {}
+        self.leaders = 0
+        self.coalesced = 0
+        self.follower_timeouts = 0
+        self.max_followers = 0
+        self._lock = threading.Lock()
+
+    def join(self, key: str) -> Tuple[_Flight, bool]:
+        """الانضمام إلى الطلب الجاري للمفتاح أو بدؤه: (الطلب، هل المنضم هو القائد)
+
+        The leader must call finish() exactly once; a follower calls wait().
+        do() wraps both for a plain call; a streamed answer holds the flight
+        while it yields and finishes it with the full text.
+        """
+        with self._lock:
+            flight = self.flights.get(key)
+            if flight is None:
+                flight = self.flights[key] = _Flight()
+                self.leaders += 1
+                return flight, True
+            flight.followers += 1
+            self.coalesced += 1
+            self.max_followers = max(self.max_followers, flight.followers)
+            return flight, False
+
+    def wait(self, flight: _Flight, timeout: Optional[float] = None) -> Any:
+        """نتيجة القائد (أو استثناؤه)، أو None إذا انتهت مهلة المنتظر"""
+        if not flight.done.wait(timeout):
+            with self._lock:
+                self.follower_timeouts += 1
+            return None
+        if flight.error is not None:
+            raise flight.error
+        return flight.result
+
+    def finish(self, key: str, flight: _Flight, result: Any = None, error: Optional[BaseException] = None) -> None:
+        """إنهاء طلب القائد وإيقاظ المنتظرين"""
+        flight.result = result
+        flight.error = error
+        with self._lock:
+            if self.flights.get(key) is flight:
+                del self.flights[key]
+        flight.done.set()
+
+    def do(self, key: str, fn: Callable[[], Any], timeout: Optional[float] = None) -> Tuple[Any, bool]:
+        """نتيجة fn() للمفتاح: (النتيجة، هل كانت مشتركة مع طلب جارٍ)"""
+        flight, leader = self.join(key)
+        if not leader:
+            return self.wait(flight, timeout), True
+
+        try:
+            result = fn()
+        except BaseException as e:
+            self.finish(key, flight, error=e)
+            raise
+        self.finish(key, flight, result)
+        return result, False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            calls = self.leaders + self.coalesced
+            return {
+                'name': self.name,
+                'in_flight': len(self.flights),
+                'upstream_calls': self.leaders,
+                'coalesced': self.coalesced,
+                'coalesce_rate': round(self.coalesced / calls, 4) if calls else 0.0,
+                'max_followers': self.max_followers,
+                'follower_timeouts': self.follower_timeouts,
+            }
+
+
+# طلبات DeepSeek المشتركة بين نقاط النهاية في العملية
+deepseek_flights = SingleFlight('deepseek')
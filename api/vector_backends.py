@@ -0,0 +1,390 @@
+"""
+ITPF Legal Search - Pluggable Vector Backends
+واجهة موحدة لمخازن المتجهات: Pinecone، بحث numpy دقيق، ورسم HNSW محلي تقريبي
+
+Backend choice: VECTOR_BACKEND=pinecone|numpy|hnsw. Without it Pinecone is
+used when PINECONE_API_KEY is set and the exact numpy store otherwise, which
+is what LegalEmbeddingsManager did before. Every backend is fed from the
+local vector index (LocalVectorIndex + IndexDelta) through sync_index(), and
+returns Pinecone-shaped results (chunk fields, "id", "score", "rank").
+
+The HNSW store keeps its graph in legal_hnsw_<lang>.npz next to the vector
+matrix; the graph carries the index version and is rebuilt when the matrix
+changed. Search is greedy descent through the upper layers and a beam search
+(ef_search) on layer 0, all on normalized float32 rows, so no network round
+trip is needed when self-hosting.
+"""
+
+import heapq
+import logging
+import math
+import os
+import random
+from typing import Any, Dict, List, Optional, Protocol, Tuple
+
+import numpy as np
+
+try:
+    from .local_vector_index import API_DIR, IndexDelta, LocalVectorIndex, normalize_rows
+except ImportError:
+    import sys
+    sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+    from local_vector_index import API_DIR, IndexDelta, LocalVectorIndex, normalize_rows
+
+logger = logging.getLogger(__name__)
+
+VECTOR_BACKENDS = ('pinecone', 'numpy', 'hnsw')
+
+HNSW_M = int(os.getenv('HNSW_M', '16'))
+HNSW_EF_CONSTRUCTION = int(os.getenv('HNSW_EF_CONSTRUCTION', '100'))
+HNSW_EF_SEARCH = int(os.getenv('HNSW_EF_SEARCH', '64'))
+HNSW_FORMAT_VERSION = 1
+
+
+def language_code(language: str) -> str:
+    """توحيد رمز اللغة إلى ar أو en"""
+    return 'ar' if language in ('ar', 'arabic') else 'en'
+
+
+class VectorStore(Protocol):
+    """الواجهة المشتركة لمخازن المتجهات"""
+
+    name: str
+
+    async def sync_index(self, index: LocalVectorIndex, delta: Optional[IndexDelta] = None,
+                         full: bool = False) -> Any:
+        """مزامنة المخزن مع فهرس اللغة المحلي (المتغيرات فقط ما لم يُطلب full)"""
+        ...
+
+    async def semantic_search(self, query_embedding: np.ndarray, language: str, top_k: int = 5,
+                              filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        """أقرب المقاطع مع score و rank"""
+        ...
+
+    async def get_index_stats(self) -> Dict[str, Any]:
+        ...
+
+
+def _matches_filters(chunk: Dict[str, Any], filters: Optional[Dict[str, Any]]) -> bool:
+    """مطابقة مرشحات المساواة (نفس استخدام مرشحات Pinecone في المشروع)"""
+    if not filters:
+        return True
+    return all(chunk.get(key) == value for key, value in filters.items() if key != 'language')
+
+
+def _format_results(index: LocalVectorIndex, hits: List[Tuple[int, float]]) -> List[Dict[str, Any]]:
+    """نتائج بنفس شكل نتائج Pinecone"""
+    results = []
+    for row, score in hits:
+        result = dict(index.chunks[row])
+        result['id'] = index.ids[row]
+        result['score'] = float(score)
+        result['rank'] = len(results) + 1
+        results.append(result)
+    return results
+
+
+def exact_search(index: LocalVectorIndex, query_embedding: np.ndarray, top_k: int,
+                 filters: Optional[Dict[str, Any]] = None) -> List[Dict[str, Any]]:
+    """بحث دقيق على كل الصفوف (أو الصفوف المطابقة للمرشحات فقط)"""
+    if not filters:
+        return _format_results(index, index.search(query_embedding, top_k))
+
+    rows = np.array([row for row, chunk in enumerate(index.chunks) if _matches_filters(chunk, filters)], dtype=np.int64)
+    if not len(rows):
+        return []
+    similarities = index.embeddings[rows] @ normalize_rows(query_embedding)[0]
+    order = np.argsort(-similarities, kind='stable')[:top_k]
+    return _format_results(index, [(int(rows[i]), float(similarities[i])) for i in order])
+
+
+class NumpyVectorStore:
+    """بحث دقيق بضرب المصفوفة في المتجه وargpartition"""
+
+    name = 'numpy'
+
+    def __init__(self):
+        self.indexes: Dict[str, LocalVectorIndex] = {}
+
+    async def sync_index(self, index: LocalVectorIndex, delta: Optional[IndexDelta] = None,
+                         full: bool = False) -> Any:
+        self.indexes[index.language] = index
+        return None
+
+    async def semantic_search(self, query_embedding: np.ndarray, language: str, top_k: int = 5,
+                              filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        index = self.indexes.get(language_code(language))
+        if index is None:
+            return []
+        return exact_search(index, query_embedding, top_k, filters)
+
+    async def get_index_stats(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.indexes else "empty",
+            "backend": self.name,
+            "languages": {language: index.stats() for language, index in self.indexes.items()},
+        }
+
+
+class HNSWGraph:
+    """رسم HNSW (Hierarchical Navigable Small World) على متجهات مطبعة"""
+
+    def __init__(self, vectors: np.ndarray, m: int = HNSW_M, ef_construction: int = HNSW_EF_CONSTRUCTION,
+                 seed: int = 0):
+        self.vectors = vectors
+        self.m = m
+        self.max_neighbors = {0: 2 * m}
+        self.ef_construction = ef_construction
+        self.level_multiplier = 1.0 / math.log(max(m, 2))
+        self.layers: List[Dict[int, List[int]]] = []
+        self.levels: List[int] = []
+        self.entry_point = -1
+        self._random = random.Random(seed)
+
+    def build(self) -> 'HNSWGraph':
+        for node in range(self.vectors.shape[0]):
+            self._insert(node)
+        return self
+
+    def _similarities(self, nodes: List[int], query: np.ndarray) -> np.ndarray:
+        return self.vectors[nodes] @ query
+
+    def _search_layer(self, query: np.ndarray, entry_points: List[int], ef: int, level: int) -> List[Tuple[float, int]]:
+        """بحث شعاعي في طبقة واحدة، يرجع (التشابه، العقدة) مرتبة تنازلياً"""
+        layer = self.layers[level]
+        visited = set(entry_points)
+        entry_scores = self._similarities(entry_points, query)
+        candidates = [(-float(score), node) for score, node in zip(entry_scores, entry_points)]
+        heapq.heapify(candidates)
+        results = [(float(score), node) for score, node in zip(entry_scores, entry_points)]
+        heapq.heapify(results)
+        while len(results) > ef:
+            heapq.heappop(results)
+
+        while candidates:
+            negative_score, node = heapq.heappop(candidates)
+            if len(results) >= ef and -negative_score < results[0][0]:
+                break
+            neighbors = [neighbor for neighbor in layer.get(node, ()) if neighbor not in visited]
+            if not neighbors:
+                continue
+            visited.update(neighbors)
+            for score, neighbor in zip(self._similarities(neighbors, query).tolist(), neighbors):
+                if len(results) < ef or score > results[0][0]:
+                    heapq.heappush(candidates, (-score, neighbor))
+                    heapq.heappush(results, (score, neighbor))
+                    if len(results) > ef:
+                        heapq.heappop(results)
+        return sorted(results, reverse=True)
+
+    def _select_neighbors(self, base: np.ndarray, candidates: List[int], limit: int) -> List[int]:
+        """اختيار الجيران بالطريقة التجريبية لـ HNSW
+
+        A candidate is kept only when it is closer to the base vector than to
+        every neighbour already kept, which keeps links towards other clusters
+        instead of only the nearest (same-cluster) vectors; the rest fill the
+        remaining slots in similarity order.
+        """
+        if len(candidates) <= limit:
+            return list(candidates)
+        scores = self._similarities(candidates, base)
+        order = np.argsort(-scores, kind='stable')
+        selected: List[int] = []
+        pruned: List[int] = []
+        for i in order:
+            candidate = candidates[i]
+            if selected and np.max(self.vectors[selected] @ self.vectors[candidate]) > scores[i]:
+                pruned.append(candidate)
+                continue
+            selected.append(candidate)
+            if len(selected) >= limit:
+                return selected
+        return selected + pruned[:limit - len(selected)]
+
+    def _shrink(self, node: int, level: int) -> None:
+        """إبقاء أفضل الجيران فقط عند تجاوز الحد"""
+        neighbors = self.layers[level][node]
+        limit = self.max_neighbors.get(level, self.m)
+        if len(neighbors) > limit:
+            self.layers[level][node] = self._select_neighbors(self.vectors[node], neighbors, limit)
+
+    def _insert(self, node: int) -> None:
+        level = int(-math.log(1.0 - self._random.random()) * self.level_multiplier)
+        self.levels.append(level)
+        while len(self.layers) <= level:
+            self.layers.append({})
+        for layer_level in range(level + 1):
+            self.layers[layer_level][node] = []
+
+        if self.entry_point < 0:
+            self.entry_point = node
+            return
+
+        query = self.vectors[node]
+        top_level = self.levels[self.entry_point]
+        entry_points = [self.entry_point]
+        # greedy descent through the layers above the new node
+        for layer_level in range(top_level, level, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer_level)[0][1]]
+
+        for layer_level in range(min(level, top_level), -1, -1):
+            found = self._search_layer(query, entry_points, self.ef_construction, layer_level)
+            neighbors = self._select_neighbors(query, [neighbor for _, neighbor in found], self.m)
+            self.layers[layer_level][node] = list(neighbors)
+            for neighbor in neighbors:
+                self.layers[layer_level][neighbor].append(node)
+                self._shrink(neighbor, layer_level)
+            entry_points = [neighbor for _, neighbor in found]
+
+        if level > top_level:
+            self.entry_point = node
+
+    def search(self, query: np.ndarray, top_k: int, ef: int = HNSW_EF_SEARCH) -> List[Tuple[int, float]]:
+        """أقرب k عقد (العقدة، التشابه)"""
+        if self.entry_point < 0:
+            return []
+        entry_points = [self.entry_point]
+        for layer_level in range(self.levels[self.entry_point], 0, -1):
+            entry_points = [self._search_layer(query, entry_points, 1, layer_level)[0][1]]
+        found = self._search_layer(query, entry_points, max(ef, top_k), 0)
+        return [(node, score) for score, node in found[:top_k]]
+
+    def to_arrays(self) -> Dict[str, np.ndarray]:
+        """تمثيل الرسم كمصفوفات (CSR لكل طبقة) للحفظ"""
+        arrays = {
+            'levels': np.array(self.levels, dtype=np.int32),
+            'params': np.array([self.m, self.ef_construction, self.entry_point], dtype=np.int64),
+        }
+        for level, layer in enumerate(self.layers):
+            nodes = sorted(layer)
+            offsets = np.zeros(len(nodes) + 1, dtype=np.int64)
+            offsets[1:] = np.cumsum([len(layer[node]) for node in nodes])
+            arrays[f'nodes_{level}'] = np.array(nodes, dtype=np.int32)
+            arrays[f'offsets_{level}'] = offsets
+            arrays[f'neighbors_{level}'] = np.array([n for node in nodes for n in layer[node]], dtype=np.int32)
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, vectors: np.ndarray, arrays: Any) -> 'HNSWGraph':
+        m, ef_construction, entry_point = (int(value) for value in arrays['params'])
+        graph = cls(vectors, m, ef_construction)
+        graph.levels = arrays['levels'].tolist()
+        graph.entry_point = entry_point
+        level = 0
+        while f'nodes_{level}' in arrays:
+            nodes = arrays[f'nodes_{level}'].tolist()
+            offsets = arrays[f'offsets_{level}'].tolist()
+            neighbors = arrays[f'neighbors_{level}'].tolist()
+            graph.layers.append({node: neighbors[offsets[i]:offsets[i + 1]] for i, node in enumerate(nodes)})
+            level += 1
+        return graph
+
+
+def hnsw_path(language: str, directory: Optional[str] = None) -> str:
+    """مسار ملف رسم HNSW للغة"""
+    return os.path.join(directory or API_DIR, f'legal_hnsw_{language}.npz')
+
+
+def save_hnsw(graph: HNSWGraph, index: LocalVectorIndex, directory: Optional[str] = None) -> str:
+    """حفظ الرسم مع نسخة الفهرس الذي بُني منه"""
+    path = hnsw_path(index.language, directory)
+    temp_path = path + '.tmp.npz'
+    np.savez(temp_path, format_version=np.array(HNSW_FORMAT_VERSION), version=np.array(index.version),
+             **graph.to_arrays())
+    os.replace(temp_path, path)
+    return path
+
+
+def load_hnsw(index: LocalVectorIndex, directory: Optional[str] = None) -> Optional[HNSWGraph]:
+    """تحميل الرسم المحفوظ إن كان مبنياً من نفس نسخة الفهرس"""
+    path = hnsw_path(index.language, directory)
+    if not os.path.exists(path):
+        return None
+    try:
+        with np.load(path) as arrays:
+            if int(arrays['format_version']) != HNSW_FORMAT_VERSION or str(arrays['version']) != index.version:
+                return None
+            graph = HNSWGraph.from_arrays(index.embeddings, arrays)
+        if len(graph.levels) != len(index):
+            return None
+        return graph
+    except (OSError, ValueError, KeyError) as e:
+        logger.warning(f"Could not load HNSW graph for {index.language}: {e}")
+        return None
+
+
+class HNSWVectorStore:
+    """بحث تقريبي محلي عبر رسم HNSW مبني من فهرس المتجهات"""
+
+    name = 'hnsw'
+
+    def __init__(self, ef_search: int = HNSW_EF_SEARCH, directory: Optional[str] = None):
+        self.ef_search = ef_search
+        self.directory = directory
+        self.indexes: Dict[str, LocalVectorIndex] = {}
+        self.graphs: Dict[str, HNSWGraph] = {}
+
+    async def sync_index(self, index: LocalVectorIndex, delta: Optional[IndexDelta] = None,
+                         full: bool = False) -> Any:
+        graph = None if full else load_hnsw(index, self.directory)
+        if graph is None:
+            logger.info(f"Building HNSW graph for {index.language} ({len(index)} vectors)")
+            graph = HNSWGraph(index.embeddings).build()
+            try:
+                save_hnsw(graph, index, self.directory)
+            except OSError as e:
+                logger.warning(f"Could not save HNSW graph for {index.language}: {e}")
+        self.indexes[index.language] = index
+        self.graphs[index.language] = graph
+        return None
+
+    async def semantic_search(self, query_embedding: np.ndarray, language: str, top_k: int = 5,
+                              filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
+        language = language_code(language)
+        index, graph = self.indexes.get(language), self.graphs.get(language)
+        if index is None or graph is None:
+            return []
+        query = normalize_rows(query_embedding)[0]
+        if not filters:
+            return _format_results(index, graph.search(query, top_k, self.ef_search))
+
+        # filtered queries widen the beam, then fall back to the exact scan if too few survive
+        hits = [(row, score) for row, score in graph.search(query, top_k * 4, self.ef_search * 4)
+                if _matches_filters(index.chunks[row], filters)]
+        if len(hits) < top_k:
+            return exact_search(index, query_embedding, top_k, filters)
+        return _format_results(index, hits[:top_k])
+
+    async def get_index_stats(self) -> Dict[str, Any]:
+        return {
+            "status": "ready" if self.graphs else "empty",
+            "backend": self.name,
+            "ef_search": self.ef_search,
+            "languages": {
+                language: dict(index.stats(), layers=len(self.graphs[language].layers))
+                for language, index in self.indexes.items() if language in self.graphs
+            },
+        }
+
+
+def configured_backend() -> str:
+    """الخلفية المختارة من VECTOR_BACKEND أو الافتراضية"""
+    backend = os.getenv('VECTOR_BACKEND', '').strip().lower()
+    if backend in VECTOR_BACKENDS:
+        return backend
+    if backend:
+        logger.warning(f"Unknown VECTOR_BACKEND '{backend}', expected one of {VECTOR_BACKENDS}")
+    return 'pinecone' if os.getenv('PINECONE_API_KEY') else 'numpy'
+
+
+def create_vector_store(backend: str) -> VectorStore:
+    """إنشاء مخزن المتجهات (Pinecone يُستورد عند الطلب فقط)"""
+    if backend == 'pinecone':
+        try:
+            from .vector_store import pinecone_store
+        except ImportError:
+            from vector_store import pinecone_store
+        return pinecone_store
+    if backend == 'hnsw':
+        return HNSWVectorStore()
+    return NumpyVectorStore()
@@ -6,17 +6,89 @@ ITPF Legal Search - Pinecone Vector Storage System
 import os
 import asyncio
 import logging
+import random
 import time
-from typing import List, Dict, Any, Optional, Tuple
+from dataclasses import dataclass, field
+from itertools import islice
+from typing import List, Dict, Any, Iterator, Optional, Tuple
 import numpy as np
 from pinecone import Pinecone, ServerlessSpec
 import json
 
 logger = logging.getLogger(__name__)
 
+# إعدادات خط رفع المتجهات
+UPSERT_BATCH_SIZE = int(os.getenv('PINECONE_UPSERT_BATCH_SIZE', '100'))
+UPSERT_CONCURRENCY = int(os.getenv('PINECONE_UPSERT_CONCURRENCY', '4'))
+UPSERT_MAX_RETRIES = int(os.getenv('PINECONE_UPSERT_MAX_RETRIES', '3'))
+UPSERT_RATE_PER_SECOND = float(os.getenv('PINECONE_UPSERT_RATE', '10'))
+UPSERT_BACKOFF_SECONDS = 0.5
+
+
+@dataclass
+class FailedBatch:
+    """دفعة فشل رفعها بعد كل المحاولات"""
+    batch_number: int
+    vector_ids: List[str]
+    error: str
+    attempts: int
+
+
+@dataclass
+class UpsertReport:
+    """نتيجة الرفع: عدد المتجهات المرفوعة والدفعات الفاشلة"""
+    language: str = ''
+    total: int = 0
+    upserted: int = 0
+    failed_batches: List[FailedBatch] = field(default_factory=list)
+    error: Optional[str] = None
+    
+    @property
+    def ok(self) -> bool:
+        return self.error is None and not self.failed_batches
+    
+    @property
+    def failed_ids(self) -> List[str]:
+        return [vector_id for failure in self.failed_batches for vector_id in failure.vector_ids]
+    
+    def __bool__(self) -> bool:
+        # keeps `if await store_embeddings(...)` meaning "everything was stored"
+        return self.ok
+    
+    def stats(self) -> Dict[str, Any]:
+        return {
+            'ok': self.ok,
+            'total': self.total,
+            'upserted': self.upserted,
+            'failed_batches': [failure.batch_number for failure in self.failed_batches],
+            'failed_ids': self.failed_ids,
+            'error': self.error,
+        }
+
+
+class RateLimiter:
+    """تحديد معدل بدء الدفعات (فاصل زمني ثابت بين الطلبات)"""
+    
+    def __init__(self, rate_per_second: float):
+        self.interval = 1.0 / rate_per_second if rate_per_second > 0 else 0.0
+        self._next_start = 0.0
+        self._lock = asyncio.Lock()
+    
+    async def acquire(self):
+        if not self.interval:
+            return
+        async with self._lock:
+            now = time.monotonic()
+            wait = self._next_start - now
+            self._next_start = max(now, self._next_start) + self.interval
+        if wait > 0:
+            await asyncio.sleep(wait)
+
 class PineconeLegalVectorStore:
     """مخزن المتجهات القانونية باستخدام Pinecone"""
     
+    name = 'pinecone'
+    
     def __init__(self):
         self.pc = None
         self.index = None
@@ -86,82 +158,157 @@ class PineconeLegalVectorStore:
             logger.error(f"Index setup error: {e}")
             raise
     
-    async def store_embeddings(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, language: str):
-        """تخزين المتجهات في Pinecone"""
-        try:
-            if not self.index:
-                logger.error("Pinecone index not initialized")
-                return False
-                
-            vectors_to_upsert = []
-            
-            for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
-                # Create unique vector ID
-                vector_id = f"{language}_{chunk['chunk_id']}_{i}"
-                
-                # Prepare metadata (Pinecone has metadata size limits)
-                metadata = {
-                    "language": language,
-                    "type": chunk.get('type', 'unknown'),
-                    "chunk_id": chunk['chunk_id'],
-                    "title": chunk.get('title', '')[:500],  # Truncate to avoid size limits
-                    "source": chunk.get('metadata', {}).get('source', 'unknown'),
-                    "content_length": len(chunk.get('content', '')),
-                    "created_at": int(time.time())
-                }
-                
-                # Add type-specific metadata
-                if chunk.get('type') == 'article':
-                    metadata["article_number"] = chunk.get('article_number')
-                    metadata["section"] = chunk.get('section', '')[:200]
-                elif chunk.get('type') == 'appendix':
-                    metadata["appendix_number"] = chunk.get('appendix_number')
-                elif chunk.get('type') == 'appendix_section':
-                    metadata["appendix_number"] = chunk.get('appendix_number')
-                    metadata["section_name"] = chunk.get('section_name', '')[:200]
-                
-                # Store truncated content in metadata (Pinecone limit ~40KB per vector)
-                content = chunk.get('content', '')
-                if len(content) > 1000:  # Reasonable limit for metadata
-                    metadata["content_preview"] = content[:1000] + "..."
-                    metadata["content_truncated"] = True
-                else:
-                    metadata["content_preview"] = content
-                    metadata["content_truncated"] = False
-                
-                vector_item = {
-                    "id": vector_id,
-                    "values": embedding.tolist(),
-                    "metadata": metadata
-                }
-                
-                vectors_to_upsert.append(vector_item)
+    def _vector_items(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, language: str,
+                      vector_ids: Optional[List[str]] = None) -> Iterator[Dict[str, Any]]:
+        """توليد عناصر المتجهات واحداً تلو الآخر بدلاً من بنائها كلها في الذاكرة"""
+        created_at = int(time.time())
+        for i, (chunk, embedding) in enumerate(zip(chunks, embeddings)):
+            # Create unique vector ID (stable ids from the local index when given)
+            vector_id = vector_ids[i] if vector_ids else f"{language}_{chunk['chunk_id']}_{i}"
             
-            # Upsert vectors in batches (Pinecone recommends batch size of 100-1000)
-            batch_size = 100
-            total_vectors = len(vectors_to_upsert)
-            
-            logger.info(f"Upserting {total_vectors} vectors to Pinecone in batches of {batch_size}")
+            # Prepare metadata (Pinecone has metadata size limits)
+            metadata = {
+                "language": language,
+                "type": chunk.get('type', 'unknown'),
+                "chunk_id": chunk['chunk_id'],
+                "title": chunk.get('title', '')[:500],  # Truncate to avoid size limits
+                "source": chunk.get('metadata', {}).get('source', 'unknown'),
+                "content_length": len(chunk.get('content', '')),
+                "created_at": created_at
+            }
             
-            for i in range(0, total_vectors, batch_size):
-                batch = vectors_to_upsert[i:i + batch_size]
-                
-                try:
-                    upsert_response = self.index.upsert(vectors=batch)
-                    logger.info(f"Batch {i//batch_size + 1}: Upserted {upsert_response['upserted_count']} vectors")
-                except Exception as e:
-                    logger.error(f"Batch upsert error: {e}")
-                    # Continue with other batches
-                
-                # Small delay between batches to avoid rate limits
-                await asyncio.sleep(0.1)
+            # Add type-specific metadata
+            if chunk.get('type') == 'article':
+                metadata["article_number"] = chunk.get('article_number')
+                metadata["section"] = chunk.get('section', '')[:200]
+            elif chunk.get('type') == 'appendix':
+                metadata["appendix_number"] = chunk.get('appendix_number')
+            elif chunk.get('type') == 'appendix_section':
+                metadata["appendix_number"] = chunk.get('appendix_number')
+                metadata["section_name"] = chunk.get('section_name', '')[:200]
             
-            logger.info(f"Successfully stored {total_vectors} {language} vectors in Pinecone")
-            return True
+            # Store truncated content in metadata (Pinecone limit ~40KB per vector)
+            content = chunk.get('content', '')
+            if len(content) > 1000:  # Reasonable limit for metadata
+                metadata["content_preview"] = content[:1000] + "..."
+                metadata["content_truncated"] = True
+            else:
+                metadata["content_preview"] = content
+                metadata["content_truncated"] = False
             
+            yield {
+                "id": vector_id,
+                "values": np.asarray(embedding, dtype=np.float32).tolist(),
+                "metadata": metadata
+            }
+    
+    async def _upsert_batch(self, batch_number: int, batch: List[Dict[str, Any]], limiter: "RateLimiter",
+                            max_retries: int) -> Optional[FailedBatch]:
+        """رفع دفعة واحدة مع إعادة المحاولة والتراجع الأسي، وإرجاع الفشل بدلاً من إسقاطه"""
+        last_error = None
+        for attempt in range(max_retries + 1):
+            await limiter.acquire()
+            try:
+                # the Pinecone client is blocking: keep it off the event loop
+                response = await asyncio.to_thread(self.index.upsert, vectors=batch)
+                logger.info(f"Batch {batch_number}: Upserted {response['upserted_count']} vectors")
+                return None
+            except Exception as e:
+                last_error = e
+                if attempt < max_retries:
+                    delay = UPSERT_BACKOFF_SECONDS * (2 ** attempt) * (1 + random.random())
+                    logger.warning(f"Batch {batch_number} upsert failed ({e}), retry {attempt + 1}/{max_retries} in {delay:.2f}s")
+                    await asyncio.sleep(delay)
+        
+        logger.error(f"Batch {batch_number} upsert failed after {max_retries + 1} attempts: {last_error}")
+        return FailedBatch(batch_number, [vector["id"] for vector in batch], str(last_error), max_retries + 1)
+    
+    async def store_embeddings(self, chunks: List[Dict[str, Any]], embeddings: np.ndarray, language: str,
+                               vector_ids: Optional[List[str]] = None, batch_size: int = UPSERT_BATCH_SIZE,
+                               concurrency: int = UPSERT_CONCURRENCY, max_retries: int = UPSERT_MAX_RETRIES,
+                               rate_per_second: float = UPSERT_RATE_PER_SECOND) -> UpsertReport:
+        """تخزين المتجهات في Pinecone (vector_ids: معرفات ثابتة تجعل الرفع استبدالاً للمقطع نفسه)
+        
+        Batches are produced lazily and at most `concurrency` of them are in
+        flight; batch starts are spaced to `rate_per_second`. The report lists
+        every batch that still failed after its retries.
+        """
+        report = UpsertReport(language=language)
+        if not self.index:
+            logger.error("Pinecone index not initialized")
+            report.error = "Pinecone index not initialized"
+            return report
+        
+        limiter = RateLimiter(rate_per_second)
+        slots = asyncio.Semaphore(concurrency)
+        pending = set()
+        
+        async def run(batch_number: int, batch: List[Dict[str, Any]]):
+            try:
+                failure = await self._upsert_batch(batch_number, batch, limiter, max_retries)
+                if failure:
+                    report.failed_batches.append(failure)
+                else:
+                    report.upserted += len(batch)
+            finally:
+                slots.release()
+        
+        logger.info(f"Upserting {language} vectors to Pinecone in batches of {batch_size} ({concurrency} concurrent)")
+        
+        # Upsert vectors in batches (Pinecone recommends batch size of 100-1000)
+        items = self._vector_items(chunks, embeddings, language, vector_ids)
+        batch_number = 0
+        try:
+            while True:
+                # wait for a free slot before materializing the next batch
+                await slots.acquire()
+                batch = list(islice(items, batch_size))
+                if not batch:
+                    slots.release()
+                    break
+                batch_number += 1
+                report.total += len(batch)
+                task = asyncio.ensure_future(run(batch_number, batch))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
         except Exception as e:
+            slots.release()
             logger.error(f"Embedding storage error: {e}")
-            return False
+            report.error = str(e)
+        
+        if pending:
+            await asyncio.gather(*pending)
+        report.failed_batches.sort(key=lambda failure: failure.batch_number)
+        
+        if report.ok:
+            logger.info(f"Successfully stored {report.total} {language} vectors in Pinecone")
+        else:
+            logger.error(f"Stored {report.upserted}/{report.total} {language} vectors, "
+                         f"{len(report.failed_batches)} batches failed")
+        return report
+    
+    async def sync_index(self, index, delta=None, full: bool = False) -> Optional[UpsertReport]:
+        """رفع المتجهات الجديدة أو المتغيرة فقط من الفهرس المحلي وحذف المتجهات المحذوفة"""
+        rows = list(range(len(index))) if full or delta is None else delta.upserted
+        
+        if full or delta is None or delta.rebuilt:
+            # vectors stored under ids this index does not know would show up as duplicate hits
+            logger.info(f"Clearing {index.language} vectors from Pinecone before a full upsert...")
+            await self.delete_all_vectors(index.language)
+        
+        report = None
+        if rows:
+            logger.info(f"Upserting {len(rows)} changed {index.language} vectors to Pinecone...")
+            report = await self.store_embeddings(
+                [index.chunks[row] for row in rows], index.embeddings[rows], index.language,
+                vector_ids=[index.ids[row] for row in rows]
+            )
+            if not report.ok:
+                logger.error(f"{index.language}: {len(report.failed_ids)} vectors were not stored in Pinecone: {report.failed_ids}")
+        if delta is not None and delta.deleted:
+            logger.info(f"Deleting {len(delta.deleted)} removed {index.language} vectors from Pinecone...")
+            await self.delete_vectors(delta.deleted)
+        return report
     
     async def semantic_search(self, query_embedding: np.ndarray, language: str, top_k: int = 5, filters: Dict[str, Any] = None) -> List[Dict[str, Any]]:
         """البحث الدلالي في Pinecone"""
@@ -291,6 +438,25 @@ class PineconeLegalVectorStore:
             logger.error(f"Hybrid search error: {e}")
             return []
     
+    async def delete_vectors(self, vector_ids: List[str]):
+        """حذف متجهات محددة بالمعرف (المقاطع التي لم تعد موجودة)"""
+        try:
+            if not self.index:
+                logger.error("Pinecone index not initialized")
+                return False
+            
+            # Pinecone accepts up to 1000 ids per delete call
+            batch_size = 1000
+            for i in range(0, len(vector_ids), batch_size):
+                self.index.delete(ids=vector_ids[i:i + batch_size])
+            
+            logger.info(f"Deleted {len(vector_ids)} vectors from Pinecone")
+            return True
+            
+        except Exception as e:
+            logger.error(f"Vector deletion error: {e}")
+            return False
+    
     async def delete_all_vectors(self, language: str = None):
         """حذف جميع المتجهات (للتجديد)"""
         try:
@@ -17,6 +17,7 @@ class ITTPFLegalSearch {
         this.cacheVersion = '12.1'; // Phase 3: Complete Appendices Integration + Enhanced Search
         this.searchCache = new Map();
         this.answerCache = new Map();
+        this.pendingJobId = null;
         
         // DOM Elements
         this.elements = {
@@ -279,6 +280,7 @@ class ITTPFLegalSearch {
         const cacheKey = `${query}-${this.currentLanguage}-${this.currentMode}-${this.cacheVersion}`;
         if (cache.has(cacheKey)) {
             console.log('📋 Using cached results');
+            this.pendingJobId = null;
             if (this.currentMode === 'search') {
                 this.displayResults(cache.get(cacheKey));
             } else {
@@ -295,12 +297,33 @@ class ITTPFLegalSearch {
      * @param {string} query - Search query
      */
     async performSearch(query) {
+        this.pendingJobId = null;
         this.setSearchingState(true);
         this.showLoadingState();
         
         try {
+            const apiBase = 'https://itpf-legal-search-c06wc8tdx-mohammadqaaqahs-projects.vercel.app';
+            
+            // Stream answers so the analysis appears while DeepSeek is still generating
+            if (this.currentMode === 'answer' && window.ReadableStream && window.TextDecoder) {
+                const streamed = await this.performStreamingAnswer(query, apiBase);
+                if (streamed) {
+                    // An interrupted or failed stream is shown but not cached
+                    if (streamed.success && streamed.completed) {
+                        this.cacheResult(query, streamed);
+                    }
+                    return;
+                }
+            }
+            
+            // Without streaming: show the local answer at once and upgrade it when DeepSeek is done
+            if (this.currentMode === 'answer') {
+                await this.performSpeculativeAnswer(query, apiBase);
+                return;
+            }
+            
             const endpoint = this.currentMode === 'search' ? '/api/search' : '/api/answer';
-            const apiUrl = `https://itpf-legal-search-c06wc8tdx-mohammadqaaqahs-projects.vercel.app${endpoint}`;
+            const apiUrl = `${apiBase}${endpoint}`;
             
             const requestBody = this.currentMode === 'search' 
                 ? { query: query, language: this.currentLanguage }
@@ -324,16 +347,7 @@ class ITTPFLegalSearch {
                 throw new Error(data.message || 'Search was not successful');
             }
             
-            // Cache successful results
-            const cache = this.currentMode === 'search' ? this.searchCache : this.answerCache;
-            const cacheKey = `${query}-${this.currentLanguage}-${this.currentMode}-${this.cacheVersion}`;
-            cache.set(cacheKey, data);
-            
-            // Limit cache size
-            if (cache.size > 50) {
-                const firstKey = cache.keys().next().value;
-                cache.delete(firstKey);
-            }
+            this.cacheResult(query, data);
             
             if (this.currentMode === 'search') {
                 this.displayResults(data);
@@ -349,6 +363,206 @@ class ITTPFLegalSearch {
         }
     }
     
+    /**
+     * Cache successful results
+     * @param {string} query - Search query
+     * @param {Object} data - Response data
+     */
+    cacheResult(query, data) {
+        const cache = this.currentMode === 'search' ? this.searchCache : this.answerCache;
+        const cacheKey = `${query}-${this.currentLanguage}-${this.currentMode}-${this.cacheVersion}`;
+        cache.set(cacheKey, data);
+        
+        // Limit cache size
+        if (cache.size > 50) {
+            const firstKey = cache.keys().next().value;
+            cache.delete(firstKey);
+        }
+    }
+    
+    /**
+     * Stream an answer from /api/answer_stream (server-sent events).
+     * References are rendered as soon as they arrive and the analysis grows
+     * with every delta event.
+     * @param {string} query - Legal question
+     * @param {string} apiBase - API origin
+     * @returns {Object|null} Answer data (completed is true only when the
+     *     stream reached its done event without an error), or null if
+     *     streaming is unavailable
+     */
+    async performStreamingAnswer(query, apiBase) {
+        let response;
+        try {
+            response = await fetch(`${apiBase}/api/answer_stream`, {
+                method: 'POST',
+                headers: {
+                    'Content-Type': 'application/json',
+                },
+                body: JSON.stringify({
+                    question: query,
+                    language: this.currentLanguage === 'ar' ? 'arabic' : 'english'
+                })
+            });
+        } catch (error) {
+            console.warn('⚠️ Streaming unavailable, using JSON endpoint:', error);
+            return null;
+        }
+        
+        if (!response.ok || !response.body) {
+            return null;
+        }
+        
+        const data = { success: true, answer: '', supporting_articles: [], metadata: {} };
+        const reader = response.body.getReader();
+        const decoder = new TextDecoder('utf-8');
+        let buffer = '';
+        let answerElement = null;
+        let interrupted = false;
+        data.completed = false;
+        
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            
+            // Events are separated by a blank line
+            let boundary;
+            while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+                const rawEvent = buffer.slice(0, boundary);
+                buffer = buffer.slice(boundary + 2);
+                
+                let eventName = 'message';
+                let eventData = '';
+                rawEvent.split('\n').forEach(line => {
+                    if (line.startsWith('event:')) eventName = line.slice(6).trim();
+                    if (line.startsWith('data:')) eventData += line.slice(5).trim();
+                });
+                const payload = eventData ? JSON.parse(eventData) : {};
+                
+                if (eventName === 'references') {
+                    data.supporting_articles = payload.legal_references.map(ref => this.toSupportingArticle(ref));
+                    this.displayAnswer(data);
+                    answerElement = this.elements.resultsContainer.querySelector('.answer-text');
+                } else if (eventName === 'delta') {
+                    data.answer += payload.text;
+                    if (answerElement) {
+                        answerElement.innerHTML = this.formatAnswerContent(data.answer);
+                    }
+                } else if (eventName === 'error') {
+                    console.error('🔴 Answer stream interrupted:', payload.error);
+                    interrupted = true;
+                } else if (eventName === 'done') {
+                    data.completed = !interrupted;
+                    data.success = payload.success;
+                    data.metadata = payload.metadata || {};
+                }
+            }
+        }
+        
+        // Final render with the complete answer and metadata
+        this.displayAnswer(data);
+        return data;
+    }
+    
+    /**
+     * Ask /api/answer in speculative mode. The local answer and references
+     * are shown immediately; if the server started a DeepSeek job, its
+     * analysis replaces the local answer once the job is done.
+     * @param {string} query - Legal question
+     * @param {string} apiBase - API origin
+     */
+    async performSpeculativeAnswer(query, apiBase) {
+        const response = await fetch(`${apiBase}/api/answer`, {
+            method: 'POST',
+            headers: {
+                'Content-Type': 'application/json',
+            },
+            body: JSON.stringify({
+                question: query,
+                language: this.currentLanguage === 'ar' ? 'arabic' : 'english',
+                mode: 'speculative'
+            })
+        });
+        
+        const result = await response.json();
+        if (!response.ok || !result.success) {
+            throw new Error(result.error || 'Answer request failed');
+        }
+        
+        const data = {
+            success: true,
+            answer: result.legal_analysis,
+            supporting_articles: (result.legal_references || []).map(ref => this.toSupportingArticle(ref)),
+            metadata: result.metadata || {}
+        };
+        this.displayAnswer(data);
+        
+        if (result.job) {
+            this.pendingJobId = result.job.id;
+            // Not awaited: the search button is released while DeepSeek works
+            this.pollAnswerJob(query, apiBase, result.job.id, data);
+        } else {
+            this.pendingJobId = null;
+            this.cacheResult(query, data);
+        }
+    }
+    
+    /**
+     * Long-poll a speculative answer job and swap in the DeepSeek analysis
+     * @param {string} query - Legal question
+     * @param {string} apiBase - API origin
+     * @param {string} jobId - Job id from the speculative response
+     * @param {Object} data - Answer data currently displayed
+     */
+    async pollAnswerJob(query, apiBase, jobId, data) {
+        const language = this.currentLanguage;
+        for (let attempt = 0; attempt < 4; attempt++) {
+            let job;
+            try {
+                const response = await fetch(`${apiBase}/api/answer?job=${encodeURIComponent(jobId)}&wait=20`);
+                job = (await response.json()).job;
+            } catch (error) {
+                console.warn('⚠️ Answer job poll failed, keeping the local answer:', error);
+                return;
+            }
+            
+            // A newer question, or a language or mode switch, replaced this answer
+            if (this.pendingJobId !== jobId || this.currentLanguage !== language || this.currentMode !== 'answer') return;
+            if (!job || job.status === 'pending') continue;
+            
+            this.pendingJobId = null;
+            if (job.status === 'done' && job.result && job.result.legal_analysis) {
+                data.answer = job.result.legal_analysis;
+                data.metadata = Object.assign({}, data.metadata, { route: job.result.route, speculative: false });
+                const answerElement = this.elements.resultsContainer.querySelector('.answer-text');
+                if (answerElement) {
+                    answerElement.innerHTML = this.formatAnswerContent(data.answer);
+                }
+                this.cacheResult(query, data);
+            }
+            return;
+        }
+    }
+    
+    /**
+     * Convert a legal reference from the answer endpoints to a supporting article
+     * @param {Object} ref - Legal reference
+     * @returns {Object} Supporting article
+     */
+    toSupportingArticle(ref) {
+        const isArticle = ref.type === 'article';
+        const label = this.currentLanguage === 'ar'
+            ? `${isArticle ? 'المادة' : 'ملحق'} ${ref.number}`
+            : `${isArticle ? 'Article' : 'Appendix'} ${ref.number}`;
+        
+        return {
+            title: ref.title,
+            content: ref.content,
+            score: Math.round(ref.relevance_score * 100) / 100,
+            source: { article: label }
+        };
+    }
+    
     /**
      * Set searching state UI
      * @param {boolean} isSearching - Whether currently searching